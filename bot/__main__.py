@@ -1,16 +1,24 @@
 import os
 import sys
 import asyncio
+import argparse
 import logging
-import fcntl
 from pathlib import Path
 from dotenv import load_dotenv
 from bot.bot import create_application
 from telegram import Update
 from bot.utils.health import check_health
 from bot.utils.cleanup import setup_signal_handlers, cleanup_services
-
-LOCK_FILE = "/tmp/telegram_bot.lock"
+from bot.config import (
+    SEARCH_BACKEND,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_MAX_CONNECTIONS
+)
 
 # Add the project root directory to Python path
 project_root = str(Path(__file__).parent.parent)
@@ -26,14 +34,77 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def main():
-    """Main function to run the bot."""
+async def start_updates(application, mode, register_webhook=True):
+    """Start receiving updates by long polling or through a webhook.
+
+    Updates Telegram queued while no replica was receiving them, e.g.
+    during a restart or a failover, are kept and handled.
+
+    In webhook mode every replica serves POSTs with a WebhookServer, which
+    answers 200 as soon as the update is queued and rejects requests
+    without the matching X-Telegram-Bot-Api-Secret-Token header. Only with
+    ``register_webhook`` is the webhook registered with Telegram, allowing
+    up to WEBHOOK_MAX_CONNECTIONS concurrent connections. Returns the
+    webhook server, or None when polling.
+    """
+    if mode == 'webhook':
+        from bot.services.webhook_server import WebhookServer
+
+        server = WebhookServer(
+            application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN
+        )
+        server.start()
+        if register_webhook:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=False
+            )
+            logger.info(f"Registered the webhook {WEBHOOK_URL}")
+        logger.info(f"Listening for webhook updates on {WEBHOOK_LISTEN}:{server.port}/{WEBHOOK_PATH}")
+        return server
+    await application.updater.start_polling(
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=False
+    )
+    return None
+
+async def main(mode=BOT_MODE):
+    """Main function to run the bot.
+
+    Any number of replicas may run. In webhook mode they all serve traffic
+    and share conversation state through MongoDB. In polling mode only the
+    holder of the polling lease consumes updates; the others wait as
+    standbys and take over when it stops or loses the lease.
+    """
+    from bot.services.database import DatabaseService
+    from bot.services.coordination import LeaderLease
+    from bot.services.change_listener import CatalogChangeListener
+
     application = None
+    lease = None
+    lease_task = None
+    lease_lost = False
+    listener_task = None
+    webhook_server = None
     try:
         # Validate environment
         if not os.getenv('TELEGRAM_BOT_TOKEN_TEST'):
             logger.error("TELEGRAM_BOT_TOKEN_TEST environment variable is not set")
             return 1
+        if mode == 'webhook' and not (WEBHOOK_URL and WEBHOOK_SECRET_TOKEN):
+            logger.error("Webhook mode requires WEBHOOK_URL and WEBHOOK_SECRET_TOKEN")
+            return 1
+
+        stop_event = asyncio.Event()
+        
+        def signal_handler():
+            stop_event.set()
+            
+        # Setup signal handlers
+        setup_signal_handlers(signal_handler)
 
         # Check services health
         logger.info("Performing health check...")
@@ -41,32 +112,61 @@ async def main():
             logger.error("Health check failed. Exiting...")
             return 1
 
-        # Create and configure the application
-        application = await create_application()
+        # Make sure the indexes the queries rely on exist
+        db = DatabaseService()
+        await db.ensure_indexes()
+
+        if mode == 'polling':
+            # Telegram allows one long-polling consumer per token
+            lease = LeaderLease('polling')
+            logger.info("Waiting to become the polling leader...")
+            if not await lease.acquire(stop_event):
+                return 0
+
+            def on_lease_lost():
+                nonlocal lease_lost
+                lease_lost = True
+                stop_event.set()
+
+            lease_task = asyncio.create_task(lease.keep_alive(on_lease_lost))
+        else:
+            # Every replica serves the webhook, but only the holder of this
+            # lease registers it, so a scale-up does not re-register it
+            lease = LeaderLease('webhook')
+            try:
+                await lease.try_acquire()
+            except Exception as e:
+                logger.warning(f"Failed to acquire the webhook lease: {e}")
+            if lease.held:
+                # Losing it later only means another replica may register
+                lease_task = asyncio.create_task(lease.keep_alive(lambda: None))
+
+        # Drop cached catalog data as soon as another process changes it
+        listener_task = asyncio.create_task(CatalogChangeListener().run(stop_event))
+
+        if SEARCH_BACKEND == 'fuzzy':
+            await db.rebuild_search_index()
+
+        # Create and configure the application. It is built only once this
+        # replica may serve, so the conversation states it loads are current.
+        application = await create_application(
+            shared_state=(mode == 'webhook'),
+            sync_catalog=False
+        )
         
         logger.info("Bot started successfully!")
         
         # Run the bot until it's stopped
         await application.initialize()
         await application.start()
-        await application.updater.start_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
+        webhook_server = await start_updates(
+            application, mode, register_webhook=mode == 'webhook' and lease.held
         )
         
-        # Keep the bot running
-        stop_event = asyncio.Event()
-        
-        def signal_handler():
-            stop_event.set()
-            
-        # Setup signal handlers
-        setup_signal_handlers(signal_handler)
-        
         # Wait for stop signal
         await stop_event.wait()
         
-        return 0
+        return 1 if lease_lost else 0
         
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
@@ -76,6 +176,8 @@ async def main():
         return 1
     finally:
         try:
+            if webhook_server:
+                await webhook_server.stop()
             if application:
                 if application.updater.running:
                     await application.updater.stop()
@@ -84,26 +186,102 @@ async def main():
                 await application.shutdown()
         except Exception as e:
             logger.error(f"Error during cleanup: {e}", exc_info=True)
+        if lease_task:
+            lease_task.cancel()
+        if listener_task:
+            # Let it save its resume token
+            stop_event.set()
+            try:
+                await asyncio.wait_for(listener_task, timeout=5)
+            except Exception as e:
+                logger.warning(f"Catalog change listener did not stop cleanly: {e}")
+        if lease:
+            await lease.release()
+        cleanup_services()
+
+async def check_indexes():
+    """Print the state of every MongoDB index and fail if any is missing."""
+    from bot.services.database import DatabaseService
+
+    try:
+        report = await DatabaseService().check_indexes()
+    finally:
+        cleanup_services()
+
+    for index in report:
+        ops = 'n/a' if index['ops'] is None else index['ops']
+        print(f"{index['collection']}.{index['name']}: {index['status']} (ops: {ops})")
+    return 1 if any(index['status'] == 'missing' for index in report) else 0
+
+async def reconcile_stats():
+    """Recompute the materialized store statistics and print any drift."""
+    from bot.services.database import DatabaseService
+
+    try:
+        drift = await DatabaseService().reconcile_statistics()
+    finally:
+        cleanup_services()
+
+    if not drift:
+        print("Store statistics are up to date")
+    for field, (stored, actual) in sorted(drift.items()):
+        print(f"{field}: stored {stored}, actual {actual}")
+    return 0
+
+async def backfill_photos():
+    """Create the missing derivatives of every stored photo."""
+    from bot.services.database import DatabaseService
+    from bot.services.photos import PhotoService
+
+    try:
+        done, failed = await PhotoService().backfill_catalog(DatabaseService())
+    finally:
         cleanup_services()
 
+    print(f"Created derivatives of {done} photos, {failed} failed")
+    return 1 if failed else 0
+
+def parse_args(argv=None):
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(prog='python -m bot', description='Sunny Store Shop bot')
+    parser.add_argument(
+        '--mode',
+        choices=['polling', 'webhook'],
+        default=BOT_MODE,
+        help='how to receive updates (default: BOT_MODE, currently %(default)s)'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser(
+        'check-indexes',
+        help='report missing, unused and building MongoDB indexes'
+    )
+    subparsers.add_parser(
+        'reconcile-stats',
+        help='recompute the store statistics and report drift'
+    )
+    subparsers.add_parser(
+        'backfill-photos',
+        help='create the thumbnail and web copies of stored photos'
+    )
+    return parser.parse_args(argv)
+
 def run():
     """Run the bot."""
-    lock_file = None
+    args = parse_args()
+    if args.command == 'check-indexes':
+        sys.exit(asyncio.run(check_indexes()))
+    if args.command == 'reconcile-stats':
+        sys.exit(asyncio.run(reconcile_stats()))
+    if args.command == 'backfill-photos':
+        sys.exit(asyncio.run(backfill_photos()))
+
     try:
-        # Try to acquire lock file
-        lock_file = open(LOCK_FILE, 'w')
-        try:
-            fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError:
-            logger.error("Another instance is already running")
-            sys.exit(1)
-            
         # Create new event loop
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         
         # Run the main function
-        exit_code = loop.run_until_complete(main())
+        exit_code = loop.run_until_complete(main(args.mode))
         
         # Clean up
         loop.close()
@@ -115,14 +293,6 @@ def run():
     except Exception as e:
         logger.error(f"Bot stopped due to error: {e}", exc_info=True)
         sys.exit(1)
-    finally:
-        if lock_file:
-            try:
-                fcntl.lockf(lock_file, fcntl.LOCK_UN)
-                lock_file.close()
-                os.unlink(LOCK_FILE)
-            except Exception as e:
-                logger.error(f"Error cleaning up lock file: {e}")
 
 if __name__ == '__main__':
     run()
\ No newline at end of file
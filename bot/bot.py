@@ -1,4 +1,5 @@
 import logging
+from functools import partial
 from telegram import BotCommand, MenuButtonCommands, Update
 from telegram.ext import (
     ApplicationBuilder,
@@ -7,10 +8,11 @@ from telegram.ext import (
     ConversationHandler,
     CallbackQueryHandler,
     ContextTypes,
+    TypeHandler,
     filters
 )
 
-from bot.config import BOT_TOKEN, BOT_COMMANDS
+from bot.config import BOT_COMMANDS, MAX_CONCURRENT_UPDATES
 from bot.handlers.base import BaseHandler
 from bot.handlers.add_item import AddItemHandler
 from bot.handlers.change_item import ChangeItemHandler
@@ -18,6 +20,11 @@ from bot.handlers.delete_item import DeleteItemHandler
 from bot.handlers.list_items import ListItemsHandler
 from bot.handlers.search import SearchHandler
 from bot.handlers.stats import StatsHandler
+from bot.handlers.metrics import MetricsHandler
+from bot.services.persistence import MongoPersistence
+from bot.services.send_scheduler import SendScheduler
+from bot.services.update_processor import KeyedUpdateProcessor
+from bot.utils.circuit_breaker import CircuitOpenError
 
 # Configure logging
 logging.basicConfig(
@@ -26,8 +33,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def create_application():
-    """Create and configure the application."""
+async def create_application(register_commands=True, shared_state=False, sync_catalog=True):
+    """Create and configure the application.
+
+    With register_commands=False the command list and menu button are not
+    sent to Telegram, saving two API calls where the application is built
+    often, e.g. on every Lambda cold start. shared_state=True is for
+    replicas serving the same bot side by side: state is loaded from and
+    written to MongoDB around every update. Pass sync_catalog=False where
+    a CatalogChangeListener runs, so shared state does not also check the
+    catalog generation.
+    """
+    from bot.config import BOT_TOKEN
+
+    processor = KeyedUpdateProcessor(MAX_CONCURRENT_UPDATES)
     # Create application with proper token and settings
     application = (
         ApplicationBuilder()
@@ -36,6 +55,9 @@ async def create_application():
         .write_timeout(30)
         .connect_timeout(30)
         .pool_timeout(30)
+        .persistence(MongoPersistence(shared=shared_state, sync_catalog=sync_catalog))
+        .concurrent_updates(processor)
+        .rate_limiter(SendScheduler())
         .build()
     )
 
@@ -49,6 +71,15 @@ async def create_application():
     list_handler = ListItemsHandler()
     search_handler = SearchHandler()
     stats_handler = StatsHandler()
+    metrics_handler = MetricsHandler()
+
+    if shared_state:
+        # Runs before all other handlers of an update
+        application.add_handler(TypeHandler(Update, load_shared_state), group=-1)
+        # PTB marks an update's user_data for persistence only once
+        # process_update has run every handler group, so the state is saved
+        # after that rather than by a last handler
+        processor.after_update = partial(save_shared_state, application)
 
     # Add handlers in order of priority (group 0)
     application.add_handler(CommandHandler('start', start))
@@ -62,7 +93,9 @@ async def create_application():
     application.add_handler(CommandHandler('list', list_handler.handle_command))
     application.add_handler(CallbackQueryHandler(list_handler.list_items, pattern='^list_'))
     application.add_handler(CommandHandler('search', search_handler.handle_command))
+    application.add_handler(CommandHandler('reindex', search_handler.handle_reindex))
     application.add_handler(CommandHandler('stats', stats_handler.handle_command))
+    application.add_handler(CommandHandler('metrics', metrics_handler.handle_command))
     
     # Add global cancel command (group 1)
     application.add_handler(
@@ -73,18 +106,19 @@ async def create_application():
     # Add fallback handler for unknown commands (group 2)
     application.add_handler(
         MessageHandler(
-            filters.COMMAND & ~filters.Regex('^/(start|add|change|delete|list|search|stats|cancel)$'),
+            filters.COMMAND & ~filters.Regex('^/(start|add|change|delete|list|search|stats|reindex|metrics|cancel)$'),
             unknown_command
         ),
         group=2
     )
 
-    # Set bot commands
-    commands = [BotCommand(command, description) for command, description in BOT_COMMANDS]
-    await application.bot.set_my_commands(commands)
+    if register_commands:
+        # Set bot commands
+        commands = [BotCommand(command, description) for command, description in BOT_COMMANDS]
+        await application.bot.set_my_commands(commands)
 
-    # Set the Menu Button to display commands
-    await application.bot.set_chat_menu_button(menu_button=MenuButtonCommands())
+        # Set the Menu Button to display commands
+        await application.bot.set_chat_menu_button(menu_button=MenuButtonCommands())
 
     return application
 
@@ -99,13 +133,29 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Available commands:\n{commands_text}"
     )
 
+async def load_shared_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Load the state other replicas may have changed."""
+    await context.application.persistence.load_shared_state(context.application, update)
+
+async def save_shared_state(application, update):
+    """Make the state changed by a processed update visible to other replicas."""
+    await application.persistence.save_shared_state(application)
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log errors."""
-    logger.error(f"Update {update} caused error {context.error}", exc_info=context.error)
-    if update and update.effective_message:
-        await update.effective_message.reply_text(
-            "Sorry, an error occurred while processing your request."
+    if isinstance(context.error, CircuitOpenError):
+        # Already logged when the circuit opened
+        logger.warning(f"Update {update} refused: {context.error}")
+        message = (
+            f"The store is read-only right now because {context.error.service} is unavailable. "
+            "Changes cannot be saved; /list, /search and /stats show the last known data. "
+            "Please try again in a few minutes."
         )
+    else:
+        logger.error(f"Update {update} caused error {context.error}", exc_info=context.error)
+        message = "Sorry, an error occurred while processing your request."
+    if update and update.effective_message:
+        await update.effective_message.reply_text(message)
 
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle unknown commands."""
@@ -118,5 +168,5 @@ async def run_polling():
     application = await create_application()
     await application.run_polling(
         allowed_updates=Update.ALL_TYPES,
-        drop_pending_updates=True
+        drop_pending_updates=False
     )
\ No newline at end of file
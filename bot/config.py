@@ -1,7 +1,10 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+# Lambda passes configuration as real environment variables; elsewhere they
+# may come from a .env file.
+if not os.getenv('AWS_LAMBDA_FUNCTION_NAME'):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 def get_required_env(name: str, default=None) -> str:
     value = os.getenv(name)
@@ -9,25 +12,107 @@ def get_required_env(name: str, default=None) -> str:
         raise ValueError(f"Missing required environment variable: {name}")
     return value or default
 
+# Settings without a default, read on first access so that importing this
+# module never fails and commands that do not need them still start.
+REQUIRED_SETTINGS = {
+    'BOT_TOKEN': 'TELEGRAM_BOT_TOKEN_TEST',
+    'MONGODB_CONNECTION_STRING': 'MONGODB_CONN_STRING',
+    'AWS_ACCESS_KEY': 'AWS_ACCESS_KEY',
+    'AWS_SECRET_KEY': 'AWS_SECRET_KEY',
+    'AWS_REGION': 'AWS_REGION',
+    'S3_BUCKET_NAME': 'S3_BUCKET_NAME',
+}
+
+def __getattr__(name):
+    if name in REQUIRED_SETTINGS:
+        value = get_required_env(REQUIRED_SETTINGS[name])
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Bot Configuration
-BOT_TOKEN = get_required_env('TELEGRAM_BOT_TOKEN_TEST')
 ITEMS_PER_PAGE = int(get_required_env('ITEMS_PER_PAGE', '5'))
+# Updates handled at once; updates from the same user still run in order
+MAX_CONCURRENT_UPDATES = int(get_required_env('MAX_CONCURRENT_UPDATES', '16'))
+ITEMS_COUNT_TTL = int(get_required_env('ITEMS_COUNT_TTL', '30'))
+RESULT_CACHE_SIZE = int(get_required_env('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_TTL = int(get_required_env('RESULT_CACHE_TTL', '30'))
+# Item documents cached by code for /change, /delete and code checks
+ITEM_CACHE_SIZE = int(get_required_env('ITEM_CACHE_SIZE', '1000'))
+ITEM_CACHE_TTL = int(get_required_env('ITEM_CACHE_TTL', '300'))
+# Rendered item captions kept, one per item revision
+CARD_CACHE_SIZE = int(get_required_env('CARD_CACHE_SIZE', '2000'))
+# 'mongo' for the text index, 'fuzzy' for the in-memory typo-tolerant index
+SEARCH_BACKEND = get_required_env('SEARCH_BACKEND', 'mongo')
+
+# Outgoing message limits in messages per second (Telegram allows about 30
+# overall, 1 per private chat and 20 per minute per group)
+SEND_RATE_GLOBAL = float(get_required_env('SEND_RATE_GLOBAL', '30'))
+SEND_RATE_CHAT = float(get_required_env('SEND_RATE_CHAT', '1'))
+SEND_RATE_GROUP = float(get_required_env('SEND_RATE_GROUP', '0.33'))
+# Messages a chat may receive at once before the per-chat rate applies
+SEND_BURST_CHAT = int(get_required_env('SEND_BURST_CHAT', '3'))
+# Resends after Telegram answers with RetryAfter
+SEND_MAX_RETRIES = int(get_required_env('SEND_MAX_RETRIES', '3'))
+
+# Update delivery: 'polling' or 'webhook'
+BOT_MODE = get_required_env('BOT_MODE', 'polling')
+# Public HTTPS URL Telegram posts updates to, e.g. https://bot.example.com/telegram
+WEBHOOK_URL = get_required_env('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = get_required_env('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(get_required_env('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = get_required_env('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET_TOKEN = get_required_env('WEBHOOK_SECRET_TOKEN', '')
+WEBHOOK_MAX_CONNECTIONS = int(get_required_env('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Seconds a polling leader holds its lease without renewing it
+LEASE_TTL = int(get_required_env('LEASE_TTL', '30'))
+# How often a replica checks whether another one changed the catalog
+CATALOG_SYNC_INTERVAL = float(get_required_env('CATALOG_SYNC_INTERVAL', '2'))
+
+# Retries of failed MongoDB and S3 calls wait a random time of up to
+# RETRY_BASE_DELAY * 2**n seconds, capped at RETRY_MAX_DELAY
+RETRY_BASE_DELAY = float(get_required_env('RETRY_BASE_DELAY', '0.1'))
+RETRY_MAX_DELAY = float(get_required_env('RETRY_MAX_DELAY', '2'))
+# Consecutive failed MongoDB or S3 calls after which calls fail at once, and
+# the seconds until one call is let through to probe for recovery
+CIRCUIT_FAILURE_THRESHOLD = int(get_required_env('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(get_required_env('CIRCUIT_RESET_TIMEOUT', '30'))
 
 # MongoDB Configuration
-MONGODB_CONNECTION_STRING = get_required_env('MONGODB_CONN_STRING')
 DB_NAME = get_required_env('DB_NAME', 'clothing_store')
 CLOTHES_COLLECTION = get_required_env('CLOTHES_COLLECTION', 'clothes')
 COUNTERS_COLLECTION = get_required_env('COUNTERS_COLLECTION', 'counters')
 MONGODB_TIMEOUT_MS = int(get_required_env('MONGODB_TIMEOUT_MS', '5000'))
 MONGODB_MAX_RETRIES = int(get_required_env('MONGODB_MAX_RETRIES', '3'))
+MONGODB_POOL_SIZE = int(get_required_env('MONGODB_POOL_SIZE', '10'))
+# Seconds after which a failing MongoDB operation is no longer retried
+MONGODB_RETRY_DEADLINE = float(get_required_env('MONGODB_RETRY_DEADLINE', '15'))
+USER_DATA_COLLECTION = get_required_env('USER_DATA_COLLECTION', 'user_data')
+CONVERSATIONS_COLLECTION = get_required_env('CONVERSATIONS_COLLECTION', 'conversations')
+LEASES_COLLECTION = get_required_env('LEASES_COLLECTION', 'leases')
+# Seconds between conversation state snapshots, and the quiet period before
+# buffered snapshots are written
+PERSISTENCE_UPDATE_INTERVAL = float(get_required_env('PERSISTENCE_UPDATE_INTERVAL', '5'))
+PERSISTENCE_FLUSH_DELAY = float(get_required_env('PERSISTENCE_FLUSH_DELAY', '1'))
+# Auto-generated codes reserved per counter round trip; unused ones are skipped on restart
+CODE_BLOCK_SIZE = int(get_required_env('CODE_BLOCK_SIZE', '100'))
 
 # AWS Configuration
-AWS_ACCESS_KEY = get_required_env('AWS_ACCESS_KEY')
-AWS_SECRET_KEY = get_required_env('AWS_SECRET_KEY')
-AWS_REGION = get_required_env('AWS_REGION')
-S3_BUCKET_NAME = get_required_env('S3_BUCKET_NAME')
 AWS_TIMEOUT = int(get_required_env('AWS_TIMEOUT', '30'))
 AWS_MAX_RETRIES = int(get_required_env('AWS_MAX_RETRIES', '3'))
+AWS_RETRY_DEADLINE = float(get_required_env('AWS_RETRY_DEADLINE', '30'))
+S3_MAX_CONCURRENCY = int(get_required_env('S3_MAX_CONCURRENCY', '8'))
+S3_SPOOL_MAX_BYTES = int(get_required_env('S3_SPOOL_MAX_BYTES', '1048576'))
+
+# Photo derivatives: longest side in pixels of the thumbnail and web copies
+PHOTO_THUMB_SIZE = int(get_required_env('PHOTO_THUMB_SIZE', '640'))
+PHOTO_WEB_SIZE = int(get_required_env('PHOTO_WEB_SIZE', '1280'))
+PHOTO_JPEG_QUALITY = int(get_required_env('PHOTO_JPEG_QUALITY', '82'))
+# Web copies are recompressed at lower quality until they fit
+PHOTO_MAX_BYTES = int(get_required_env('PHOTO_MAX_BYTES', '307200'))
+# Larger images are refused rather than decoded
+PHOTO_MAX_PIXELS = int(get_required_env('PHOTO_MAX_PIXELS', '40000000'))
+PHOTO_WORKERS = int(get_required_env('PHOTO_WORKERS', '2'))
 
 # Bot Commands
 BOT_COMMANDS = [
@@ -38,6 +123,8 @@ BOT_COMMANDS = [
     ('list', 'List all items'),
     ('search', 'Search for items'),
     ('stats', 'Show store statistics'),
+    ('reindex', 'Rebuild the fuzzy search index'),
+    ('metrics', 'Show cache and performance metrics'),
     ('cancel', 'Cancel the current operation'),
 ]
 
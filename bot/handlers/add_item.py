@@ -150,9 +150,12 @@ class AddItemHandler(BaseHandler):
                     # Download photo
                     await photo_file.download_to_drive(temp_path)
                     
-                    # Upload to S3
-                    self.storage.upload_file(temp_path, unique_filename)
+                    # Upload to S3 with its thumbnail and web copies
+                    derivatives = await self.photos.store(temp_path, unique_filename)
                     context.user_data['new_item']['photo_key'] = unique_filename
+                    context.user_data['new_item']['photo_derivatives'] = derivatives
+                    # Telegram already hosts this photo; reuse its file_id when showing the item
+                    context.user_data['new_item']['photo_file_id'] = update.message.photo[-1].file_id
                     
                     logger.info(f"Successfully uploaded photo {unique_filename}")
                     
@@ -203,7 +206,7 @@ class AddItemHandler(BaseHandler):
             return STATES['ADD_COLOR']
         else:
             # No parameters, add item directly
-            self.db.add_item(context.user_data['new_item'])
+            await self.db.add_item(context.user_data['new_item'])
             await query.edit_message_text(
                 f"Item added successfully!"
             )
@@ -241,7 +244,7 @@ class AddItemHandler(BaseHandler):
 
         if choice == 'auto_color_code':
             # Auto-generate code
-            code = self.db.get_next_code()
+            code = await self.db.get_next_code()
             context.user_data['current_param']['code'] = code
             await query.edit_message_text(
                 f"Generated code for color '{context.user_data['current_param']['color']}': {code}\n\n"
@@ -269,7 +272,7 @@ class AddItemHandler(BaseHandler):
             return STATES['ADD_COLOR_CODE_MANUAL']
 
         # Check if code already exists
-        existing_item = self.db.get_item(code)
+        existing_item = await self.db.get_item(code)
         if existing_item:
             await update.message.reply_text(
                 f"Code {code} is already in use. Please enter a different code:",
@@ -297,9 +300,11 @@ class AddItemHandler(BaseHandler):
                     # Download photo
                     await photo_file.download_to_drive(temp_path)
                     
-                    # Upload to S3
-                    self.storage.upload_file(temp_path, unique_filename)
+                    # Upload to S3 with its thumbnail and web copies
+                    derivatives = await self.photos.store(temp_path, unique_filename)
                     context.user_data['current_param']['photo_key'] = unique_filename
+                    context.user_data['current_param']['photo_derivatives'] = derivatives
+                    context.user_data['current_param']['photo_file_id'] = update.message.photo[-1].file_id
                     
                     logger.info(f"Successfully uploaded color photo {unique_filename}")
                     
@@ -477,7 +482,8 @@ class AddItemHandler(BaseHandler):
                 CommandHandler('cancel', self.cancel),
                 CallbackQueryHandler(self.cancel, pattern='^cancel$'),
             ],
-            name='add_item_conversation'  # Add a name for better logging
+            name='add_item_conversation',  # Add a name for better logging
+            persistent=True
         )
         self.logger.info("Add item conversation handler created")
         return handler
\ No newline at end of file
@@ -1,38 +1,260 @@
+import asyncio
 import logging
-from telegram import Update
+from telegram import InputMediaPhoto, Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
-from bot.services.database import DatabaseService
-from bot.services.storage import StorageService
+from bot.config import PHOTO_THUMB_SIZE, PHOTO_WEB_SIZE
+from bot.models import Item
+from bot.services.photos import select_photo_key
+from bot.services.send_scheduler import BULK, INTERACTIVE
+from bot.utils.formatters import format_item_caption
+
+# Telegram limits: photos per album and characters per text message
+MEDIA_GROUP_LIMIT = 10
+MESSAGE_LIMIT = 4096
+
+def is_file_id_rejected(error):
+    """Whether a BadRequest says a file_id we sent is not valid (any more)."""
+    # e.g. "Wrong file identifier/http url specified" or
+    # "Wrong remote file identifier specified: ..."
+    message = error.message.lower()
+    return 'file identifier' in message or 'file_id' in message
 
 class BaseHandler:
     def __init__(self):
-        self.db = DatabaseService()
-        self.storage = StorageService()
+        self._db = None
+        self._storage = None
+        self._photos = None
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    # The services, and pymongo/boto3 with them, are imported and created on
+    # first use, so building the handlers costs no imports or connections.
+    @property
+    def db(self):
+        if self._db is None:
+            from bot.services.database import DatabaseService
+            self._db = DatabaseService()
+        return self._db
+
+    @db.setter
+    def db(self, value):
+        self._db = value
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            from bot.services.storage import StorageService
+            self._storage = StorageService()
+        return self._storage
+
+    @storage.setter
+    def storage(self, value):
+        self._storage = value
+
+    @property
+    def photos(self):
+        if self._photos is None:
+            from bot.services.photos import PhotoService
+            self._photos = PhotoService()
+        return self._photos
+
+    @photos.setter
+    def photos(self, value):
+        self._photos = value
+
+    async def send_item(self, context: ContextTypes.DEFAULT_TYPE, chat_id, item):
+        """Send a single item card for an Item."""
+        await self.send_items(context, chat_id, [item], priority=INTERACTIVE)
+
+    async def send_items(self, context: ContextTypes.DEFAULT_TYPE, chat_id, items,
+                         text=None, reply_markup=None, priority=BULK):
+        """Send cards for Items in as few messages as possible.
+
+        Items with photos go out as albums of up to MEDIA_GROUP_LIMIT photos
+        with their captions attached. Cards without a photo are joined with
+        ``text`` into trailing text messages, the last of which carries
+        ``reply_markup``. Photos are sent by cached Telegram file_id; the
+        rest are downloaded from S3 concurrently before the send, as the
+        smallest stored copy that suits the message, and their new file_ids
+        are stored for the next view. The messages are queued
+        with ``priority`` (see SendScheduler), so pages of cards give way to
+        conversation replies.
+        """
+        photo_items = [item for item in items if item.photo_key]
+        text_items = [item for item in items if not item.photo_key]
+
+        for start in range(0, len(photo_items), MEDIA_GROUP_LIMIT):
+            group = photo_items[start:start + MEDIA_GROUP_LIMIT]
+            text_items.extend(await self.send_photo_group(context, chat_id, group, priority))
+
+        texts = [format_item_caption(item) for item in text_items]
+        if text:
+            texts.append(text)
+        await self.send_text_chunks(
+            context, chat_id, texts, reply_markup=reply_markup, priority=priority
+        )
+
+    async def send_photo_group(self, context: ContextTypes.DEFAULT_TYPE, chat_id, items,
+                               priority=INTERACTIVE):
+        """Send items with photos as one album and return the items left unsent."""
+        # Albums show small tiles; a single card is shown large
+        size = PHOTO_WEB_SIZE if len(items) == 1 else PHOTO_THUMB_SIZE
+        file_ids = {id(item): getattr(item, self.file_id_field(item, size)) for item in items}
+        # Items without a cached file_id have to be uploaded from S3
+        streams = await self.fetch_photos(
+            [item for item in items if not file_ids[id(item)]], size
+        )
+        sendable = [
+            item for item in items
+            if file_ids[id(item)] or id(item) in streams
+        ]
+        try:
+            try:
+                messages = await self._send_photos(
+                    context, chat_id, sendable, streams, file_ids, priority
+                )
+            except BadRequest as e:
+                cached = [item for item in sendable if id(item) not in streams]
+                # Other errors, e.g. a caption Telegram cannot parse, would
+                # only fail again after the downloads
+                if not cached or not is_file_id_rejected(e):
+                    raise
+                # A cached file_id was rejected; resend everything from S3
+                self.logger.warning(f"Cached file_id rejected, re-uploading photos: {e}")
+                streams.update(await self.fetch_photos(cached, size))
+                sendable = [item for item in sendable if id(item) in streams]
+                messages = await self._send_photos(
+                    context, chat_id, sendable, streams, file_ids, priority
+                )
+        except Exception as e:
+            self.logger.error(f"Error sending photos: {e}")
+            return items
+        finally:
+            for stream in streams.values():
+                stream.close()
+
+        await asyncio.gather(*(
+            self.remember_file_id(item, message, self.file_id_field(item, size))
+            for item, message in zip(sendable, messages)
+            if id(item) in streams
+        ))
+        sent = {id(item) for item in sendable}
+        return [item for item in items if id(item) not in sent]
+
+    @staticmethod
+    def photo_key_for(item, size):
+        """Key of the smallest stored copy of an item photo at least ``size`` pixels wide."""
+        return select_photo_key(item.photo_key, item.photo_derivatives, size)
+
+    @classmethod
+    def file_id_field(cls, item, size):
+        """Item field caching the file_id of the copy sent at ``size``.
+
+        photo_file_id is the full-size copy; a smaller copy sent in albums
+        has its own photo_thumb_file_id.
+        """
+        if cls.photo_key_for(item, size) == cls.photo_key_for(item, PHOTO_WEB_SIZE):
+            return 'photo_file_id'
+        return 'photo_thumb_file_id'
+
+    async def fetch_photos(self, items, size=PHOTO_WEB_SIZE):
+        """Download the photos of several items from S3 concurrently.
+
+        Each photo is fetched as its smallest stored copy at least ``size``
+        pixels wide. Returns a dict mapping id(item) to an open stream; items
+        whose photo could not be downloaded are left out.
+        """
+        if not items:
+            return {}
+        keys = [self.photo_key_for(item, size) for item in items]
+        results = await self.storage.get_files(keys)
+        streams = {}
+        for item, key, result in zip(items, keys, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Error getting photo {key}: {result}")
+            else:
+                streams[id(item)] = result
+        return streams
+
+    async def _send_photos(self, context, chat_id, items, streams, file_ids, priority):
+        if not items:
+            return []
+        media = []
+        for item in items:
+            stream = streams.get(id(item))
+            if stream:
+                stream.seek(0)
+            media.append(stream if stream is not None else file_ids[id(item)])
+
+        if len(items) == 1:
+            message = await context.bot.send_photo(
+                chat_id=chat_id,
+                photo=media[0],
+                caption=format_item_caption(items[0]),
+                parse_mode='Markdown',
+                rate_limit_args={'priority': priority}
+            )
+            return [message]
+
+        return await context.bot.send_media_group(
+            chat_id=chat_id,
+            media=[
+                InputMediaPhoto(
+                    media=photo,
+                    caption=format_item_caption(item),
+                    parse_mode='Markdown'
+                )
+                for item, photo in zip(items, media)
+            ],
+            rate_limit_args={'priority': priority}
+        )
+
+    async def send_text_chunks(self, context: ContextTypes.DEFAULT_TYPE, chat_id, texts,
+                               reply_markup=None, priority=INTERACTIVE):
+        """Join texts into as few messages as the message size limit allows."""
+        chunks = []
+        for text in texts:
+            if chunks and len(chunks[-1]) + len(text) + 1 <= MESSAGE_LIMIT:
+                chunks[-1] += '\n' + text
+            else:
+                chunks.append(text)
+
+        for index, chunk in enumerate(chunks):
+            is_last = index == len(chunks) - 1
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text=chunk,
+                parse_mode='Markdown',
+                reply_markup=reply_markup if is_last else None,
+                rate_limit_args={'priority': priority}
+            )
+
+    async def remember_file_id(self, item, message, field='photo_file_id'):
+        """Store the file_id Telegram assigned to an uploaded item photo in ``field``."""
+        if not message or not message.photo or item.id is None:
+            return
+        file_id = message.photo[-1].file_id
+        try:
+            await self.db.set_photo_file_id(item.id, field, file_id)
+            # Also updates the copy in the result cache
+            setattr(item, field, file_id)
+        except Exception as e:
+            self.logger.error(f"Error saving file_id for photo {item.photo_key}: {e}")
+
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Cancel the current operation and clean up."""
         try:
             # Clean up any temporary data
             if 'new_item' in context.user_data:
-                # If there's a photo key, try to delete it from S3
-                photo_key = context.user_data['new_item'].get('photo_key')
-                if photo_key:
+                # Delete the item and param photos and their derivatives from
+                # S3 in one batch
+                photo_keys = Item.from_bson(context.user_data['new_item']).photo_keys
+                if photo_keys:
                     try:
-                        self.storage.delete_file(photo_key)
-                        self.logger.info(f"Deleted photo {photo_key} from S3")
+                        await self.storage.delete_files(photo_keys)
+                        self.logger.info(f"Deleted photos {photo_keys} from S3")
                     except Exception as e:
-                        self.logger.error(f"Error deleting photo {photo_key}: {e}")
-
-                # If there are params with photos, delete those too
-                for param in context.user_data['new_item'].get('params', []):
-                    param_photo = param.get('photo_key')
-                    if param_photo:
-                        try:
-                            self.storage.delete_file(param_photo)
-                            self.logger.info(f"Deleted param photo {param_photo} from S3")
-                        except Exception as e:
-                            self.logger.error(f"Error deleting param photo {param_photo}: {e}")
+                        self.logger.error(f"Error deleting photos {photo_keys}: {e}")
 
             # Clean up user data
             context.user_data.clear()
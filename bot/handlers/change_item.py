@@ -1,5 +1,6 @@
 import uuid
 import os
+import logging
 from telegram import Update
 from telegram.ext import (
     ContextTypes,
@@ -12,12 +13,16 @@ from telegram.ext import (
 from bot.utils.conversation import create_conversation_handler
 
 from bot.handlers.base import BaseHandler
+from bot.models import Item
+from bot.models.item import derivative_key
 from bot.utils.states import STATES
 from bot.utils.keyboards import (
     get_cancel_keyboard,
     get_field_keyboard,
 )
 
+logger = logging.getLogger(__name__)
+
 class ChangeItemHandler(BaseHandler):
     """Handler for changing existing items."""
 
@@ -34,12 +39,13 @@ class ChangeItemHandler(BaseHandler):
     async def handle_choice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle item code input."""
         item_code = update.message.text.strip()
-        item = self.db.get_item(item_code)
+        item = await self.db.get_item(item_code)
 
         if item:
-            context.user_data['edit_item'] = item
+            # user_data is stored in MongoDB, so keep the small document form
+            context.user_data['edit_item'] = item.to_bson()
             await update.message.reply_text(
-                f"Item found: {item.get('name', 'N/A')}\n"
+                f"Item found: {item.name or 'N/A'}\n"
                 "What do you want to change?",
                 reply_markup=get_field_keyboard(self.EDITABLE_FIELDS)
             )
@@ -81,7 +87,7 @@ class ChangeItemHandler(BaseHandler):
         """Handle field update."""
         try:
             field = context.user_data.get('edit_field')
-            item = context.user_data.get('edit_item')
+            item = Item.from_bson(context.user_data.get('edit_item'))
             
             if not field or not item:
                 await update.message.reply_text(
@@ -90,7 +96,7 @@ class ChangeItemHandler(BaseHandler):
                 )
                 return ConversationHandler.END
                 
-            item_id = item['_id']
+            item_id = item.id
 
             if field in ['name', 'description']:
                 value = update.message.text.strip()
@@ -101,7 +107,7 @@ class ChangeItemHandler(BaseHandler):
                     )
                     return STATES['CHANGE_UPDATE']
                     
-                self.db.update_item(item_id, {field: value})
+                await self.db.update_item(item_id, {field: value})
                 await update.message.reply_text(f"{field.capitalize()} updated successfully!")
                 return ConversationHandler.END
 
@@ -111,7 +117,7 @@ class ChangeItemHandler(BaseHandler):
                     if value < 0:
                         raise ValueError("Price cannot be negative")
                         
-                    self.db.update_item(item_id, {field: value})
+                    await self.db.update_item(item_id, {field: value})
                     await update.message.reply_text(f"{field.capitalize()} updated successfully!")
                     return ConversationHandler.END
                     
@@ -133,19 +139,28 @@ class ChangeItemHandler(BaseHandler):
                             # Download photo
                             await photo_file.download_to_drive(temp_path)
                             
-                            # Upload to S3
-                            self.storage.upload_file(temp_path, unique_filename)
+                            # Upload to S3 with its thumbnail and web copies
+                            derivatives = await self.photos.store(temp_path, unique_filename)
                             
-                            # Delete old photo if exists
-                            old_photo = item.get('photo_key')
+                            # Delete old photo and its derivatives if it exists
+                            old_photo = item.photo_key
                             if old_photo:
+                                old_keys = [old_photo] + [
+                                    derivative_key(old_photo, name) for name in item.photo_derivatives
+                                ]
                                 try:
-                                    self.storage.delete_file(old_photo)
+                                    await self.storage.delete_files(old_keys)
                                 except Exception as e:
                                     logger.warning(f"Failed to delete old photo {old_photo}: {e}")
                             
                             # Update database
-                            self.db.update_item(item_id, {'photo_key': unique_filename})
+                            await self.db.update_item(item_id, {
+                                'photo_key': unique_filename,
+                                'photo_file_id': update.message.photo[-1].file_id,
+                                # Made from the old photo
+                                'photo_thumb_file_id': None,
+                                'photo_derivatives': derivatives
+                            })
                             await update.message.reply_text("Photo updated successfully!")
                             return ConversationHandler.END
                             
@@ -206,5 +221,7 @@ class ChangeItemHandler(BaseHandler):
             fallbacks=[
                 CommandHandler('cancel', self.cancel),
                 CallbackQueryHandler(self.cancel, pattern='^cancel$'),
-            ]
+            ],
+            name='change_item_conversation',
+            persistent=True
         )
\ No newline at end of file
@@ -5,11 +5,13 @@ from telegram.ext import (
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ConversationHandler,
     filters,
 )
 from bot.utils.conversation import create_conversation_handler
 
 from bot.handlers.base import BaseHandler
+from bot.models import Item
 from bot.utils.states import STATES
 from bot.utils.keyboards import (
     get_cancel_keyboard,
@@ -39,11 +41,12 @@ class DeleteItemHandler(BaseHandler):
             )
             return STATES['DELETE_CONFIRM']
 
-        item = self.db.get_item(item_code)
+        item = await self.db.get_item(item_code)
         if item:
-            context.user_data['delete_item'] = item
+            # user_data is stored in MongoDB, so keep the small document form
+            context.user_data['delete_item'] = item.to_bson()
             await update.message.reply_text(
-                f"Are you sure you want to delete the item '{item.get('name', 'N/A')}' "
+                f"Are you sure you want to delete the item '{item.name or 'N/A'}' "
                 f"with code '{item_code}'?",
                 reply_markup=get_yes_no_keyboard()
             )
@@ -62,22 +65,21 @@ class DeleteItemHandler(BaseHandler):
         data = query.data
 
         if data == 'yes':
-            item = context.user_data.get('delete_item')
+            item = Item.from_bson(context.user_data.get('delete_item'))
             if item:
-                # Delete photo from S3 if exists
-                photo_key = item.get('photo_key')
-                if photo_key:
+                # Delete the item and color photos from S3 if they exist
+                photo_keys = item.photo_keys
+                if photo_keys:
                     try:
-                        self.storage.delete_file(photo_key)
+                        await self.storage.delete_files(photo_keys)
                     except Exception as e:
-                        self.logger.error(f"Error deleting photo from S3: {e}")
+                        self.logger.error(f"Error deleting photos from S3: {e}")
 
                 # Delete item from database
-                result = self.db.delete_item(item['_id'])
-                if result.deleted_count > 0:
+                if await self.db.delete_item(item.id):
                     await query.edit_message_text(
-                        f"Item '{item.get('name', 'N/A')}' with code "
-                        f"'{item.get('code', 'N/A')}' deleted successfully!"
+                        f"Item '{item.name or 'N/A'}' with code "
+                        f"'{item.code or 'N/A'}' deleted successfully!"
                     )
                 else:
                     await query.edit_message_text("Failed to delete the item.")
@@ -103,5 +105,7 @@ class DeleteItemHandler(BaseHandler):
             fallbacks=[
                 CommandHandler('cancel', self.cancel),
                 CallbackQueryHandler(self.cancel, pattern='^cancel$'),
-            ]
+            ],
+            name='delete_item_conversation',
+            persistent=True
         )
\ No newline at end of file
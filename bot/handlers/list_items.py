@@ -1,10 +1,34 @@
-import io
+from bson import ObjectId
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 from bot.handlers.base import BaseHandler
+from bot.services.cache import is_stale
+from bot.utils.formatters import STALE_NOTICE
 from bot.config import ITEMS_PER_PAGE
-from bot.utils.formatters import format_item_caption
+
+def encode_page_cursor(page, direction, item):
+    """Build list_ callback data pointing at the page next to ``item``.
+
+    The format is ``list_<page>_<n|p>_<_id>_<code>``: the page number to
+    display, whether to seek after (n) or before (p) the item, and the
+    item's sort position. The code goes last so it may contain underscores.
+    """
+    return f"list_{page}_{direction}_{item.id}_{item.code or ''}"
+
+def decode_page_cursor(data):
+    """Parse list_ callback data into (page, direction, (code, _id)).
+
+    Plain ``list_<page>`` data from older messages yields no cursor.
+    """
+    parts = data.split('_', 4)
+    page = int(parts[1])
+    if len(parts) < 5:
+        return page, None, None
+    direction, item_id, code = parts[2], parts[3], parts[4]
+    if ObjectId.is_valid(item_id):
+        item_id = ObjectId(item_id)
+    return page, direction, (code or None, item_id)
 
 class ListItemsHandler(BaseHandler):
     """Handler for listing items."""
@@ -18,7 +42,7 @@ class ListItemsHandler(BaseHandler):
         if update.callback_query:
             query = update.callback_query
             await query.answer()
-            page = int(query.data.split('_')[1])
+            page, direction, cursor = decode_page_cursor(query.data)
             chat_id = query.message.chat_id
 
             # Delete the previous page navigation message
@@ -30,11 +54,10 @@ class ListItemsHandler(BaseHandler):
             except Exception as e:
                 self.logger.error(f"Failed to delete previous navigation message: {e}")
         else:
-            page = 0
+            page, direction, cursor = 0, None, None
             chat_id = update.message.chat_id
 
-        total_items = self.db.clothes.count_documents({})
-        total_pages = (total_items - 1) // ITEMS_PER_PAGE + 1
+        total_items = await self.db.count_items()
 
         if total_items == 0:
             await context.bot.send_message(
@@ -43,61 +66,70 @@ class ListItemsHandler(BaseHandler):
             )
             return
 
-        # Retrieve items for the current page
-        items = self.db.get_items(
-            skip=page * ITEMS_PER_PAGE,
-            limit=ITEMS_PER_PAGE
-        )
+        # Retrieve items for the current page, plus one to see if there are more
+        if direction == 'n':
+            items = await self.db.get_items(after=cursor, limit=ITEMS_PER_PAGE + 1)
+            has_more = len(items) > ITEMS_PER_PAGE
+            items = items[:ITEMS_PER_PAGE]
+            has_previous, has_next = page > 0, has_more
+        elif direction == 'p':
+            items = await self.db.get_items(before=cursor, limit=ITEMS_PER_PAGE + 1)
+            has_more = len(items) > ITEMS_PER_PAGE
+            items = items[-ITEMS_PER_PAGE:]
+            has_previous, has_next = has_more, True
+            if not has_more:
+                page = 0
+        else:
+            items = await self.db.get_items(
+                skip=page * ITEMS_PER_PAGE,
+                limit=ITEMS_PER_PAGE + 1
+            )
+            has_more = len(items) > ITEMS_PER_PAGE
+            items = items[:ITEMS_PER_PAGE]
+            has_previous, has_next = page > 0, has_more
 
-        # Send each item
-        for item in items:
-            caption = format_item_caption(item)
-            photo_key = item.get('photo_key')
-
-            if photo_key:
-                try:
-                    s3_response = self.storage.get_file(photo_key)
-                    image_data = s3_response['Body'].read()
-                    image_stream = io.BytesIO(image_data)
-                    image_stream.seek(0)
-
-                    await context.bot.send_photo(
-                        chat_id=chat_id,
-                        photo=image_stream,
-                        caption=caption,
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    self.logger.error(f"Error sending photo: {e}")
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=caption,
-                        parse_mode='Markdown'
-                    )
-            else:
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text=caption,
-                    parse_mode='Markdown'
-                )
+        if not items:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="No more items."
+            )
+            return
+
+        # The total is an estimate, so never show fewer pages than we have seen
+        total_pages = max((total_items - 1) // ITEMS_PER_PAGE + 1, page + 1)
+        if has_next:
+            total_pages = max(total_pages, page + 2)
 
         # Prepare navigation buttons
         keyboard = []
         buttons = []
-        if page > 0:
+        if has_previous:
             buttons.append(
-                InlineKeyboardButton("⬅️ Previous", callback_data=f'list_{page - 1}')
+                InlineKeyboardButton(
+                    "⬅️ Previous",
+                    callback_data=encode_page_cursor(max(page - 1, 0), 'p', items[0])
+                )
             )
-        if page < total_pages - 1:
+        if has_next:
             buttons.append(
-                InlineKeyboardButton("Next ➡️", callback_data=f'list_{page + 1}')
+                InlineKeyboardButton(
+                    "Next ➡️",
+                    callback_data=encode_page_cursor(page + 1, 'n', items[-1])
+                )
             )
         if buttons:
             keyboard.append(buttons)
 
-        # Send navigation message
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"Page {page + 1} of {total_pages}",
+        text = f"Page {page + 1} of {total_pages}"
+        if is_stale(items):
+            text = f"{STALE_NOTICE}\n{text}"
+
+        # Send the page as an album plus one message with the remaining cards
+        # and the navigation buttons
+        await self.send_items(
+            context,
+            chat_id,
+            items,
+            text=text,
             reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
-        )
\ No newline at end of file
+        )
@@ -0,0 +1,31 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from bot.handlers.base import BaseHandler
+from bot.services.send_scheduler import SendScheduler
+from bot.utils.formatters import caption_cache_statistics, format_metrics
+from bot.utils.retry import retry_statistics
+
+class MetricsHandler(BaseHandler):
+    """Handler for showing cache and performance metrics."""
+
+    async def handle_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the /metrics command."""
+        sections = {
+            'Result cache': self.db.cache_statistics(),
+            'Item cache': self.db.item_cache_statistics(),
+            'Caption cache': caption_cache_statistics(),
+            'MongoDB circuit': self.db.circuit_breaker.stats(),
+            'S3 circuit': self.storage.circuit_breaker.stats(),
+        }
+        rate_limiter = getattr(context.bot, 'rate_limiter', None)
+        if isinstance(rate_limiter, SendScheduler):
+            sections['Send queue'] = rate_limiter.stats()
+        retried = retry_statistics()
+        if retried:
+            sections['Retried operations'] = retried
+
+        await update.message.reply_text(
+            format_metrics(sections),
+            parse_mode='Markdown'
+        )
@@ -1,9 +1,10 @@
-import io
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from bot.handlers.base import BaseHandler
-from bot.utils.formatters import format_item_caption
+from bot.services.cache import is_stale
+from bot.utils.formatters import STALE_NOTICE
+from bot.config import SEARCH_BACKEND
 
 class SearchHandler(BaseHandler):
     """Handler for searching items."""
@@ -18,7 +19,10 @@ class SearchHandler(BaseHandler):
             return
 
         search_term = ' '.join(context.args).lower()
-        items = self.db.search_items(search_term)
+        if SEARCH_BACKEND == 'fuzzy':
+            items = await self.db.fuzzy_search_items(search_term)
+        else:
+            items = await self.db.search_items(search_term)
 
         if not items:
             await update.message.reply_text(
@@ -27,31 +31,16 @@ class SearchHandler(BaseHandler):
             return
 
         # Send results
-        for item in items:
-            caption = format_item_caption(item)
-            photo_key = item.get('photo_key')
-
-            if photo_key:
-                try:
-                    s3_response = self.storage.get_file(photo_key)
-                    image_data = s3_response['Body'].read()
-                    image_stream = io.BytesIO(image_data)
-                    image_stream.seek(0)
-
-                    await context.bot.send_photo(
-                        chat_id=update.effective_chat.id,
-                        photo=image_stream,
-                        caption=caption,
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    self.logger.error(f"Error sending photo: {e}")
-                    await update.message.reply_text(
-                        caption,
-                        parse_mode='Markdown'
-                    )
-            else:
-                await update.message.reply_text(
-                    caption,
-                    parse_mode='Markdown'
-                )
\ No newline at end of file
+        await self.send_items(
+            context,
+            update.effective_chat.id,
+            items,
+            text=STALE_NOTICE if is_stale(items) else None
+        )
+
+    async def handle_reindex(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the /reindex command."""
+        count = await self.db.rebuild_search_index()
+        await update.message.reply_text(
+            f"Search index rebuilt with {count} items."
+        )
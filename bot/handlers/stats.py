@@ -2,15 +2,18 @@ from telegram import Update
 from telegram.ext import ContextTypes
 
 from bot.handlers.base import BaseHandler
-from bot.utils.formatters import format_statistics
+from bot.services.cache import is_stale
+from bot.utils.formatters import STALE_NOTICE, format_statistics
 
 class StatsHandler(BaseHandler):
     """Handler for showing statistics."""
 
     async def handle_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /stats command."""
-        stats = self.db.get_statistics()
+        stats = await self.db.get_statistics()
         message = format_statistics(stats)
+        if is_stale(stats):
+            message = f"{STALE_NOTICE}\n\n{message}"
         
         await update.message.reply_text(
             message,
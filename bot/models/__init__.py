@@ -0,0 +1,8 @@
+from .item import PHOTO_FILE_ID_FIELDS, Item, Variant, Stock
+
+__all__ = [
+    'PHOTO_FILE_ID_FIELDS',
+    'Item',
+    'Variant',
+    'Stock',
+]
@@ -0,0 +1,137 @@
+import posixpath
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+# Item fields caching Telegram file_ids of the photo; not catalog data
+PHOTO_FILE_ID_FIELDS = frozenset({'photo_file_id', 'photo_thumb_file_id'})
+
+def derivative_key(photo_key, name):
+    """S3 key of a photo's ``name`` derivative, stored next to it: a.jpg -> a.thumb.jpg."""
+    return f"{posixpath.splitext(photo_key)[0]}.{name}.jpg"
+
+@dataclass(slots=True)
+class Stock:
+    """Quantity in stock of one size of a variant."""
+    size: Optional[str] = None
+    quantity: Optional[int] = None
+
+    @classmethod
+    def from_bson(cls, document):
+        return cls(document.get('size'), document.get('quantity'))
+
+    def to_bson(self):
+        return _without_none({'size': self.size, 'quantity': self.quantity})
+
+@dataclass(slots=True)
+class Variant:
+    """A color of an item, stored in the item's ``params`` array."""
+    color: Optional[str] = None
+    code: Optional[str] = None
+    photo_key: Optional[str] = None
+    photo_file_id: Optional[str] = None
+    stock: list = field(default_factory=list)
+    # Names of the derivatives stored next to photo_key
+    photo_derivatives: list = field(default_factory=list)
+
+    @classmethod
+    def from_bson(cls, document):
+        get = document.get
+        return cls(
+            get('color'),
+            get('code'),
+            get('photo_key'),
+            get('photo_file_id'),
+            [Stock.from_bson(entry) for entry in get('stock') or ()],
+            list(get('photo_derivatives') or ())
+        )
+
+    def to_bson(self):
+        document = _without_none({
+            'color': self.color,
+            'code': self.code,
+            'photo_key': self.photo_key,
+            'photo_file_id': self.photo_file_id,
+        })
+        if self.stock:
+            document['stock'] = [entry.to_bson() for entry in self.stock]
+        if self.photo_derivatives:
+            document['photo_derivatives'] = list(self.photo_derivatives)
+        return document
+
+@dataclass(slots=True)
+class Item:
+    """A catalog item as read from the clothes collection.
+
+    Built from projected documents, so fields the query did not ask for are
+    None (or empty for variants). Conversion only looks fields up; nothing
+    is validated or copied twice.
+    """
+    id: Any = None
+    code: Optional[str] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    wholesale_price: Optional[float] = None
+    selling_price: Optional[float] = None
+    photo_key: Optional[str] = None
+    photo_file_id: Optional[str] = None
+    variants: list = field(default_factory=list)
+    # Revision, bumped by every write; None for items stored before revisions
+    rev: Optional[int] = None
+    # Names of the derivatives stored next to photo_key
+    photo_derivatives: list = field(default_factory=list)
+    # file_id of the thumbnail sent in albums, when it is a different copy
+    photo_thumb_file_id: Optional[str] = None
+
+    @classmethod
+    def from_bson(cls, document):
+        """Build an item from a decoded clothes document, or return None for None."""
+        if document is None:
+            return None
+        get = document.get
+        return cls(
+            get('_id'),
+            get('code'),
+            get('name'),
+            get('description'),
+            get('wholesalePrice'),
+            get('sellingPrice'),
+            get('photo_key'),
+            get('photo_file_id'),
+            [Variant.from_bson(param) for param in get('params') or ()],
+            get('rev'),
+            list(get('photo_derivatives') or ()),
+            get('photo_thumb_file_id')
+        )
+
+    def to_bson(self):
+        """Return the stored document form, leaving out unset fields."""
+        document = _without_none({
+            '_id': self.id,
+            'code': self.code,
+            'name': self.name,
+            'description': self.description,
+            'wholesalePrice': self.wholesale_price,
+            'sellingPrice': self.selling_price,
+            'photo_key': self.photo_key,
+            'photo_file_id': self.photo_file_id,
+            'rev': self.rev,
+            'photo_thumb_file_id': self.photo_thumb_file_id,
+        })
+        if self.photo_derivatives:
+            document['photo_derivatives'] = list(self.photo_derivatives)
+        if self.variants:
+            document['params'] = [variant.to_bson() for variant in self.variants]
+        return document
+
+    @property
+    def photo_keys(self):
+        """S3 keys of the item photo, every variant photo and their derivatives."""
+        keys = []
+        for owner in [self] + self.variants:
+            if owner.photo_key:
+                keys.append(owner.photo_key)
+                keys.extend(derivative_key(owner.photo_key, name) for name in owner.photo_derivatives)
+        return keys
+
+def _without_none(document):
+    return {key: value for key, value in document.items() if value is not None}
@@ -0,0 +1,226 @@
+import asyncio
+import time
+from collections import OrderedDict
+import bson
+
+class StaleList(list):
+    """Results served from the last known data while the database is down."""
+    stale = True
+
+    def __getitem__(self, index):
+        # Pages cut from stale results are stale too
+        result = super().__getitem__(index)
+        return StaleList(result) if isinstance(index, slice) else result
+
+class StaleDict(dict):
+    """A document served from the last known data while the database is down."""
+    stale = True
+
+def is_stale(value):
+    """Whether a result came from the last known data instead of the database."""
+    return getattr(value, 'stale', False)
+
+class ResultCache:
+    """Bounded LRU cache of query results with a TTL and a write generation.
+
+    Every catalog write calls invalidate(), which bumps the generation and
+    drops all entries, so a cached page or search never outlives a change.
+    Concurrent misses for the same key share a single call to the loader
+    (single-flight), and a load that started before an invalidation is
+    returned to its callers but not stored.
+
+    The last result loaded for each key is also kept, past expiry and
+    invalidation, so it can be served marked as stale while the database
+    is unavailable (see last_known).
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._last_known = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale_served = 0
+
+    async def get_or_load(self, key, loader):
+        """Return the cached value for key, calling ``await loader()`` on a miss."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        flight_key = (self.generation, key)
+        future = self._inflight.get(flight_key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        generation = self.generation
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[flight_key] = future
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(flight_key, None)
+
+        future.set_result(value)
+        self._last_known[key] = value
+        self._last_known.move_to_end(key)
+        if len(self._last_known) > self.max_entries:
+            self._last_known.popitem(last=False)
+        if generation == self.generation:
+            self._store(key, value)
+        return value
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *args):
+        """Start a new generation and drop every cached result.
+
+        Accepts and ignores any arguments so it can be subscribed to catalog
+        write notifications directly.
+        """
+        self.generation += 1
+        self._entries.clear()
+
+    def last_known(self, key):
+        """Return the last result loaded for key as a StaleList, or None."""
+        value = self._last_known.get(key)
+        if value is None:
+            return None
+        self.stale_served += 1
+        return StaleList(value)
+
+    def stats(self):
+        """Return the cache counters."""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'entries': len(self._entries),
+            'generation': self.generation,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'stale_served': self.stale_served,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+class ItemCache:
+    """Bounded LRU cache of item documents by code, with a TTL.
+
+    Items are kept BSON-encoded: every lookup decodes a fresh copy, so
+    callers may change the document they get, and the memory held is known
+    exactly. Codes that do not exist are cached too (as None), which makes
+    repeated uniqueness checks free. Entries are dropped through
+    on_catalog_change, which is subscribed to catalog writes; a lookup that
+    started before a write is not stored.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        # code -> (expires, BSON bytes or None, _id)
+        self._entries = OrderedDict()
+        # _id -> code, to find the entry to drop on updates and deletes
+        self._codes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get_or_load(self, code, loader):
+        """Return the item with ``code``, calling ``await loader()`` on a miss."""
+        entry = self._entries.get(code)
+        if entry is not None:
+            expires, data, _ = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(code)
+                if data is None:
+                    self.negative_hits += 1
+                    return None
+                self.hits += 1
+                return bson.decode(data)
+            self._drop(code)
+
+        self.misses += 1
+        generation = self.generation
+        item = await loader()
+        if generation == self.generation:
+            self._store(code, item)
+        return item
+
+    def _store(self, code, item):
+        data = bson.encode(item) if item is not None else None
+        item_id = item.get('_id') if item is not None else None
+        self._drop(code)
+        self._entries[code] = (time.monotonic() + self.ttl, data, item_id)
+        if data is not None:
+            self.bytes += len(data)
+        if item_id is not None:
+            self._codes[item_id] = code
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _drop(self, code):
+        entry = self._entries.pop(code, None)
+        if entry is None:
+            return
+        _, data, item_id = entry
+        if data is not None:
+            self.bytes -= len(data)
+        if item_id is not None and self._codes.get(item_id) == code:
+            del self._codes[item_id]
+
+    def on_catalog_change(self, operation, item_id, document=None):
+        """Drop the entries a catalog write made stale."""
+        self.generation += 1
+        if operation == 'reset':
+            self._entries.clear()
+            self._codes.clear()
+            self.bytes = 0
+            return
+        code = self._codes.get(item_id)
+        if code is not None:
+            self._drop(code)
+        # An insert or a code change may turn a cached "no such code" stale
+        if document and document.get('code') is not None:
+            self._drop(document['code'])
+
+    def stats(self):
+        """Return the cache counters and the memory held by cached items."""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from bot.config import CATALOG_SYNC_INTERVAL, CLOTHES_COLLECTION
+from bot.models import PHOTO_FILE_ID_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Server error codes meaning change streams are not available here, e.g.
+# on a standalone mongod
+UNSUPPORTED_ERROR_CODES = {40573, 40324}
+# The resume token has fallen off the oplog
+HISTORY_LOST_ERROR_CODES = {136, 260, 280, 286}
+# Seconds between resume token saves
+TOKEN_SAVE_INTERVAL = 10
+
+def _only_file_ids_changed(change):
+    description = change.get('updateDescription') or {}
+    updated = description.get('updatedFields') or {}
+    return (
+        bool(updated)
+        and updated.keys() <= PHOTO_FILE_ID_FIELDS
+        and not description.get('removedFields')
+        and not description.get('truncatedArrays')
+    )
+
+class CatalogChangeListener:
+    """Keeps this process's catalog caches coherent with other processes' writes.
+
+    Watches the clothes collection and the catalog generation counter with
+    a MongoDB change stream and publishes every change through
+    DatabaseService.apply_catalog_change, so every subscribed cache drops
+    what the change made stale. The resume token is saved every
+    TOKEN_SAVE_INTERVAL seconds, so a reconnect or restart resumes where the
+    stream stopped. If the token is too old, caches are reset and a new
+    stream is opened. Where change streams are not available (a standalone
+    mongod) the catalog generation is polled every CATALOG_SYNC_INTERVAL
+    seconds instead.
+    """
+
+    def __init__(self, name='catalog', poll_interval=CATALOG_SYNC_INTERVAL):
+        self.name = name
+        self.poll_interval = poll_interval
+        self.events = 0
+        self._db = None
+        self._token = None
+        self._token_saved = None
+        self._token_saved_at = 0
+        self._listened = False
+
+    @property
+    def db(self):
+        if self._db is None:
+            from bot.services.database import DatabaseService
+            self._db = DatabaseService()
+        return self._db
+
+    @db.setter
+    def db(self, value):
+        self._db = value
+
+    async def run(self, stop_event):
+        """Listen until stop_event is set."""
+        from pymongo.errors import OperationFailure
+
+        self._token = await self._load_token()
+        while not stop_event.is_set():
+            try:
+                await self._listen(stop_event)
+            except OperationFailure as e:
+                if e.code in UNSUPPORTED_ERROR_CODES:
+                    logger.info(f"Change streams are not available, polling the catalog generation: {e}")
+                    await self._poll(stop_event)
+                    return
+                if e.code in HISTORY_LOST_ERROR_CODES:
+                    logger.warning(f"Catalog changes were missed, resetting caches: {e}")
+                    self._token = None
+                    self.db.apply_catalog_change('reset', None)
+                    continue
+                logger.warning(f"Catalog change stream failed: {e}")
+            except Exception as e:
+                logger.warning(f"Catalog change stream failed: {e}")
+            await self._wait(stop_event, self.poll_interval)
+        await self._save_token(force=True)
+
+    async def _listen(self, stop_event):
+        stream = await self.db.watch_catalog(resume_after=self._token)
+        try:
+            if self._token is None and self._listened:
+                # Changes since the last stream was lost cannot be replayed
+                self.db.apply_catalog_change('reset', None)
+            self._listened = True
+            logger.info("Listening for catalog changes")
+            while not stop_event.is_set():
+                change = await self.db.next_catalog_change(stream)
+                if change is not None:
+                    self._apply(change)
+                # Also advances past events filtered out on the server
+                self._token = stream.resume_token
+                await self._save_token()
+                if not stream.alive:
+                    # The collection or database was dropped or renamed
+                    self._token = None
+                    return
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, stream.close)
+
+    def _apply(self, change):
+        self.events += 1
+        operation = change['operationType']
+        if change['ns'].get('coll') != CLOTHES_COLLECTION:
+            # The generation counter; every clothes change comes before its bump
+            document = change.get('fullDocument') or {}
+            if 'value' in document:
+                self.db.note_catalog_generation(document['value'])
+            return
+        item_id = change.get('documentKey', {}).get('_id')
+        if operation == 'update' and _only_file_ids_changed(change):
+            # A cached file_id (see DatabaseService.set_photo_file_id)
+            return
+        if operation == 'insert':
+            self.db.apply_catalog_change('insert', item_id, change.get('fullDocument'))
+        elif operation in ('update', 'replace'):
+            document = change.get('fullDocument')
+            if document is None:
+                # Deleted before the lookup
+                self.db.apply_catalog_change('delete', item_id)
+            else:
+                self.db.apply_catalog_change('update', item_id, document)
+        elif operation == 'delete':
+            self.db.apply_catalog_change('delete', item_id)
+        else:
+            self.db.apply_catalog_change('reset', None)
+
+    async def _poll(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                await self.db.sync_catalog_generation()
+            except Exception as e:
+                logger.warning(f"Failed to read the catalog generation: {e}")
+            await self._wait(stop_event, self.poll_interval)
+
+    @staticmethod
+    async def _wait(stop_event, seconds):
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _load_token(self):
+        try:
+            token = await self.db.get_resume_token(self.name)
+        except Exception as e:
+            logger.warning(f"Failed to load the catalog change stream resume token: {e}")
+            return None
+        self._token_saved = token
+        return token
+
+    async def _save_token(self, force=False):
+        if self._token is None or self._token == self._token_saved:
+            return
+        if not force and time.monotonic() - self._token_saved_at < TOKEN_SAVE_INTERVAL:
+            return
+        self._token_saved_at = time.monotonic()
+        try:
+            await self.db.save_resume_token(self.name, self._token)
+            self._token_saved = self._token
+        except Exception as e:
+            logger.warning(f"Failed to save the catalog change stream resume token: {e}")
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from bot.config import LEASE_TTL
+
+logger = logging.getLogger(__name__)
+
+class LeaderLease:
+    """Lease-based leadership of a named role, stored in MongoDB.
+
+    Only the holder of the lease may perform the role, e.g. long-polling
+    Telegram, which allows a single consumer per bot token. The holder renews
+    the lease every third of its TTL. A replica that cannot renew gives the
+    role up before the lease can expire, so two replicas never hold it at
+    the same time; a standby replica takes over once it has expired.
+    """
+
+    def __init__(self, name, ttl=LEASE_TTL, holder=None):
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+        self._renewed_at = 0
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            from bot.services.database import DatabaseService
+            self._db = DatabaseService()
+        return self._db
+
+    @db.setter
+    def db(self, value):
+        self._db = value
+
+    async def try_acquire(self):
+        """Take or renew the lease once; return whether it is held."""
+        started = time.monotonic()
+        self.held = await self.db.acquire_lease(self.name, self.holder, self.ttl)
+        if self.held:
+            self._renewed_at = started
+        return self.held
+
+    async def acquire(self, stop_event):
+        """Wait until the lease is held or stop_event is set; return whether it is held."""
+        while not stop_event.is_set():
+            try:
+                if await self.try_acquire():
+                    logger.info(f"Acquired the {self.name} lease as {self.holder}")
+                    return True
+            except Exception as e:
+                logger.warning(f"Failed to acquire the {self.name} lease: {e}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=self.ttl / 3)
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def keep_alive(self, on_lost):
+        """Renew the lease until it is lost, then call ``on_lost()``."""
+        while self.held:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.try_acquire()
+            except Exception as e:
+                logger.warning(f"Failed to renew the {self.name} lease: {e}")
+                # Give up with a safety margin before the lease can expire
+                if time.monotonic() - self._renewed_at > self.ttl * 2 / 3:
+                    self.held = False
+        logger.error(f"Lost the {self.name} lease")
+        on_lost()
+
+    async def release(self):
+        """Release the lease so a standby replica can take over at once."""
+        if not self.held:
+            return
+        self.held = False
+        try:
+            await self.db.release_lease(self.name, self.holder)
+            logger.info(f"Released the {self.name} lease")
+        except Exception as e:
+            logger.warning(f"Failed to release the {self.name} lease: {e}")
@@ -1,166 +1,1051 @@
+import asyncio
+import copy
 import logging
-from functools import wraps
-from typing import Any, Callable
-from pymongo import MongoClient, errors
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+from bson import ObjectId
+from pymongo import ASCENDING, TEXT, IndexModel, MongoClient, errors
 from pymongo.collection import ReturnDocument
+from bot.models import PHOTO_FILE_ID_FIELDS, Item
+from bot.services.cache import ItemCache, ResultCache, StaleDict
+from bot.services.search_index import FuzzySearchIndex, SEARCH_PROJECTION
+from bot.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from bot.utils.retry import RetryPolicy
 from bot.config import (
-    MONGODB_CONNECTION_STRING,
     DB_NAME,
     CLOTHES_COLLECTION,
     COUNTERS_COLLECTION,
+    USER_DATA_COLLECTION,
+    CONVERSATIONS_COLLECTION,
+    LEASES_COLLECTION,
     MONGODB_TIMEOUT_MS,
-    MONGODB_MAX_RETRIES
+    MONGODB_MAX_RETRIES,
+    MONGODB_RETRY_DEADLINE,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    MONGODB_POOL_SIZE,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    CODE_BLOCK_SIZE,
+    ITEMS_COUNT_TTL,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+    ITEM_CACHE_SIZE,
+    ITEM_CACHE_TTL
 )
 
 logger = logging.getLogger(__name__)
 
+# Indexes the query paths rely on, per collection. ensure_indexes() creates
+# them at startup and check_indexes() reports drift from this registry.
+INDEXES = {
+    CLOTHES_COLLECTION: [
+        # get_item lookups and manual code uniqueness; items without a
+        # top-level code are excluded so they do not collide on null
+        IndexModel(
+            [('code', ASCENDING)],
+            name='code_unique',
+            unique=True,
+            partialFilterExpression={'code': {'$type': 'string'}}
+        ),
+        # /list sort order and keyset pagination
+        IndexModel([('code', ASCENDING), ('_id', ASCENDING)], name='code_id'),
+        # Variant code lookups
+        IndexModel([('params.code', ASCENDING)], name='params_code'),
+        # Items-with-photos count
+        IndexModel([('photo_key', ASCENDING)], name='photo_key', sparse=True),
+        # Ranked /search over names, colors, codes and descriptions. No
+        # language is set so names and colors are matched as typed, without
+        # stemming or stop words.
+        IndexModel(
+            [
+                ('name', TEXT),
+                ('params.color', TEXT),
+                ('code', TEXT),
+                ('params.code', TEXT),
+                ('description', TEXT),
+            ],
+            name='search_text',
+            weights={'name': 10, 'params.color': 5, 'code': 5, 'params.code': 5, 'description': 1},
+            default_language='none',
+            language_override='search_language'
+        ),
+    ],
+    CONVERSATIONS_COLLECTION: [
+        # Conversation states are loaded per handler name at startup, and
+        # per conversation key on every update when replicas share state
+        IndexModel([('name', ASCENDING)], name='name'),
+        IndexModel([('key', ASCENDING)], name='key'),
+    ],
+}
+
+CODE_PATTERN = re.compile(r'\d{6}')
+SEARCH_TERM_PATTERN = re.compile(r'\w+')
+
+# Server error codes that mean "try again": primary stepdown or shutdown
+# during a failover, and network errors reported by a mongos
+TRANSIENT_ERROR_CODES = {6, 7, 89, 91, 189, 9001, 10107, 11600, 11602, 13435, 13436}
+
+def is_transient_error(error):
+    """Whether a failed MongoDB operation may succeed if tried again.
+
+    Connection problems and elections are transient; duplicate keys,
+    validation errors and other server errors are not.
+    """
+    if isinstance(error, errors.DuplicateKeyError):
+        return False
+    if isinstance(error, errors.ConnectionFailure):
+        return True
+    if isinstance(error, errors.PyMongoError) and (
+        error.has_error_label('RetryableWriteError')
+        or error.has_error_label('TransientTransactionError')
+    ):
+        return True
+    return isinstance(error, errors.OperationFailure) and error.code in TRANSIENT_ERROR_CODES
+
+def is_unavailable(error):
+    """Whether an error means MongoDB is down rather than the request is wrong."""
+    return isinstance(error, CircuitOpenError) or is_transient_error(error)
+
 def with_retry(max_retries: int = MONGODB_MAX_RETRIES) -> Callable:
-    def decorator(func: Callable) -> Callable:
-        @wraps(func)
-        def wrapper(*args, **kwargs) -> Any:
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except errors.PyMongoError as e:
-                    last_error = e
-                    logger.warning(f"MongoDB operation failed (attempt {attempt + 1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        continue
-            raise last_error
-        return wrapper
-    return decorator
+    return RetryPolicy(
+        'MongoDB',
+        is_transient_error,
+        max_attempts=max_retries,
+        deadline=MONGODB_RETRY_DEADLINE,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY
+    )
+
+def _keyset_filter(field, position, operator):
+    """Build the filter for items sorted after ('$gt') or before ('$lt') a position.
+
+    MongoDB sorts missing and null values first, and range operators never
+    match them, so those items are handled explicitly.
+    """
+    value, item_id = position
+    if value is None:
+        if operator == '$gt':
+            return {'$or': [
+                {field: None, '_id': {'$gt': item_id}},
+                {field: {'$ne': None}}
+            ]}
+        return {field: None, '_id': {'$lt': item_id}}
+
+    query = {'$or': [
+        {field: {operator: value}},
+        {field: value, '_id': {operator: item_id}}
+    ]}
+    if operator == '$lt':
+        query['$or'].append({field: None})
+    return query
+
+# Shared catalog version, bumped on every write so that other replicas know
+# to drop their caches; kept in the counters collection
+GENERATION_ID = 'catalog_generation'
+# Longest a change stream read waits on the server for an event
+CHANGE_STREAM_MAX_AWAIT_MS = 1000
+
+# Materialized /stats document, kept in the counters collection
+STATS_ID = 'store_statistics'
+STATS_PROJECTION = {'photo_key': 1, 'params.color': 1, 'params.stock.quantity': 1}
+
+# Fields each read path needs, so nothing else is sent, decoded or cached.
+# Item cards in /list and /search pages:
+CARD_PROJECTION = {
+    'code': 1,
+    'name': 1,
+    'description': 1,
+    'wholesalePrice': 1,
+    'sellingPrice': 1,
+    'photo_key': 1,
+    'photo_file_id': 1,
+    'photo_thumb_file_id': 1,
+    'photo_derivatives': 1,
+    'rev': 1,
+    'params.color': 1,
+    'params.stock.size': 1,
+    'params.stock.quantity': 1,
+}
+SEARCH_HIT_PROJECTION = {**CARD_PROJECTION, 'score': {'$meta': 'textScore'}}
+# The item looked up by /change, /delete and code checks:
+EDIT_TARGET_PROJECTION = {
+    'code': 1,
+    'name': 1,
+    'photo_key': 1,
+    'photo_derivatives': 1,
+    'params.photo_key': 1,
+    'params.photo_derivatives': 1,
+}
+# Photos of an item, for backfilling their derivatives:
+PHOTO_PROJECTION = {
+    'photo_key': 1,
+    'photo_derivatives': 1,
+    'params.photo_key': 1,
+    'params.photo_derivatives': 1,
+}
+
+def _read_items(cursor):
+    """Exhaust a cursor into Items; runs on the database pool."""
+    return [Item.from_bson(document) for document in cursor]
+
+def _encode_color_key(color):
+    """Turn a color into a field name; '.', '$' and None are not allowed there."""
+    if color is None:
+        return '%00'
+    return str(color).replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+def _decode_color_key(key):
+    if key == '%00':
+        return None
+    return key.replace('%24', '$').replace('%2E', '.').replace('%25', '%')
+
+def _statistics_counters(item):
+    """Return what an item contributes to the materialized statistics."""
+    if not item:
+        return {}
+    counters = {'total_items': 1}
+    if item.get('photo_key') is not None:
+        counters['items_with_photos'] = 1
+    total_stock = 0
+    for param in item.get('params') or []:
+        key = f"colors.{_encode_color_key(param.get('color'))}"
+        counters[key] = counters.get(key, 0) + 1
+        for stock in param.get('stock') or []:
+            quantity = stock.get('quantity')
+            if isinstance(quantity, (int, float)) and not isinstance(quantity, bool):
+                total_stock += quantity
+    if total_stock:
+        counters['total_stock'] = total_stock
+    return counters
+
+def _statistics_delta(before, after):
+    """Return the $inc document that turns before's contribution into after's."""
+    before, after = _statistics_counters(before), _statistics_counters(after)
+    delta = {}
+    for key in before.keys() | after.keys():
+        change = after.get(key, 0) - before.get(key, 0)
+        if change:
+            delta[key] = change
+    return delta
+
+def _apply_set(document, update_data):
+    """Return a copy of document with a $set document applied to it."""
+    document = copy.deepcopy(document)
+    for path, value in update_data.items():
+        *parents, last = path.split('.')
+        target = document
+        for key in parents:
+            target = target[int(key)] if isinstance(target, list) else target.setdefault(key, {})
+        if isinstance(target, list):
+            target[int(last)] = value
+        else:
+            target[last] = value
+    return document
 
 class DatabaseService:
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(DatabaseService, cls).__new__(cls)
-            cls._instance._initialize()
+            # Only cache a fully initialized instance, so a failed start
+            # (e.g. a missing setting) is retried instead of leaving a
+            # half-built singleton behind
+            instance = super(DatabaseService, cls).__new__(cls)
+            instance._initialize()
+            cls._instance = instance
         return cls._instance
 
     def _initialize(self):
+        from bot.config import MONGODB_CONNECTION_STRING
+
         try:
+            # MongoClient connects in the background; the first query waits
+            # for it, so nothing here blocks on the network.
             self.client = MongoClient(
                 MONGODB_CONNECTION_STRING,
                 serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS,
                 connectTimeoutMS=MONGODB_TIMEOUT_MS,
-                socketTimeoutMS=MONGODB_TIMEOUT_MS
+                socketTimeoutMS=MONGODB_TIMEOUT_MS,
+                maxPoolSize=MONGODB_POOL_SIZE
+            )
+            # pymongo is blocking, so every query runs on this bounded pool
+            # instead of the event loop thread.
+            self.executor = ThreadPoolExecutor(
+                max_workers=MONGODB_POOL_SIZE,
+                thread_name_prefix='mongodb'
+            )
+            # Every query goes through this breaker (see _run); while it is
+            # open reads fall back to the last known results and writes fail
+            self.circuit_breaker = CircuitBreaker(
+                'MongoDB',
+                is_transient_error,
+                failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=CIRCUIT_RESET_TIMEOUT
             )
             self.db = self.client[DB_NAME]
             self.clothes = self.db[CLOTHES_COLLECTION]
             self.counters = self.db[COUNTERS_COLLECTION]
-            
-            # Test connection
-            self.client.admin.command('ping')
-            
-            # Initialize the counter if it doesn't exist
-            if self.counters.count_documents({'_id': 'itemid'}) == 0:
-                self.counters.insert_one({'_id': 'itemid', 'sequence_value': 0})
-                
-            logger.info("Successfully connected to MongoDB")
+            self._item_count = None
+            self._item_count_expires = 0
+            self._last_item_count = None
+            self._last_statistics = None
+            # Locally reserved code range [_next_code, _code_block_end]
+            self._code_lock = asyncio.Lock()
+            self._next_code = 1
+            self._code_block_end = 0
+            self._listeners = []
+            self.search_index = FuzzySearchIndex()
+            self._search_index_ready = False
+            self._search_index_lock = asyncio.Lock()
+            self._search_index_backlog = None
+            self.subscribe(self._update_search_index)
+            # List pages and search results, dropped on every catalog write
+            self.result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+            self.subscribe(self.result_cache.invalidate)
+            # Item documents by code for get_item, dropped per item on writes
+            self.item_cache = ItemCache(ITEM_CACHE_SIZE, ITEM_CACHE_TTL)
+            self.subscribe(self.item_cache.on_catalog_change)
+            # Last catalog generation this process has caught up with
+            self._catalog_generation = None
+            self._generation_checked = 0
+            logger.info("MongoDB client initialized")
         except Exception as e:
             logger.error(f"Failed to initialize MongoDB connection: {e}")
             raise
 
+    async def ensure_indexes(self):
+        """Create any registered index that does not exist yet.
+
+        create_index is a no-op for existing indexes, so this is safe to run
+        on every start. Each index is created separately so that one failing
+        build (e.g. duplicate codes) does not block the others.
+        """
+        await self._run(self._ensure_indexes)
+
+    def _ensure_indexes(self):
+        for collection_name, models in INDEXES.items():
+            collection = self.db[collection_name]
+            for model in models:
+                name = model.document['name']
+                try:
+                    collection.create_indexes([model])
+                except errors.PyMongoError as e:
+                    logger.error(f"Failed to create index {collection_name}.{name}: {e}")
+        logger.info("MongoDB indexes ensured")
+
+    async def check_indexes(self):
+        """Compare the live indexes with the registry.
+
+        Returns one dict per index with its collection, name, usage count
+        since the server started and a status: ok, missing, building, unused
+        (registered but never used) or unregistered (exists but unknown).
+        """
+        return await self._run(self._check_indexes)
+
+    def _check_indexes(self):
+        building = self._index_builds()
+        report = []
+        for collection_name, models in INDEXES.items():
+            collection = self.db[collection_name]
+            existing = {index['name'] for index in collection.list_indexes()}
+            usage = {
+                stat['name']: stat['accesses']['ops']
+                for stat in collection.aggregate([{'$indexStats': {}}])
+            }
+            registered = {model.document['name'] for model in models}
+
+            for name in sorted(registered | existing - {'_id_'}):
+                if (collection_name, name) in building:
+                    status = 'building'
+                elif name not in existing:
+                    status = 'missing'
+                elif name not in registered:
+                    status = 'unregistered'
+                elif usage.get(name, 0) == 0:
+                    status = 'unused'
+                else:
+                    status = 'ok'
+                report.append({
+                    'collection': collection_name,
+                    'name': name,
+                    'status': status,
+                    'ops': usage.get(name)
+                })
+        return report
+
+    def _index_builds(self):
+        """Return (collection, index name) pairs of index builds in progress."""
+        try:
+            operations = self.client.admin.aggregate([
+                {'$currentOp': {'allUsers': True}},
+                {'$match': {'command.createIndexes': {'$exists': True}}}
+            ])
+            return {
+                (operation['command']['createIndexes'], index['name'])
+                for operation in operations
+                for index in operation['command'].get('indexes', [])
+            }
+        except errors.OperationFailure as e:
+            logger.warning(f"Cannot read index build progress: {e}")
+            return set()
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking pymongo call on the database thread pool.
+
+        Raises CircuitOpenError at once while MongoDB is known to be down.
+        """
+        loop = asyncio.get_running_loop()
+        return await self.circuit_breaker.call(
+            loop.run_in_executor, self.executor, partial(func, *args, **kwargs)
+        )
+
+    async def _cached(self, key, loader):
+        """Serve a result from the result cache, or the last known one during an outage."""
+        try:
+            return await self.result_cache.get_or_load(key, loader)
+        except Exception as e:
+            stale = self.result_cache.last_known(key) if is_unavailable(e) else None
+            if stale is None:
+                raise
+            logger.warning(f"Serving last known {key[0]} results, MongoDB is unavailable: {e}")
+            return stale
+
+    async def get_next_code(self):
+        """Return the next auto-generated code."""
+        codes = await self.get_next_codes(1)
+        return codes[0]
+
+    async def get_next_codes(self, count):
+        """Return ``count`` unused auto-generated codes.
+
+        Codes are handed out from a block reserved with a single $inc on the
+        shared counter, CODE_BLOCK_SIZE codes at a time, so most calls never
+        touch MongoDB. Blocks never overlap, which keeps several bot instances
+        safe, but codes are only unique, not consecutive: each instance draws
+        from its own block, and codes left in a block when the process exits
+        or crashes are never used.
+        """
+        codes = []
+        async with self._code_lock:
+            while len(codes) < count:
+                if self._next_code > self._code_block_end:
+                    size = max(CODE_BLOCK_SIZE, count - len(codes))
+                    self._code_block_end = await self._reserve_codes(size)
+                    self._next_code = self._code_block_end - size + 1
+                end = min(self._code_block_end, self._next_code + count - len(codes) - 1)
+                codes.extend(range(self._next_code, end + 1))
+                self._next_code = end + 1
+        return [f"{code:06d}" for code in codes]
+
     @with_retry()
-    def get_next_code(self):
-        result = self.counters.find_one_and_update(
+    async def _reserve_codes(self, size):
+        """Reserve ``size`` codes on the shared counter and return the last one."""
+        result = await self._run(
+            self.counters.find_one_and_update,
             {'_id': 'itemid'},
-            {'$inc': {'sequence_value': 1}},
+            {'$inc': {'sequence_value': size}},
             return_document=ReturnDocument.AFTER,
             upsert=True
         )
-        return f"{result['sequence_value']:06d}"
+        return result['sequence_value']
+
+    def subscribe(self, callback):
+        """Register a callback for catalog writes.
+
+        After every add, update or delete the callback is called on the event
+        loop as ``callback(operation, item_id, document)``, where operation is
+        'insert', 'update' or 'delete'. document is the new item for inserts,
+        the current search fields for updates that touch them, and None
+        otherwise. operation is 'reset', with no item, when another replica
+        changed the catalog and everything derived from it must be dropped.
+        """
+        self._listeners.append(callback)
+
+    def _publish(self, operation, item_id, document=None):
+        for callback in self._listeners:
+            try:
+                callback(operation, item_id, document)
+            except Exception as e:
+                logger.error(f"Catalog listener {callback} failed on {operation} of {item_id}: {e}")
+
+    async def _bump_generation(self):
+        """Advance the shared catalog generation after a write."""
+        try:
+            document = await self._run(
+                self.counters.find_one_and_update,
+                {'_id': GENERATION_ID},
+                {'$inc': {'value': 1}},
+                return_document=ReturnDocument.AFTER,
+                upsert=True
+            )
+        except (errors.PyMongoError, CircuitOpenError) as e:
+            logger.warning(f"Failed to bump the catalog generation: {e}")
+            return
+        # Stay behind if another replica wrote in between, so that the next
+        # sync still drops what this process cached from before its write
+        if self._catalog_generation is not None and document['value'] == self._catalog_generation + 1:
+            self._catalog_generation = document['value']
+
+    async def sync_catalog_generation(self, max_age=0):
+        """Drop local caches if another replica changed the catalog.
+
+        Reads the shared generation at most once every ``max_age`` seconds.
+        Returns True when caches were reset.
+        """
+        if time.monotonic() - self._generation_checked < max_age:
+            return False
+        self._generation_checked = time.monotonic()
+        document = await self._run(self.counters.find_one, {'_id': GENERATION_ID})
+        generation = document['value'] if document else 0
+        previous, self._catalog_generation = self._catalog_generation, generation
+        if previous is None or previous == generation:
+            return False
+        self.apply_catalog_change('reset', None)
+        return True
+
+    def note_catalog_generation(self, generation):
+        """Record a catalog generation whose changes have already been applied."""
+        self._catalog_generation = generation
+        self._generation_checked = time.monotonic()
+
+    def apply_catalog_change(self, operation, item_id, document=None):
+        """Publish a catalog change made by another process.
+
+        Takes the same arguments as the subscribe callbacks.
+        """
+        if operation in ('insert', 'delete', 'reset'):
+            self._item_count = None
+        self._publish(operation, item_id, document)
+
+    async def watch_catalog(self, resume_after=None):
+        """Open a change stream on the clothes and the catalog generation.
+
+        Update events carry the current document. Read it with
+        next_catalog_change.
+        """
+        pipeline = [{'$match': {'$or': [
+            {'ns.coll': CLOTHES_COLLECTION},
+            {'ns.coll': COUNTERS_COLLECTION, 'documentKey._id': GENERATION_ID},
+        ]}}]
+        return await self._run(
+            self.db.watch,
+            pipeline,
+            full_document='updateLookup',
+            resume_after=resume_after,
+            max_await_time_ms=CHANGE_STREAM_MAX_AWAIT_MS
+        )
+
+    async def next_catalog_change(self, stream):
+        """Return the next change event, or None if none arrived in time."""
+        return await self._run(stream.try_next)
+
+    async def get_resume_token(self, name):
+        """Return the saved resume token of a change stream, or None."""
+        document = await self._run(self.counters.find_one, {'_id': f'resume_token:{name}'})
+        return document['token'] if document else None
+
+    async def save_resume_token(self, name, token):
+        await self._run(
+            self.counters.replace_one,
+            {'_id': f'resume_token:{name}'},
+            {'_id': f'resume_token:{name}', 'token': token},
+            upsert=True
+        )
+
+    async def add_item(self, item_data):
+        """Insert an item and return its _id.
+
+        Only the insert is retried, never the follow-up writes, and the _id
+        is assigned up front: if a retried insert finds its own document
+        already stored, the first attempt succeeded.
+        """
+        item_data.setdefault('_id', ObjectId())
+        # Revisions key the rendered caption cache; see format_item_caption
+        item_data['rev'] = 1
+        await self._insert_item(item_data)
+        self._item_count = None
+        await self._apply_statistics_delta(_statistics_delta(None, item_data))
+        await self._bump_generation()
+        self._publish('insert', item_data['_id'], item_data)
+        return item_data['_id']
 
     @with_retry()
-    def add_item(self, item_data):
-        return self.clothes.insert_one(item_data)
+    async def _insert_item(self, document):
+        try:
+            await self._run(self.clothes.insert_one, document)
+        except errors.DuplicateKeyError as e:
+            if (e.details or {}).get('keyPattern') != {'_id': 1}:
+                raise
+            logger.info(f"Item {document['_id']} was already inserted by an earlier attempt")
+
+    async def get_item(self, code):
+        """Return the Item with ``code`` or None, served from the item cache.
+
+        Only the EDIT_TARGET_PROJECTION fields are set.
+        """
+        document = await self.item_cache.get_or_load(code, partial(self._get_item, code))
+        return Item.from_bson(document)
 
     @with_retry()
-    def get_item(self, code):
-        return self.clothes.find_one({'code': code})
+    async def _get_item(self, code):
+        return await self._run(self.clothes.find_one, {'code': code}, EDIT_TARGET_PROJECTION)
+
+    async def update_item(self, item_id, update_data):
+        """Apply ``$set: update_data`` to an item; return whether it exists."""
+        # The statistics fields as they were right before this update, read
+        # atomically with it so concurrent edits each see their own "before"
+        before = await self._update_item(item_id, update_data)
+        if before is None:
+            return False
+
+        # Only photo and variant changes move the statistics
+        fields = {field.split('.')[0] for field in update_data}
+        if fields & {'photo_key', 'params'}:
+            try:
+                delta = _statistics_delta(before, _apply_set(before, update_data))
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                logger.warning(f"Cannot compute statistics change for item {item_id}: {e}")
+            else:
+                await self._apply_statistics_delta(delta)
+
+        await self._bump_generation()
+        if not fields & SEARCH_PROJECTION.keys():
+            self._publish('update', item_id)
+            return True
+        try:
+            document = await self._get_search_fields(item_id)
+        except Exception as e:
+            # The update is saved; drop what cannot be brought up to date
+            logger.warning(f"Cannot read the search fields of item {item_id}, resetting caches: {e}")
+            self._publish('reset', None)
+        else:
+            self._publish('update', item_id, document)
+        return True
 
     @with_retry()
-    def update_item(self, item_id, update_data):
-        return self.clothes.update_one(
+    async def _update_item(self, item_id, update_data):
+        return await self._run(
+            self.clothes.find_one_and_update,
             {'_id': item_id},
-            {'$set': update_data}
+            {'$set': update_data, '$inc': {'rev': 1}},
+            projection=STATS_PROJECTION,
+            return_document=ReturnDocument.BEFORE
         )
 
     @with_retry()
-    def delete_item(self, item_id):
-        return self.clothes.delete_one({'_id': item_id})
+    async def set_photo_file_id(self, item_id, field, file_id):
+        """Store a Telegram file_id of an item photo in one of PHOTO_FILE_ID_FIELDS.
+
+        Not a catalog change: rev, the catalog generation and the caches are
+        left alone, and other replicas ignore it (see CatalogChangeListener).
+        """
+        if field not in PHOTO_FILE_ID_FIELDS:
+            raise ValueError(f"Not a photo file_id field: {field}")
+        await self._run(self.clothes.update_one, {'_id': item_id}, {'$set': {field: file_id}})
+
+    @with_retry()
+    async def _get_search_fields(self, item_id):
+        return await self._run(self.clothes.find_one, {'_id': item_id}, SEARCH_PROJECTION)
+
+    async def delete_item(self, item_id):
+        """Delete an item; return whether it existed."""
+        deleted = await self._delete_item(item_id)
+        self._item_count = None
+        if deleted is not None:
+            await self._apply_statistics_delta(_statistics_delta(deleted, None))
+        await self._bump_generation()
+        self._publish('delete', item_id)
+        return deleted is not None
+
+    @with_retry()
+    async def _delete_item(self, item_id):
+        return await self._run(self.clothes.find_one_and_delete, {'_id': item_id}, STATS_PROJECTION)
 
     @with_retry()
-    def get_items(self, skip=0, limit=None, sort_by='code'):
+    async def get_items_missing_photo_derivatives(self):
+        """Return the photo fields of items with a photo that has no derivatives yet."""
+        # Missing, or empty where processing failed at upload
+        missing = {'photo_key': {'$type': 'string'}, 'photo_derivatives': {'$in': [None, []]}}
+        cursor = self.clothes.find(
+            {'$or': [missing, {'params': {'$elemMatch': missing}}]},
+            PHOTO_PROJECTION
+        )
+        return await self._run(list, cursor)
+
+    async def count_items(self):
+        """Return the number of items, cached for ITEMS_COUNT_TTL seconds.
+
+        Uses the collection metadata count, so it is cheap but may be
+        slightly off after an unclean shutdown; it is only used for display.
+        While MongoDB is unavailable the last known count is returned.
+        """
+        if self._item_count is None or time.monotonic() >= self._item_count_expires:
+            try:
+                self._item_count = await self._estimated_count()
+            except Exception as e:
+                if self._last_item_count is None or not is_unavailable(e):
+                    raise
+                return self._last_item_count
+            self._item_count_expires = time.monotonic() + ITEMS_COUNT_TTL
+            self._last_item_count = self._item_count
+        return self._item_count
+
+    @with_retry()
+    async def _estimated_count(self):
+        return await self._run(self.clothes.estimated_document_count)
+
+    async def get_items(self, skip=0, limit=None, sort_by='code', after=None, before=None):
+        """Fetch item cards (CARD_PROJECTION Items) ordered by ``sort_by`` and then ``_id``.
+
+        ``after`` and ``before`` are ``(value, _id)`` pairs taken from the
+        last or first item of an adjacent page. When given, the query seeks
+        past that position with the (sort_by, _id) index instead of skipping,
+        so deep pages cost the same as the first one. Results are served
+        from the result cache until the next catalog write, and as a
+        StaleList of the last known results while MongoDB is unavailable.
+        """
+        return await self._cached(
+            ('items', skip, limit, sort_by, after, before),
+            partial(self._get_items, skip, limit, sort_by, after, before)
+        )
+
+    @with_retry()
+    async def _get_items(self, skip, limit, sort_by, after, before):
         try:
-            cursor = self.clothes.find().sort(sort_by, 1)
+            direction = -1 if before else 1
+            query = {}
+            if after:
+                query = _keyset_filter(sort_by, after, '$gt')
+            elif before:
+                query = _keyset_filter(sort_by, before, '$lt')
+
+            cursor = self.clothes.find(query, CARD_PROJECTION).sort(
+                [(sort_by, direction), ('_id', direction)]
+            )
             if skip:
                 cursor = cursor.skip(skip)
             if limit:
                 cursor = cursor.limit(limit)
-            return list(cursor)
+            items = await self._run(_read_items, cursor)
+            if before:
+                items.reverse()
+            return items
         except Exception as e:
             logger.error(f"Error fetching items: {e}")
             raise
 
+    async def search_items(self, query, limit=5, skip=0):
+        """Find items matching a search query, best matches first.
+
+        A 6-digit query is looked up exactly on item and variant codes.
+        Anything else runs against the text index, ranked by text score.
+        Only word characters are kept from the query, so text search
+        operators (quoted phrases, negation) cannot be injected. Results
+        are served from the result cache until the next catalog write.
+        """
+        return await self._cached(
+            ('search', query, limit, skip),
+            partial(self._search_items, query, limit, skip)
+        )
+
     @with_retry()
-    def search_items(self, query, limit=5):
+    async def _search_items(self, query, limit, skip):
         try:
-            search_query = {
-                '$or': [
-                    {'name': {'$regex': query, '$options': 'i'}},
-                    {'description': {'$regex': query, '$options': 'i'}},
-                    {'code': {'$regex': query, '$options': 'i'}},
-                    {'params.color': {'$regex': query, '$options': 'i'}}
-                ]
-            }
-            return list(self.clothes.find(search_query).limit(limit))
+            query = query.strip()
+            if CODE_PATTERN.fullmatch(query):
+                cursor = self.clothes.find(
+                    {'$or': [{'code': query}, {'params.code': query}]},
+                    CARD_PROJECTION
+                ).sort('code', 1)
+            else:
+                terms = ' '.join(SEARCH_TERM_PATTERN.findall(query))
+                if not terms:
+                    return []
+                cursor = self.clothes.find(
+                    {'$text': {'$search': terms}},
+                    SEARCH_HIT_PROJECTION
+                ).sort([('score', {'$meta': 'textScore'})])
+
+            if skip:
+                cursor = cursor.skip(skip)
+            if limit:
+                cursor = cursor.limit(limit)
+            return await self._run(_read_items, cursor)
         except Exception as e:
             logger.error(f"Error searching items: {e}")
             raise
 
+    async def fuzzy_search_items(self, query, limit=5):
+        """Typo-tolerant search served from the in-memory trigram index.
+
+        6-digit codes still go through the exact indexed lookup. The index
+        is built on first use if rebuild_search_index has not run yet.
+        """
+        return await self._cached(
+            ('fuzzy', query, limit),
+            partial(self._fuzzy_search_items, query, limit)
+        )
+
+    async def _fuzzy_search_items(self, query, limit):
+        if CODE_PATTERN.fullmatch(query.strip()):
+            return await self.search_items(query, limit=limit)
+        if not self._search_index_ready:
+            await self.rebuild_search_index()
+
+        ids = [item_id for item_id, _ in self.search_index.search(query, limit=limit)]
+        if not ids:
+            return []
+        items = await self._run(
+            _read_items, self.clothes.find({'_id': {'$in': ids}}, CARD_PROJECTION)
+        )
+        rank = {item_id: position for position, item_id in enumerate(ids)}
+        return sorted(items, key=lambda item: rank[item.id])
+
+    async def rebuild_search_index(self):
+        """Build a fresh trigram index from the catalog and swap it in.
+
+        Items are streamed with a cursor on the database pool. Writes that
+        happen during the build are replayed onto the new index before it
+        replaces the old one.
+        """
+        async with self._search_index_lock:
+            self._search_index_backlog = []
+            try:
+                index = await self._run(self._build_search_index)
+                for change in self._search_index_backlog:
+                    self._apply_search_change(index, *change)
+                self.search_index = index
+                self._search_index_ready = True
+                logger.info(f"Fuzzy search index built with {len(index)} items")
+                return len(index)
+            finally:
+                self._search_index_backlog = None
+
+    def _build_search_index(self):
+        index = FuzzySearchIndex()
+        for item in self.clothes.find({}, SEARCH_PROJECTION, batch_size=1000):
+            index.add(item)
+        return index
+
+    def _update_search_index(self, operation, item_id, document):
+        if operation == 'reset':
+            # Rebuilt from scratch on the next fuzzy search
+            self._search_index_ready = False
+            return
+        if self._search_index_backlog is not None:
+            self._search_index_backlog.append((operation, item_id, document))
+        self._apply_search_change(self.search_index, operation, item_id, document)
+
+    @staticmethod
+    def _apply_search_change(index, operation, item_id, document):
+        if operation == 'delete':
+            index.remove(item_id)
+        elif document is not None:
+            index.add(document)
+
+    async def _apply_statistics_delta(self, delta):
+        """Apply a write's effect to the materialized statistics.
+
+        The item write and this $inc are separate operations, so a crash in
+        between leaves the statistics off by that write until the next
+        reconcile_statistics. Failures are logged rather than raised: the
+        item write has already succeeded.
+        """
+        if not delta:
+            return
+        try:
+            # No upsert: until the first reconcile there is nothing to adjust
+            await self._run(self.counters.update_one, {'_id': STATS_ID}, {'$inc': delta})
+        except (errors.PyMongoError, CircuitOpenError) as e:
+            logger.warning(f"Failed to update store statistics, run reconcile-stats: {e}")
+
+    async def get_statistics(self):
+        """Return the store statistics with a single point read.
+
+        The statistics document is created by reconcile_statistics the first
+        time it is missing. While MongoDB is unavailable the last statistics
+        read are returned as a StaleDict.
+        """
+        try:
+            statistics = await self._get_statistics()
+        except Exception as e:
+            if self._last_statistics is None or not is_unavailable(e):
+                raise
+            logger.warning(f"Serving last known statistics, MongoDB is unavailable: {e}")
+            return StaleDict(self._last_statistics)
+        self._last_statistics = statistics
+        return statistics
+
     @with_retry()
-    def get_statistics(self):
+    async def _get_statistics(self):
         try:
-            total_items = self.clothes.count_documents({})
-            items_with_photos = self.clothes.count_documents(
-                {"photo_key": {"$exists": True, "$ne": None}}
-            )
+            document = await self._run(self.counters.find_one, {'_id': STATS_ID})
+            if document is None:
+                await self.reconcile_statistics()
+                document = await self._run(self.counters.find_one, {'_id': STATS_ID})
 
-            # Get total stock
-            pipeline = [
-                {"$unwind": "$params"},
-                {"$unwind": "$params.stock"},
-                {"$group": {
-                    "_id": None,
-                    "total_stock": {"$sum": "$params.stock.quantity"}
-                }}
+            colors = [
+                {'_id': _decode_color_key(key), 'count': count}
+                for key, count in (document.get('colors') or {}).items()
+                if count
             ]
-            stock_result = list(self.clothes.aggregate(pipeline))
-            total_stock = stock_result[0]["total_stock"] if stock_result else 0
-
-            # Get items by color
-            pipeline = [
-                {"$unwind": "$params"},
-                {"$group": {
-                    "_id": "$params.color",
-                    "count": {"$sum": 1}
-                }}
-            ]
-            colors = list(self.clothes.aggregate(pipeline))
-
+            colors.sort(key=lambda color: (-color['count'], str(color['_id'])))
             return {
-                'total_items': total_items,
-                'items_with_photos': items_with_photos,
-                'total_stock': total_stock,
+                'total_items': document.get('total_items', 0),
+                'items_with_photos': document.get('items_with_photos', 0),
+                'total_stock': document.get('total_stock', 0),
                 'colors': colors
             }
         except Exception as e:
             logger.error(f"Error getting statistics: {e}")
             raise
 
+    @with_retry()
+    async def reconcile_statistics(self):
+        """Recompute the statistics from the catalog and replace the stored ones.
+
+        Returns the drift as a dict mapping each field that was wrong to a
+        (stored, actual) pair. Writes made while the aggregation runs may
+        still be off by their own delta.
+        """
+        actual = await self._run(self._compute_statistics)
+        stored = await self._run(self.counters.find_one, {'_id': STATS_ID}) or {}
+
+        document = {
+            'total_items': actual['total_items'],
+            'items_with_photos': actual['items_with_photos'],
+            'total_stock': actual['total_stock'],
+            'colors': {
+                _encode_color_key(color['_id']): color['count']
+                for color in actual['colors']
+            }
+        }
+
+        drift = {}
+        for field in ('total_items', 'items_with_photos', 'total_stock'):
+            if stored.get(field, 0) != document[field]:
+                drift[field] = (stored.get(field, 0), document[field])
+        stored_colors = stored.get('colors') or {}
+        for key in stored_colors.keys() | document['colors'].keys():
+            if stored_colors.get(key, 0) != document['colors'].get(key, 0):
+                drift[f"colors.{_decode_color_key(key)}"] = (
+                    stored_colors.get(key, 0),
+                    document['colors'].get(key, 0)
+                )
+
+        await self._run(self.counters.replace_one, {'_id': STATS_ID}, document, upsert=True)
+        if drift and stored:
+            logger.warning(f"Store statistics drifted: {drift}")
+        return drift
+
+    def _compute_statistics(self):
+        total_items = self.clothes.count_documents({})
+        items_with_photos = self.clothes.count_documents(
+            {"photo_key": {"$exists": True, "$ne": None}}
+        )
+
+        # Get total stock
+        pipeline = [
+            {"$unwind": "$params"},
+            {"$unwind": "$params.stock"},
+            {"$group": {
+                "_id": None,
+                "total_stock": {"$sum": "$params.stock.quantity"}
+            }}
+        ]
+        stock_result = list(self.clothes.aggregate(pipeline))
+        total_stock = stock_result[0]["total_stock"] if stock_result else 0
+
+        # Get items by color
+        pipeline = [
+            {"$unwind": "$params"},
+            {"$group": {
+                "_id": "$params.color",
+                "count": {"$sum": 1}
+            }}
+        ]
+        colors = list(self.clothes.aggregate(pipeline))
+
+        return {
+            'total_items': total_items,
+            'items_with_photos': items_with_photos,
+            'total_stock': total_stock,
+            'colors': colors
+        }
+
+    async def get_user_data(self, user_id):
+        """Return the stored user_data of a user, or None."""
+        document = await self._run(self.db[USER_DATA_COLLECTION].find_one, {'_id': user_id})
+        return document['data'] if document else None
+
+    async def get_conversations(self, name):
+        """Return the stored states of a conversation handler by conversation key."""
+        documents = await self._run(
+            lambda: list(self.db[CONVERSATIONS_COLLECTION].find({'name': name}))
+        )
+        return {tuple(document['key']): document['state'] for document in documents}
+
+    async def get_conversation_states(self, key, names):
+        """Return the stored states of the named conversations for a conversation key, by handler name."""
+        documents = await self._run(
+            lambda: list(self.db[CONVERSATIONS_COLLECTION].find(
+                {'key': list(key), 'name': {'$in': list(names)}},
+                {'name': 1, 'state': 1}
+            ))
+        )
+        return {document['name']: document['state'] for document in documents}
+
+    @with_retry()
+    async def bulk_write(self, collection_name, operations):
+        """Apply a batch of write operations to a collection in one round trip."""
+        return await self._run(
+            self.db[collection_name].bulk_write, operations, ordered=False
+        )
+
+    async def acquire_lease(self, name, holder, ttl):
+        """Take or renew a named lease for ``ttl`` seconds.
+
+        Succeeds when the lease is free, expired or already held by
+        ``holder``. Expiry is computed with the server clock ($$NOW), so
+        replicas do not need synchronized clocks.
+        """
+        try:
+            await self._run(
+                self.db[LEASES_COLLECTION].update_one,
+                {
+                    '_id': name,
+                    '$or': [
+                        {'holder': holder},
+                        {'$expr': {'$lt': ['$expires_at', '$$NOW']}},
+                    ]
+                },
+                [{'$set': {
+                    'holder': holder,
+                    'expires_at': {'$add': ['$$NOW', int(ttl * 1000)]},
+                }}],
+                upsert=True
+            )
+            return True
+        except errors.DuplicateKeyError:
+            # Held by someone else: the filter missed and the upsert collided
+            return False
+
+    async def release_lease(self, name, holder):
+        """Give up a lease if ``holder`` still has it."""
+        await self._run(self.db[LEASES_COLLECTION].delete_one, {'_id': name, 'holder': holder})
+
+    def cache_statistics(self):
+        """Return the result cache counters."""
+        return self.result_cache.stats()
+
+    def item_cache_statistics(self):
+        """Return the item cache counters and memory use."""
+        return self.item_cache.stats()
+
     def close(self):
-        self.client.close()
\ No newline at end of file
+        self.client.close()
+        self.executor.shutdown(wait=False)
\ No newline at end of file
@@ -0,0 +1,251 @@
+import asyncio
+import copy
+import logging
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+from bot.utils.conversation import ConversationStates
+from bot.config import (
+    CATALOG_SYNC_INTERVAL,
+    USER_DATA_COLLECTION,
+    CONVERSATIONS_COLLECTION,
+    PERSISTENCE_UPDATE_INTERVAL,
+    PERSISTENCE_FLUSH_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+def _conversation_id(name, key):
+    return f"{name}:{':'.join(str(part) for part in key)}"
+
+def _raise_unless_unavailable(error):
+    from bot.services.database import is_unavailable
+    if not is_unavailable(error):
+        raise error
+
+class MongoPersistence(BasePersistence):
+    """Keeps user_data and conversation states in MongoDB.
+
+    Only user_data and conversations are stored; bot, chat and callback data
+    are not used by the bot. user_data is loaded per user on the first update
+    from that user instead of all at startup. Writes are buffered per
+    document, so repeated changes to the same user or conversation collapse
+    into the latest one, and everything buffered is sent as one bulk_write
+    per collection ``flush_delay`` seconds after the first change.
+
+    With ``shared=True`` several replicas serve the same users: user_data
+    and conversation states are read from MongoDB on every update (see
+    load_shared_state) and written back as soon as it has been handled (see
+    save_shared_state), instead of being kept in memory. Pass
+    ``sync_catalog=False`` where a CatalogChangeListener already keeps the
+    catalog caches current.
+    """
+
+    def __init__(self, update_interval=PERSISTENCE_UPDATE_INTERVAL,
+                 flush_delay=PERSISTENCE_FLUSH_DELAY, shared=False, sync_catalog=True):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False,
+                chat_data=False,
+                user_data=True,
+                callback_data=False
+            ),
+            update_interval=update_interval
+        )
+        self.flush_delay = flush_delay
+        self.shared = shared
+        self.sync_catalog = sync_catalog
+        self._db = None
+        self._loaded_users = set()
+        self._pending = {USER_DATA_COLLECTION: {}, CONVERSATIONS_COLLECTION: {}}
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def db(self):
+        if self._db is None:
+            from bot.services.database import DatabaseService
+            self._db = DatabaseService()
+        return self._db
+
+    @db.setter
+    def db(self, value):
+        self._db = value
+
+    async def get_user_data(self):
+        # Loaded lazily in refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users and not self.shared:
+            return
+        try:
+            data = await self.db.get_user_data(user_id)
+        except Exception as e:
+            # Keep what this replica has; the update is still handled
+            _raise_unless_unavailable(e)
+            logger.warning(f"Using local user_data of {user_id}, MongoDB is unavailable: {e}")
+            return
+        if self.shared:
+            user_data.clear()
+        if data:
+            user_data.update(data)
+        self._loaded_users.add(user_id)
+
+    async def update_user_data(self, user_id, data):
+        from pymongo import ReplaceOne
+        self._loaded_users.add(user_id)
+        # A snapshot: PTB's dict keeps changing while the write waits to be
+        # encoded on the database pool
+        self._queue(
+            USER_DATA_COLLECTION,
+            user_id,
+            ReplaceOne({'_id': user_id}, {'_id': user_id, 'data': copy.deepcopy(data)}, upsert=True)
+        )
+
+    async def drop_user_data(self, user_id):
+        from pymongo import DeleteOne
+        self._queue(USER_DATA_COLLECTION, user_id, DeleteOne({'_id': user_id}))
+
+    async def get_conversations(self, name):
+        return await self.db.get_conversations(name)
+
+    async def update_conversation(self, name, key, new_state):
+        from pymongo import DeleteOne, ReplaceOne
+        document_id = _conversation_id(name, key)
+        if new_state is None:
+            operation = DeleteOne({'_id': document_id})
+        else:
+            operation = ReplaceOne(
+                {'_id': document_id},
+                {
+                    '_id': document_id,
+                    'name': name,
+                    'key': list(key),
+                    'state': copy.deepcopy(new_state)
+                },
+                upsert=True
+            )
+        self._queue(CONVERSATIONS_COLLECTION, document_id, operation)
+
+    async def load_shared_state(self, application, update):
+        """Bring this replica up to date before an update is handled.
+
+        Drops local catalog caches if another replica changed the catalog
+        (unless ``sync_catalog`` is off because a CatalogChangeListener does
+        that), and loads the stored state of the persistent conversation
+        that handles the update. Conversations that do not handle it are
+        neither read nor kept. While MongoDB is unavailable the local state
+        is used, so read-only commands keep working.
+        """
+        if self.sync_catalog:
+            try:
+                await self.db.sync_catalog_generation(max_age=CATALOG_SYNC_INTERVAL)
+            except Exception as e:
+                _raise_unless_unavailable(e)
+                logger.warning(f"Cannot check the catalog generation: {e}")
+        candidates = []
+        for group in sorted(application.handlers):
+            for handler in application.handlers[group]:
+                if not (isinstance(handler, ConversationHandler) and handler.persistent):
+                    continue
+                key = ConversationStates.key(handler, update)
+                if key is not None:
+                    candidates.append((group, handler, key))
+        if not candidates:
+            return
+        states = {}
+        try:
+            for key in {key for _, _, key in candidates}:
+                names = [handler.name for _, handler, candidate in candidates if candidate == key]
+                stored = await self.db.get_conversation_states(key, names)
+                states.update(((name, key), state) for name, state in stored.items())
+        except Exception as e:
+            _raise_unless_unavailable(e)
+            logger.warning(f"Using local conversation states, MongoDB is unavailable: {e}")
+            return
+        # Like PTB, only the first matching handler of a group handles the
+        # update, and whether it matches depends on its stored state
+        handled_groups = set()
+        for group, handler, key in candidates:
+            ConversationStates.set(handler, key, states.get((handler.name, key)))
+            if group in handled_groups or not handler.check_update(update):
+                ConversationStates.set(handler, key, None)
+            else:
+                handled_groups.add(group)
+
+    async def save_shared_state(self, application):
+        """Write the state changed by the update just handled.
+
+        While MongoDB is unavailable the writes stay queued for a later flush.
+        """
+        await application.update_persistence()
+        try:
+            await self.flush()
+        except Exception as e:
+            _raise_unless_unavailable(e)
+            logger.warning(f"Bot state kept in memory until MongoDB is available: {e}")
+
+    def _queue(self, collection_name, document_id, operation):
+        """Buffer a write, replacing any pending one for the same document."""
+        self._pending[collection_name][document_id] = operation
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        try:
+            await self._write_pending()
+        except Exception as e:
+            logger.error(f"Failed to write bot state to MongoDB: {e}")
+
+    async def _write_pending(self):
+        async with self._flush_lock:
+            for collection_name, pending in self._pending.items():
+                if not pending:
+                    continue
+                batch = list(pending.items())
+                pending.clear()
+                try:
+                    await self.db.bulk_write(
+                        collection_name,
+                        [operation for _, operation in batch]
+                    )
+                except Exception:
+                    # Put the writes back unless newer ones replaced them
+                    for document_id, operation in batch:
+                        pending.setdefault(document_id, operation)
+                    raise
+            logger.debug("Bot state written to MongoDB")
+
+    async def flush(self):
+        """Write everything still buffered; called on application shutdown."""
+        await self._write_pending()
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+
+    # Bot, chat and callback data are not persisted
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
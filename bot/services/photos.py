@@ -0,0 +1,226 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from bot.models.item import derivative_key
+from bot.config import (
+    PHOTO_JPEG_QUALITY,
+    PHOTO_MAX_BYTES,
+    PHOTO_MAX_PIXELS,
+    PHOTO_THUMB_SIZE,
+    PHOTO_WEB_SIZE,
+    PHOTO_WORKERS
+)
+
+logger = logging.getLogger(__name__)
+
+# Derivatives from smallest to largest: name -> longest side in pixels
+DERIVATIVES = {'thumb': PHOTO_THUMB_SIZE, 'web': PHOTO_WEB_SIZE}
+# Lowest JPEG quality tried when a derivative is over PHOTO_MAX_BYTES
+MIN_JPEG_QUALITY = 50
+
+def select_photo_key(photo_key, derivatives, min_size):
+    """Return the key of the smallest stored copy at least ``min_size`` pixels wide.
+
+    Falls back to the original when no derivative is large enough.
+    """
+    for name, size in DERIVATIVES.items():
+        if size >= min_size and name in derivatives:
+            return derivative_key(photo_key, name)
+    return photo_key
+
+def render_derivatives(source_path, sizes, quality, max_bytes, max_pixels):
+    """Write a JPEG of each size next to an image and return name -> path.
+
+    Runs in a worker process. The EXIF orientation is applied and then all
+    metadata is dropped, so no location or camera data is published.
+    """
+    from PIL import Image, ImageOps
+
+    root = os.path.splitext(source_path)[0]
+    paths = {}
+    with Image.open(source_path) as image:
+        # Checked before anything is decoded
+        if image.width * image.height > max_pixels:
+            raise ValueError(f"Image is too large: {image.width}x{image.height}")
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for name, size in sizes.items():
+            copy = image.copy()
+            copy.thumbnail((size, size), Image.Resampling.LANCZOS)
+            path = f"{root}.{name}.jpg"
+            with open(path, 'wb') as f:
+                f.write(_encode_jpeg(copy, quality, max_bytes))
+            paths[name] = path
+    return paths
+
+def _encode_jpeg(image, quality, max_bytes):
+    while True:
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+        if buffer.tell() <= max_bytes or quality <= MIN_JPEG_QUALITY:
+            return buffer.getvalue()
+        quality -= 10
+
+class PhotoService:
+    """Stores item photos together with smaller derivatives of them.
+
+    Decoding and resizing are CPU-bound, so they run in a process pool and
+    never block the event loop. Each photo gets one derivative per entry of
+    DERIVATIVES, stored next to it in S3 (see derivative_key). The names of
+    the stored derivatives are kept in the item's photo_derivatives field;
+    photos without derivatives are sent as they are.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            # Only cache a fully initialized instance, so a failed start
+            # (e.g. a missing setting) is retried instead of leaving a
+            # half-built singleton behind
+            instance = super(PhotoService, cls).__new__(cls)
+            instance._initialize()
+            cls._instance = instance
+        return cls._instance
+
+    def _initialize(self):
+        self._executor = None
+        self._storage = None
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            from bot.services.storage import StorageService
+            self._storage = StorageService()
+        return self._storage
+
+    @storage.setter
+    def storage(self, value):
+        self._storage = value
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            try:
+                # Spawned, not forked: a fork would copy the event loop,
+                # the MongoDB client and their locks into the workers
+                self._executor = ProcessPoolExecutor(
+                    max_workers=PHOTO_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            except OSError as e:
+                # No process pools where there is no /dev/shm, e.g. on Lambda
+                logger.warning(f"Process pool unavailable, processing photos on threads: {e}")
+                self._executor = ThreadPoolExecutor(
+                    max_workers=PHOTO_WORKERS,
+                    thread_name_prefix='photos'
+                )
+        return self._executor
+
+    async def render(self, source_path):
+        """Write the derivatives of a local image and return name -> path."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(
+            render_derivatives,
+            source_path,
+            DERIVATIVES,
+            PHOTO_JPEG_QUALITY,
+            PHOTO_MAX_BYTES,
+            PHOTO_MAX_PIXELS
+        ))
+
+    async def store(self, source_path, photo_key):
+        """Upload a photo and its derivatives; return the derivative names stored.
+
+        Raises if the photo itself cannot be uploaded. A photo that cannot be
+        processed is stored without derivatives.
+        """
+        await self.storage.upload_file(source_path, photo_key)
+        try:
+            return await self._store_derivatives(source_path, photo_key)
+        except Exception as e:
+            logger.warning(f"Stored photo {photo_key} without derivatives: {e}")
+            return []
+
+    async def backfill(self, photo_key):
+        """Create the derivatives of a photo already in S3; return their names."""
+        with tempfile.TemporaryDirectory() as directory:
+            source_path = os.path.join(directory, 'original')
+            stream = await self.storage.get_file(photo_key)
+            try:
+                with open(source_path, 'wb') as f:
+                    # Chunked, the original may be larger than memory allows
+                    while chunk := stream.read(1024 * 1024):
+                        f.write(chunk)
+            finally:
+                stream.close()
+            return await self._store_derivatives(source_path, photo_key)
+
+    async def _store_derivatives(self, source_path, photo_key):
+        paths = await self.render(source_path)
+        try:
+            names = list(paths)
+            results = await self.storage.upload_files(
+                [(paths[name], derivative_key(photo_key, name)) for name in names]
+            )
+        finally:
+            for path in paths.values():
+                os.remove(path)
+        for name, result in zip(names, results):
+            if result is not None:
+                logger.error(f"Error uploading {name} derivative of {photo_key}: {result}")
+        return [name for name, result in zip(names, results) if result is None]
+
+    async def backfill_catalog(self, db):
+        """Create the missing derivatives of every item and variant photo.
+
+        Returns (photos processed, photos failed). Failed photos are left
+        without derivatives, so running it again retries them.
+        """
+        documents = await db.get_items_missing_photo_derivatives()
+        semaphore = asyncio.Semaphore(PHOTO_WORKERS)
+        counts = {'done': 0, 'failed': 0}
+
+        async def backfill_photo(owner):
+            async with semaphore:
+                try:
+                    names = await self.backfill(owner['photo_key'])
+                except Exception as e:
+                    logger.error(f"Error creating derivatives of {owner['photo_key']}: {e}")
+                    counts['failed'] += 1
+                    return None
+            counts['done'] += 1
+            return names
+
+        async def backfill_item(document):
+            owners = {}
+            if isinstance(document.get('photo_key'), str) and not document.get('photo_derivatives'):
+                owners['photo_derivatives'] = document
+            for index, param in enumerate(document.get('params') or ()):
+                if isinstance(param.get('photo_key'), str) and not param.get('photo_derivatives'):
+                    owners[f'params.{index}.photo_derivatives'] = param
+            names = await asyncio.gather(*(backfill_photo(owner) for owner in owners.values()))
+            update = {
+                field: result for field, result in zip(owners, names)
+                if result is not None
+            }
+            if not update:
+                return
+            try:
+                await db.update_item(document['_id'], update)
+            except Exception as e:
+                logger.error(f"Error saving derivatives of item {document['_id']}: {e}")
+                counts['done'] -= len(update)
+                counts['failed'] += len(update)
+
+        await asyncio.gather(*(backfill_item(document) for document in documents))
+        return counts['done'], counts['failed']
+
+    def close(self):
+        if self._executor is not None:
+            # Renders are short, and a process pool left running at exit
+            # fails in its atexit hook
+            self._executor.shutdown(cancel_futures=True)
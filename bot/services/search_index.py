@@ -0,0 +1,137 @@
+import heapq
+import logging
+import re
+from array import array
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# Fields read from MongoDB to (re)build the index
+SEARCH_PROJECTION = {
+    'name': 1,
+    'description': 1,
+    'code': 1,
+    'params.color': 1,
+    'params.code': 1,
+}
+
+def trigrams(text):
+    """Return the trigrams of every word in text.
+
+    Words are padded with two leading blanks and one trailing blank so that
+    word starts weigh more and one- and two-letter words still produce
+    trigrams.
+    """
+    grams = set()
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        padded = f"  {word} "
+        for start in range(len(padded) - 2):
+            grams.add(padded[start:start + 3])
+    return grams
+
+def item_text(item):
+    """Return the searchable text of an item document."""
+    parts = [item.get('name'), item.get('description'), item.get('code')]
+    for param in item.get('params') or []:
+        parts.append(param.get('color'))
+        parts.append(param.get('code'))
+    return ' '.join(str(part) for part in parts if part)
+
+class FuzzySearchIndex:
+    """In-memory trigram inverted index over the catalog.
+
+    Every indexed item gets an integer slot. Each trigram maps to an
+    array('I') of the slots containing it, so a posting costs four bytes.
+    Removing an item only clears its slot; the postings are compacted once
+    more than half of the slots are dead.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._slot_ids = []
+        self._slot_sizes = array('I')
+        self._slots = {}
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, item):
+        """Index an item document, replacing any previous version of it."""
+        item_id = item['_id']
+        self.remove(item_id)
+        grams = trigrams(item_text(item))
+        slot = len(self._slot_ids)
+        self._slot_ids.append(item_id)
+        self._slot_sizes.append(len(grams))
+        self._slots[item_id] = slot
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('I')
+            postings.append(slot)
+
+    def remove(self, item_id):
+        """Drop an item from the index."""
+        slot = self._slots.pop(item_id, None)
+        if slot is None:
+            return
+        self._slot_ids[slot] = None
+        self._dead += 1
+        if self._dead > 1000 and self._dead > len(self._slots):
+            self._compact()
+
+    def search(self, query, limit=5, min_similarity=0.5):
+        """Return up to ``limit`` (item _id, score) pairs, best match first.
+
+        The score is the share of the query's trigrams found in the item, so
+        a typo in one letter of a word still leaves most of them matching.
+        Ties go to the item with fewer trigrams overall, i.e. the closer
+        match.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return []
+
+        counts = Counter()
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is not None:
+                counts.update(postings)
+
+        threshold = min_similarity * len(grams)
+        candidates = (
+            (count / len(grams), count / (self._slot_sizes[slot] or 1), slot)
+            for slot, count in counts.items()
+            if count >= threshold and self._slot_ids[slot] is not None
+        )
+        return [
+            (self._slot_ids[slot], score)
+            for score, _, slot in heapq.nlargest(limit, candidates)
+        ]
+
+    def _compact(self):
+        """Renumber live slots and drop dead ones from every posting list."""
+        remap = {}
+        slot_ids = []
+        slot_sizes = array('I')
+        for slot, item_id in enumerate(self._slot_ids):
+            if item_id is not None:
+                remap[slot] = len(slot_ids)
+                slot_ids.append(item_id)
+                slot_sizes.append(self._slot_sizes[slot])
+
+        postings = {}
+        for gram, slots in self._postings.items():
+            live = array('I', (remap[slot] for slot in slots if slot in remap))
+            if live:
+                postings[gram] = live
+
+        self._postings = postings
+        self._slot_ids = slot_ids
+        self._slot_sizes = slot_sizes
+        self._slots = {item_id: slot for slot, item_id in enumerate(slot_ids)}
+        self._dead = 0
+        logger.info(f"Compacted fuzzy search index to {len(slot_ids)} items")
@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from bot.config import (
+    SEND_RATE_GLOBAL,
+    SEND_RATE_CHAT,
+    SEND_RATE_GROUP,
+    SEND_BURST_CHAT,
+    SEND_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Priorities passed as rate_limit_args={'priority': ...}; lower goes first
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+# Endpoints that post into a chat and count towards Telegram's limits
+THROTTLED_PREFIXES = ('send', 'copyMessage', 'forwardMessage', 'editMessage')
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second up to ``capacity``.
+
+    A request may cost more than the capacity (e.g. a 10-photo album); it
+    waits for a full bucket and leaves it in debt.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost, now):
+        """Return the seconds until ``cost`` tokens can be taken."""
+        self._refill(now)
+        missing = min(cost, self.capacity) - self.tokens
+        return max(self.paused_until - now, missing / self.rate if missing > 0 else 0)
+
+    def take(self, cost, now):
+        self._refill(now)
+        self.tokens -= cost
+
+    def pause(self, seconds, now):
+        """Hand out nothing for ``seconds``, as Telegram asked with RetryAfter."""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 0)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+class SendScheduler(BaseRateLimiter):
+    """Central queue for outgoing messages, used by every bot API call.
+
+    Calls that post into a chat wait for a token from a global bucket and
+    from a bucket for their chat, sized after Telegram's limits (groups are
+    slower than private chats). Waiting calls are served by priority:
+    interactive replies go before bulk page renders, which pass
+    ``rate_limit_args={'priority': BULK}``. A RetryAfter pauses the chat for
+    the time Telegram asks and the call is queued again, up to
+    ``max_retries`` times. Other calls (callback answers, getUpdates, ...)
+    are not throttled.
+    """
+
+    def __init__(self, global_rate=SEND_RATE_GLOBAL, chat_rate=SEND_RATE_CHAT,
+                 group_rate=SEND_RATE_GROUP, chat_burst=SEND_BURST_CHAT,
+                 max_retries=SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._timer = None
+        self._waits = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+        self.retry_after_count = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(THROTTLED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        priority = (rate_limit_args or {}).get('priority', INTERACTIVE)
+        chat_id = data.get('chat_id')
+        cost = len(data.get('media') or ()) or 1
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(priority, chat_id, cost)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood control on {endpoint} to chat {chat_id}, retrying in {e.retry_after}s")
+                bucket = self._global if chat_id is None else self._chat_bucket(chat_id)
+                bucket.pause(e.retry_after, time.monotonic())
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                now = time.monotonic()
+                self._chats = {
+                    key: value for key, value in self._chats.items() if not value.is_idle(now)
+                }
+            # Group and channel ids are negative
+            rate = self.group_rate if str(chat_id).startswith(('-', '@')) else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, priority, chat_id, cost):
+        """Wait until the call may be made."""
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._sequence), chat_id, cost, future)
+        self._waiting.append(entry)
+        queued = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        finally:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+        waited = time.monotonic() - queued
+        stats = self._waits.setdefault(priority, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+    def _dispatch(self):
+        """Release every waiting call that has tokens, by priority, then arrival."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        next_check = None
+        blocked_chats = set()
+        for entry in sorted(self._waiting, key=lambda entry: entry[:2]):
+            _, _, chat_id, cost, future = entry
+            if future.done():
+                self._waiting.remove(entry)
+                continue
+            wait = self._global.wait_time(cost, now)
+            if wait > 0:
+                # Nothing of lower priority may overtake on the global limit
+                next_check = wait if next_check is None else min(next_check, wait)
+                break
+            if chat_id in blocked_chats:
+                continue
+            bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+            wait = bucket.wait_time(cost, now) if bucket else 0
+            if wait > 0:
+                # Keep the chat's calls in order behind the blocked one
+                blocked_chats.add(chat_id)
+                next_check = wait if next_check is None else min(next_check, wait)
+                continue
+            self._global.take(cost, now)
+            if bucket:
+                bucket.take(cost, now)
+            self._waiting.remove(entry)
+            future.set_result(None)
+
+        if next_check is not None:
+            self._timer = asyncio.get_running_loop().call_later(next_check, self._dispatch)
+
+    def stats(self):
+        """Return queue depth, wait times per priority and flood control hits."""
+        stats = {'queue_depth': len(self._waiting)}
+        for priority, name in PRIORITY_NAMES.items():
+            count, total, longest = self._waits[priority]
+            stats[f'{name}_sent'] = count
+            stats[f'{name}_avg_wait_ms'] = round(total / count * 1000) if count else 0
+            stats[f'{name}_max_wait_ms'] = round(longest * 1000)
+        stats['retry_after'] = self.retry_after_count
+        return stats
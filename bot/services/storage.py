@@ -1,53 +1,87 @@
+import asyncio
 import logging
-from functools import wraps
-from typing import Any, Callable
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable
 import boto3
 from botocore.config import Config
-from botocore.exceptions import BotoCoreError, ClientError
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+from bot.utils.circuit_breaker import CircuitBreaker
+from bot.utils.retry import RetryPolicy
 from bot.config import (
-    AWS_ACCESS_KEY,
-    AWS_SECRET_KEY,
-    AWS_REGION,
-    S3_BUCKET_NAME,
     AWS_TIMEOUT,
-    AWS_MAX_RETRIES
+    AWS_MAX_RETRIES,
+    AWS_RETRY_DEADLINE,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    RETRY_BASE_DELAY,
+    RETRY_MAX_DELAY,
+    S3_MAX_CONCURRENCY,
+    S3_SPOOL_MAX_BYTES
 )
 
 logger = logging.getLogger(__name__)
 
+# Error codes S3 returns for throttling and passing server trouble
+TRANSIENT_ERROR_CODES = {
+    'InternalError', 'RequestTimeout', 'RequestTimeTooSkewed', 'ServiceUnavailable',
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded'
+}
+
+def is_transient_error(error):
+    """Whether a failed S3 call may succeed if tried again.
+
+    Connection errors, timeouts, throttling and 5xx responses are transient;
+    missing keys, access denied and other 4xx responses are not.
+    """
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        response = error.response or {}
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return (
+            response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES
+            or status == 429
+            or status >= 500
+        )
+    return False
+
 def with_s3_retry(max_retries: int = AWS_MAX_RETRIES) -> Callable:
-    def decorator(func: Callable) -> Callable:
-        @wraps(func)
-        def wrapper(*args, **kwargs) -> Any:
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except (BotoCoreError, ClientError) as e:
-                    last_error = e
-                    logger.warning(f"S3 operation failed (attempt {attempt + 1}/{max_retries}): {e}")
-                    if attempt < max_retries - 1:
-                        continue
-            raise last_error
-        return wrapper
-    return decorator
+    return RetryPolicy(
+        'S3',
+        is_transient_error,
+        max_attempts=max_retries,
+        deadline=AWS_RETRY_DEADLINE,
+        base_delay=RETRY_BASE_DELAY,
+        max_delay=RETRY_MAX_DELAY
+    )
 
 class StorageService:
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(StorageService, cls).__new__(cls)
-            cls._instance._initialize()
+            # Only cache a fully initialized instance, so a failed start
+            # (e.g. a missing setting) is retried instead of leaving a
+            # half-built singleton behind
+            instance = super(StorageService, cls).__new__(cls)
+            instance._initialize()
+            cls._instance = instance
         return cls._instance
 
     def _initialize(self):
+        from bot.config import AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_REGION, S3_BUCKET_NAME
+
         try:
             config = Config(
                 region_name=AWS_REGION,
                 connect_timeout=AWS_TIMEOUT,
                 read_timeout=AWS_TIMEOUT,
-                retries={'max_attempts': AWS_MAX_RETRIES}
+                # with_s3_retry does the retrying; botocore retrying as well
+                # would multiply the attempts
+                retries={'total_max_attempts': 1}
             )
             
             self.s3 = boto3.client(
@@ -57,36 +91,120 @@ class StorageService:
                 config=config
             )
             self.bucket_name = S3_BUCKET_NAME
-            
-            # Test connection by listing buckets
-            self.s3.list_buckets()
-            logger.info("Successfully connected to AWS S3")
+            # While S3 is down transfers fail at once instead of timing out
+            self.circuit_breaker = CircuitBreaker(
+                'S3',
+                is_transient_error,
+                failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=CIRCUIT_RESET_TIMEOUT
+            )
+            # boto3 is blocking; transfers run on this pool, which also caps
+            # how many of them are in flight at once.
+            self.executor = ThreadPoolExecutor(
+                max_workers=S3_MAX_CONCURRENCY,
+                thread_name_prefix='s3'
+            )
+            # No connection probe here: it costs a round trip on every cold
+            # start, and check_health() covers it for long-running processes.
+            logger.info("AWS S3 client initialized")
         except Exception as e:
             logger.error(f"Failed to initialize S3 connection: {e}")
             raise
 
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking boto3 call on the S3 thread pool.
+
+        Raises CircuitOpenError at once while S3 is known to be down.
+        """
+        loop = asyncio.get_running_loop()
+        return await self.circuit_breaker.call(
+            loop.run_in_executor, self.executor, partial(func, *args, **kwargs)
+        )
+
     @with_s3_retry()
-    def upload_file(self, file_path, file_key):
+    async def upload_file(self, file_path, file_key):
         try:
-            self.s3.upload_file(file_path, self.bucket_name, file_key)
+            await self._run(self.s3.upload_file, file_path, self.bucket_name, file_key)
             logger.info(f"Successfully uploaded file {file_key}")
         except Exception as e:
             logger.error(f"Error uploading file {file_key}: {e}")
             raise
 
     @with_s3_retry()
-    def get_file(self, file_key):
+    async def upload_fileobj(self, fileobj, file_key):
         try:
-            return self.s3.get_object(Bucket=self.bucket_name, Key=file_key)
+            fileobj.seek(0)
+            await self._run(self.s3.upload_fileobj, fileobj, self.bucket_name, file_key)
+            logger.info(f"Successfully uploaded file {file_key}")
         except Exception as e:
+            logger.error(f"Error uploading file {file_key}: {e}")
+            raise
+
+    @with_s3_retry()
+    async def get_file(self, file_key):
+        """Download an object and return it as a file positioned at the start.
+
+        The body is streamed in chunks into a spooled temporary file that only
+        stays in memory up to S3_SPOOL_MAX_BYTES. Callers must close it.
+        """
+        fileobj = tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MAX_BYTES)
+        try:
+            await self._run(self.s3.download_fileobj, self.bucket_name, file_key, fileobj)
+            fileobj.seek(0)
+            return fileobj
+        except Exception as e:
+            fileobj.close()
             logger.error(f"Error getting file {file_key}: {e}")
             raise
 
     @with_s3_retry()
-    def delete_file(self, file_key):
+    async def delete_file(self, file_key):
         try:
-            self.s3.delete_object(Bucket=self.bucket_name, Key=file_key)
+            await self._run(self.s3.delete_object, Bucket=self.bucket_name, Key=file_key)
             logger.info(f"Successfully deleted file {file_key}")
         except Exception as e:
             logger.error(f"Error deleting file {file_key}: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    async def upload_files(self, files):
+        """Upload (file_path, file_key) pairs concurrently.
+
+        Returns one entry per pair: None on success or the raised exception.
+        """
+        return await asyncio.gather(
+            *(self.upload_file(file_path, file_key) for file_path, file_key in files),
+            return_exceptions=True
+        )
+
+    async def get_files(self, file_keys):
+        """Download several objects concurrently.
+
+        Returns one entry per key: the open file or the raised exception.
+        """
+        return await asyncio.gather(
+            *(self.get_file(file_key) for file_key in file_keys),
+            return_exceptions=True
+        )
+
+    @with_s3_retry()
+    async def delete_files(self, file_keys):
+        """Delete several objects with batched DeleteObjects requests."""
+        file_keys = [key for key in file_keys if key]
+        # DeleteObjects accepts at most 1000 keys per request
+        for start in range(0, len(file_keys), 1000):
+            batch = file_keys[start:start + 1000]
+            try:
+                response = await self._run(
+                    self.s3.delete_objects,
+                    Bucket=self.bucket_name,
+                    Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True}
+                )
+                for error in response.get('Errors', []):
+                    logger.error(f"Error deleting file {error.get('Key')}: {error.get('Message')}")
+                logger.info(f"Successfully deleted {len(batch)} files")
+            except Exception as e:
+                logger.error(f"Error deleting files {batch}: {e}")
+                raise
+
+    def close(self):
+        self.executor.shutdown(wait=False)
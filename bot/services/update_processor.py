@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, but one at a time per user.
+
+    Up to ``max_concurrent_updates`` updates run at once. Updates from the
+    same user wait for each other and run in arrival order. That covers the
+    (chat, user) key of the conversation handlers, and also user_data, which
+    holds the draft item and is shared by all chats of a user. Updates
+    without a user are ordered per chat. A user waits for their turn before
+    taking a slot, so one busy operator cannot use up the limit for everyone
+    else.
+
+    ``after_update``, if set, is awaited with each update once it has been
+    processed, still in its user's turn.
+    """
+
+    def __init__(self, max_concurrent_updates, after_update=None):
+        super().__init__(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks = {}
+        self.after_update = after_update
+
+    @staticmethod
+    def _key(update):
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return ('user', user.id)
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return ('chat', chat.id)
+        return None
+
+    async def process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+        if self.after_update is not None:
+            try:
+                await self.after_update(update)
+            except Exception as e:
+                logger.error(f"Error after processing update {update}: {e}")
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,63 @@
+import hmac
+import json
+import logging
+from telegram import Update
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.web import Application, RequestHandler
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class UpdateHandler(RequestHandler):
+    """Accepts one update POSTed by Telegram and queues it for the application."""
+
+    def initialize(self, bot_application, secret_token):
+        # Tornado's own application is self.application
+        self.bot_application = bot_application
+        self.secret_token = secret_token
+
+    async def post(self):
+        token = self.request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(token, self.secret_token):
+            self.send_error(403)
+            return
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            self.send_error(400)
+            return
+        await self.bot_application.update_queue.put(update)
+        self.set_status(200)
+
+class WebhookServer:
+    """Serves Telegram's webhook POSTs without registering the webhook.
+
+    PTB's Updater.start_webhook always calls setWebhook. Behind a load
+    balancer only one replica should do that (see start_updates), so every
+    replica serves updates through this server instead, and the updates go
+    into the application's update_queue just as the Updater would put them.
+    """
+
+    def __init__(self, application, listen, port, url_path, secret_token):
+        if not secret_token:
+            raise ValueError("A webhook needs a secret token")
+        self.listen = listen
+        self.port = port
+        self._server = HTTPServer(Application([(
+            rf"/{url_path.strip('/')}/?",
+            UpdateHandler,
+            {'bot_application': application, 'secret_token': secret_token}
+        )]))
+
+    def start(self):
+        sockets = bind_sockets(self.port, address=self.listen)
+        # The bound port, in case port 0 asked for any free one
+        self.port = sockets[0].getsockname()[1]
+        self._server.add_sockets(sockets)
+
+    async def stop(self):
+        self._server.stop()
+        await self._server.close_all_connections()
@@ -10,8 +10,7 @@ def mock_db():
     """Create a properly configured mock database service."""
     db = create_autospec(DatabaseService)
     db.get_next_code.return_value = "000001"
-    db.clothes = MagicMock()
-    db.clothes.count_documents.return_value = 0
+    db.count_items.return_value = 0
     return db
 
 @pytest.fixture
@@ -21,6 +20,8 @@ def mock_storage():
     storage.upload_file = AsyncMock()
     storage.get_file = AsyncMock()
     storage.delete_file = AsyncMock()
+    storage.get_files = AsyncMock()
+    storage.delete_files = AsyncMock()
     return storage
 
 @pytest.fixture
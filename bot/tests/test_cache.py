@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+from functools import partial
+
+from bot.services.cache import ItemCache, ResultCache, is_stale
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = ResultCache(max_entries=10, ttl=30)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return ['item']
+
+    results = await asyncio.gather(*(cache.get_or_load('key', loader) for _ in range(5)))
+
+    assert calls == 1
+    assert all(result == ['item'] for result in results)
+    assert await cache.get_or_load('key', loader) == ['item']
+    stats = cache.stats()
+    assert (stats['misses'], stats['coalesced'], stats['hits']) == (1, 4, 1)
+
+@pytest.mark.asyncio
+async def test_invalidate_drops_entries_and_in_flight_results():
+    cache = ResultCache(max_entries=10, ttl=30)
+    values = iter(['old', 'new', 'newer'])
+
+    async def loader():
+        return next(values)
+
+    assert await cache.get_or_load('key', loader) == 'old'
+    cache.invalidate('update', 'some-id')
+    assert await cache.get_or_load('key', loader) == 'new'
+
+    async def racing_loader():
+        cache.invalidate()
+        return 'stale'
+
+    # A load that overlaps a write is returned but never cached
+    assert await cache.get_or_load('other', racing_loader) == 'stale'
+    assert await cache.get_or_load('other', loader) == 'newer'
+
+@pytest.mark.asyncio
+async def test_lru_eviction_and_failed_loads():
+    cache = ResultCache(max_entries=2, ttl=30)
+
+    async def loader():
+        return 'value'
+
+    for key in ('a', 'b', 'a', 'c'):
+        await cache.get_or_load(key, loader)
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['entries'] == 2
+
+    async def failing_loader():
+        raise RuntimeError('backend down')
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load('d', failing_loader)
+    assert await cache.get_or_load('d', loader) == 'value'
+
+@pytest.mark.asyncio
+async def test_last_known_results_survive_invalidation_marked_stale():
+    cache = ResultCache(max_entries=10, ttl=30)
+
+    async def loader():
+        return ['a', 'b', 'c']
+
+    await cache.get_or_load('key', loader)
+    cache.invalidate()
+
+    stale = cache.last_known('key')
+    assert stale == ['a', 'b', 'c'] and is_stale(stale)
+    assert is_stale(stale[:2]) and not is_stale(['a'])
+    assert cache.last_known('other') is None
+    assert cache.stats()['stale_served'] == 1
+
+@pytest.mark.asyncio
+async def test_item_cache_serves_copies_and_negative_entries():
+    cache = ItemCache(max_entries=10, ttl=30)
+    loads = []
+
+    async def load(item):
+        loads.append(item)
+        return item
+
+    item = {'_id': 1, 'code': '000001', 'name': 'Shirt'}
+    first = await cache.get_or_load('000001', partial(load, dict(item)))
+    first['name'] = 'changed by a handler'
+    assert await cache.get_or_load('000001', partial(load, None)) == item
+    assert await cache.get_or_load('999999', partial(load, None)) is None
+    assert await cache.get_or_load('999999', partial(load, item)) is None
+
+    assert len(loads) == 2
+    stats = cache.stats()
+    assert (stats['hits'], stats['negative_hits'], stats['misses']) == (1, 1, 2)
+    assert stats['bytes'] > 0
+
+@pytest.mark.asyncio
+async def test_item_cache_drops_entries_on_writes():
+    cache = ItemCache(max_entries=10, ttl=30)
+
+    async def load(item):
+        return item
+
+    await cache.get_or_load('000001', partial(load, {'_id': 1, 'code': '000001'}))
+    await cache.get_or_load('000002', partial(load, None))
+
+    # Updates and deletes find the entry by _id, inserts by code
+    cache.on_catalog_change('update', 1, None)
+    cache.on_catalog_change('insert', 2, {'_id': 2, 'code': '000002'})
+    assert cache.stats()['entries'] == 0 and cache.stats()['bytes'] == 0
+
+    # A lookup that raced with a write is not stored
+    async def racing_load():
+        cache.on_catalog_change('delete', 1)
+        return {'_id': 1, 'code': '000001'}
+
+    await cache.get_or_load('000001', racing_load)
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,82 @@
+import asyncio
+import pytest
+from unittest.mock import create_autospec
+from pymongo.errors import OperationFailure
+
+from bot.services.change_listener import CatalogChangeListener
+from bot.services.database import DatabaseService
+
+class FakeStream:
+    """Replays change events, then sets stop_event."""
+
+    def __init__(self, events, stop_event):
+        self.events = list(events)
+        self.stop_event = stop_event
+        self.resume_token = None
+        self.alive = True
+
+    def try_next(self):
+        if not self.events:
+            self.stop_event.set()
+            return None
+        change = self.events.pop(0)
+        self.resume_token = change['_id']
+        return change
+
+    def close(self):
+        pass
+
+def make_listener():
+    listener = CatalogChangeListener(poll_interval=0.01)
+    listener.db = create_autospec(DatabaseService)
+    listener.db.get_resume_token.return_value = None
+    listener.db.next_catalog_change.side_effect = lambda stream: stream.try_next()
+    return listener
+
+@pytest.mark.asyncio
+async def test_changes_are_published_and_the_resume_token_saved():
+    listener = make_listener()
+    stop_event = asyncio.Event()
+    events = [
+        {'_id': 't1', 'operationType': 'insert', 'ns': {'coll': 'clothes'},
+         'documentKey': {'_id': 1}, 'fullDocument': {'_id': 1, 'code': '000001'}},
+        {'_id': 't2', 'operationType': 'update', 'ns': {'coll': 'clothes'},
+         'documentKey': {'_id': 1}, 'fullDocument': {'_id': 1, 'code': '000002'}},
+        {'_id': 't3', 'operationType': 'update', 'ns': {'coll': 'counters'},
+         'documentKey': {'_id': 'catalog_generation'},
+         'fullDocument': {'_id': 'catalog_generation', 'value': 7}},
+        {'_id': 't4', 'operationType': 'delete', 'ns': {'coll': 'clothes'},
+         'documentKey': {'_id': 1}},
+        # A cached file_id, which changes nothing in the catalog
+        {'_id': 't5', 'operationType': 'update', 'ns': {'coll': 'clothes'},
+         'documentKey': {'_id': 2}, 'fullDocument': {'_id': 2, 'code': '000003'},
+         'updateDescription': {'updatedFields': {'photo_file_id': 'F'}, 'removedFields': []}},
+    ]
+    listener.db.watch_catalog.return_value = FakeStream(events, stop_event)
+
+    await listener.run(stop_event)
+
+    published = [call.args[:2] for call in listener.db.apply_catalog_change.call_args_list]
+    assert published == [('insert', 1), ('update', 1), ('delete', 1)]
+    listener.db.note_catalog_generation.assert_called_once_with(7)
+    listener.db.save_resume_token.assert_awaited_with('catalog', 't5')
+
+@pytest.mark.asyncio
+async def test_falls_back_to_polling_without_change_streams():
+    listener = make_listener()
+    stop_event = asyncio.Event()
+    listener.db.watch_catalog.side_effect = OperationFailure(
+        'The $changeStream stage is only supported on replica sets', 40573
+    )
+
+    async def sync_catalog_generation():
+        if listener.db.sync_catalog_generation.await_count == 2:
+            stop_event.set()
+        return False
+
+    listener.db.sync_catalog_generation.side_effect = sync_catalog_generation
+
+    await asyncio.wait_for(listener.run(stop_event), timeout=5)
+
+    assert listener.db.sync_catalog_generation.await_count == 2
+    listener.db.apply_catalog_change.assert_not_called()
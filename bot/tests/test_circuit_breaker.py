@@ -0,0 +1,64 @@
+import pytest
+from unittest.mock import patch
+
+from bot.utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+def make_breaker():
+    return CircuitBreaker(
+        'MongoDB',
+        lambda e: isinstance(e, ConnectionError),
+        failure_threshold=2,
+        reset_timeout=30
+    )
+
+async def fail():
+    raise ConnectionError('no primary')
+
+async def succeed():
+    return 'ok'
+
+@pytest.mark.asyncio
+async def test_circuit_opens_after_consecutive_failures_and_fails_fast():
+    breaker = make_breaker()
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail)
+    assert breaker.state == 'open'
+
+    with pytest.raises(CircuitOpenError) as error:
+        await breaker.call(succeed)
+    assert error.value.service == 'MongoDB'
+    assert breaker.stats()['rejected_calls'] == 1
+
+@pytest.mark.asyncio
+async def test_non_transient_errors_do_not_open_the_circuit():
+    breaker = make_breaker()
+
+    async def duplicate():
+        raise ValueError('duplicate key')
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            await breaker.call(duplicate)
+    assert breaker.state == 'closed'
+
+@pytest.mark.asyncio
+async def test_half_open_probe_closes_or_reopens_the_circuit():
+    breaker = make_breaker()
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail)
+
+    with patch('bot.utils.circuit_breaker.time.monotonic', return_value=breaker.opened_at + 31):
+        # The probe fails, so the circuit opens again for another reset_timeout
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail)
+        assert breaker.state == 'open'
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(succeed)
+
+    with patch('bot.utils.circuit_breaker.time.monotonic', return_value=breaker.opened_at + 31):
+        assert await breaker.call(succeed) == 'ok'
+    assert breaker.state == 'closed'
+    assert breaker.stats()['times_opened'] == 1
@@ -0,0 +1,40 @@
+import telegram
+from datetime import datetime, timezone
+from telegram import Chat, Message, Update, User
+from telegram.ext import ConversationHandler
+from telegram.ext._utils.trackingdict import TrackingDict
+
+from bot.utils.conversation import PTB_VERSION, ConversationStates, create_conversation_handler
+
+def _update(**kwargs):
+    message = Message(
+        message_id=1,
+        date=datetime.now(timezone.utc),
+        chat=Chat(456, Chat.PRIVATE),
+        from_user=User(789, 'Test', False),
+        text='Red'
+    )
+    return Update(update_id=1, **{'message': message, **kwargs})
+
+def test_adapter_is_checked_against_the_installed_ptb():
+    # ConversationStates uses private ConversationHandler attributes; check
+    # them again against the new release before updating PTB_VERSION
+    assert telegram.__version__ == PTB_VERSION
+
+def test_key_matches_ptb():
+    handler = create_conversation_handler(entry_points=[], states={}, fallbacks=[])
+    update = _update()
+
+    assert ConversationStates.key(handler, update) == handler._get_key(update) == (456, 789)
+    assert ConversationStates.key(handler, Update(update_id=2, channel_post=update.message)) is None
+
+def test_states_are_set_without_being_tracked():
+    handler = ConversationHandler(entry_points=[], states={}, fallbacks=[], name='add', persistent=True)
+    handler._conversations = TrackingDict()
+
+    ConversationStates.set(handler, (456, 789), 3)
+    assert ConversationStates.get(handler, (456, 789)) == 3
+    ConversationStates.set(handler, (456, 789), None)
+
+    assert ConversationStates.get(handler, (456, 789)) is None
+    assert handler._conversations.pop_accessed_keys() == set()
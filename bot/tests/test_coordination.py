@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.coordination import LeaderLease
+
+@pytest.fixture
+def lease():
+    lease = LeaderLease('polling', ttl=0.03, holder='replica-1')
+    lease.db = MagicMock()
+    lease.db.acquire_lease = AsyncMock()
+    lease.db.release_lease = AsyncMock()
+    return lease
+
+@pytest.mark.asyncio
+async def test_standby_waits_until_the_lease_is_free(lease):
+    lease.db.acquire_lease.side_effect = [False, False, True]
+
+    assert await lease.acquire(asyncio.Event())
+    assert lease.held
+    assert lease.db.acquire_lease.await_count == 3
+    lease.db.acquire_lease.assert_awaited_with('polling', 'replica-1', 0.03)
+
+@pytest.mark.asyncio
+async def test_acquire_gives_up_when_stopped(lease):
+    lease.db.acquire_lease.return_value = False
+    stop_event = asyncio.Event()
+    stop_event.set()
+
+    assert not await lease.acquire(stop_event)
+
+@pytest.mark.asyncio
+async def test_leader_steps_down_when_renewals_fail(lease):
+    lease.db.acquire_lease.return_value = True
+    await lease.try_acquire()
+    lease.db.acquire_lease.side_effect = ConnectionError('mongo unreachable')
+    on_lost = MagicMock()
+
+    await asyncio.wait_for(lease.keep_alive(on_lost), timeout=1)
+
+    on_lost.assert_called_once()
+    await lease.release()
+    lease.db.release_lease.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_leader_releases_on_shutdown(lease):
+    lease.db.acquire_lease.return_value = True
+    await lease.acquire(asyncio.Event())
+
+    await lease.release()
+
+    lease.db.release_lease.assert_awaited_once_with('polling', 'replica-1')
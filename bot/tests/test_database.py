@@ -1,5 +1,9 @@
+import asyncio
 import pytest
-from bot.services.database import DatabaseService
+from unittest.mock import AsyncMock, MagicMock
+from pymongo import errors
+from bot.config import CODE_BLOCK_SIZE
+from bot.services.database import DatabaseService, _apply_set, _statistics_delta
 
 @pytest.fixture
 def db_service():
@@ -8,15 +12,46 @@ def db_service():
     # Clean up test data after each test
     service.clothes.delete_many({})
 
-def test_get_next_code(db_service):
-    code1 = db_service.get_next_code()
-    code2 = db_service.get_next_code()
+@pytest.mark.asyncio
+async def test_get_next_code(db_service):
+    code1 = await db_service.get_next_code()
+    code2 = await db_service.get_next_code()
     
     assert len(code1) == 6
     assert len(code2) == 6
     assert int(code2) == int(code1) + 1
 
-def test_add_and_get_item(db_service):
+@pytest.mark.asyncio
+async def test_get_next_codes_are_unique_across_blocks(db_service):
+    codes = await db_service.get_next_codes(250)
+    codes += await asyncio.gather(*(db_service.get_next_code() for _ in range(20)))
+
+    assert len(set(codes)) == len(codes) == 270
+    assert all(len(code) == 6 for code in codes)
+
+@pytest.mark.asyncio
+async def test_codes_are_reserved_one_block_at_a_time():
+    service = object.__new__(DatabaseService)
+    service._code_lock = asyncio.Lock()
+    service._next_code, service._code_block_end = 1, 0
+    counter = 0
+
+    async def reserve(size):
+        nonlocal counter
+        counter += size
+        return counter
+
+    service._reserve_codes = AsyncMock(side_effect=reserve)
+
+    codes = [await service.get_next_code() for _ in range(3)]
+    codes += await service.get_next_codes(CODE_BLOCK_SIZE)
+
+    assert codes[:3] == ['000001', '000002', '000003']
+    assert [int(code) for code in codes] == list(range(1, CODE_BLOCK_SIZE + 4))
+    assert service._reserve_codes.await_count == 2
+
+@pytest.mark.asyncio
+async def test_add_and_get_item(db_service):
     test_item = {
         'code': '000001',
         'name': 'Test Item',
@@ -26,49 +61,146 @@ def test_add_and_get_item(db_service):
     }
     
     # Add item
-    result = db_service.add_item(test_item)
-    assert result.inserted_id is not None
+    item_id = await db_service.add_item(test_item)
+    assert item_id is not None
     
     # Get item
-    item = db_service.get_item('000001')
+    item = await db_service.get_item('000001')
     assert item is not None
-    assert item['name'] == 'Test Item'
-    assert item['description'] == 'Test Description'
+    assert item.name == 'Test Item'
+    assert item.id == item_id
+    # Lookups only load what /change and /delete need
+    assert item.description is None
+
+@pytest.mark.asyncio
+async def test_add_item_retries_only_the_insert():
+    service = object.__new__(DatabaseService)
+    service._listeners = []
+    service.clothes = MagicMock()
+    service._apply_statistics_delta = AsyncMock()
+    service._bump_generation = AsyncMock()
+    # The first attempt is stored but its reply lost; the retry finds it
+    service._run = AsyncMock(side_effect=[
+        errors.AutoReconnect('connection reset'),
+        errors.DuplicateKeyError('duplicate', 11000, {'keyPattern': {'_id': 1}}),
+    ])
+    item = {'code': '000001', 'name': 'Test Item'}
+
+    item_id = await service.add_item(item)
+
+    assert item_id == item['_id'] and item['rev'] == 1
+    assert service._run.await_count == 2
+    service._apply_statistics_delta.assert_awaited_once()
+    service._bump_generation.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_caching_a_file_id_is_not_a_catalog_change():
+    service = object.__new__(DatabaseService)
+    service.clothes = MagicMock()
+    service._bump_generation = AsyncMock()
+    service._publish = MagicMock()
+    service._run = AsyncMock()
+
+    await service.set_photo_file_id(1, 'photo_thumb_file_id', 'T1')
+
+    service._run.assert_awaited_once_with(
+        service.clothes.update_one, {'_id': 1}, {'$set': {'photo_thumb_file_id': 'T1'}}
+    )
+    service._bump_generation.assert_not_called()
+    service._publish.assert_not_called()
+    with pytest.raises(ValueError):
+        await service.set_photo_file_id(1, 'name', 'T1')
 
-def test_update_item(db_service):
+@pytest.mark.asyncio
+async def test_update_item(db_service):
     # First add an item
     test_item = {
         'code': '000001',
         'name': 'Test Item',
         'description': 'Test Description'
     }
-    result = db_service.add_item(test_item)
-    item_id = result.inserted_id
+    item_id = await db_service.add_item(test_item)
     
     # Update the item
-    update_result = db_service.update_item(
+    update_result = await db_service.update_item(
         item_id,
         {'name': 'Updated Name'}
     )
-    assert update_result.modified_count == 1
+    assert update_result is True
     
     # Verify the update
-    updated_item = db_service.get_item('000001')
-    assert updated_item['name'] == 'Updated Name'
+    updated_item = await db_service.get_item('000001')
+    assert updated_item.name == 'Updated Name'
 
-def test_delete_item(db_service):
+@pytest.mark.asyncio
+async def test_delete_item(db_service):
     # First add an item
     test_item = {
         'code': '000001',
         'name': 'Test Item'
     }
-    result = db_service.add_item(test_item)
-    item_id = result.inserted_id
+    item_id = await db_service.add_item(test_item)
     
     # Delete the item
-    delete_result = db_service.delete_item(item_id)
-    assert delete_result.deleted_count == 1
+    delete_result = await db_service.delete_item(item_id)
+    assert delete_result is True
     
     # Verify the deletion
-    item = db_service.get_item('000001')
-    assert item is None
\ No newline at end of file
+    item = await db_service.get_item('000001')
+    assert item is None
+
+@pytest.mark.asyncio
+async def test_ensure_indexes_is_idempotent(db_service):
+    await db_service.ensure_indexes()
+    await db_service.ensure_indexes()
+
+    report = await db_service.check_indexes()
+    statuses = {index['name']: index['status'] for index in report}
+    assert 'missing' not in statuses.values()
+    assert 'code_unique' in statuses
+
+@pytest.mark.asyncio
+async def test_search_items_by_code_and_text(db_service):
+    await db_service.ensure_indexes()
+    await db_service.add_item({
+        'code': '000001',
+        'name': 'Blue Shirt',
+        'params': [{'color': 'blue', 'code': '000002', 'stock': []}]
+    })
+    await db_service.add_item({'code': '000003', 'name': 'Red Dress'})
+
+    by_variant_code = await db_service.search_items('000002')
+    assert [item.name for item in by_variant_code] == ['Blue Shirt']
+
+    by_text = await db_service.search_items('shirt (.*')
+    assert [item.name for item in by_text] == ['Blue Shirt']
+
+def test_statistics_delta_for_stock_and_color_changes():
+    before = {
+        'photo_key': None,
+        'params': [{'color': 'navy.blue', 'stock': [{'size': 'M', 'quantity': 2}]}]
+    }
+    after = _apply_set(before, {'photo_key': 'a.jpg', 'params.0.stock.0.quantity': 5})
+
+    assert _statistics_delta(None, before) == {'total_items': 1, 'colors.navy%2Eblue': 1, 'total_stock': 2}
+    assert _statistics_delta(before, after) == {'items_with_photos': 1, 'total_stock': 3}
+    assert _statistics_delta(after, None) == {
+        'total_items': -1, 'items_with_photos': -1, 'colors.navy%2Eblue': -1, 'total_stock': -5
+    }
+
+@pytest.mark.asyncio
+async def test_statistics_follow_writes(db_service):
+    await db_service.reconcile_statistics()
+    item_id = await db_service.add_item({
+        'code': '000001',
+        'photo_key': 'a.jpg',
+        'params': [{'color': 'red', 'stock': [{'size': 'M', 'quantity': 3}]}]
+    })
+    await db_service.update_item(item_id, {'params.0.stock.0.quantity': 4})
+
+    stats = await db_service.get_statistics()
+    assert stats['total_items'] == 1
+    assert stats['items_with_photos'] == 1
+    assert stats['total_stock'] == 4
+    assert stats['colors'] == [{'_id': 'red', 'count': 1}]
+    assert await db_service.reconcile_statistics() == {}
@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+from bson import ObjectId
+
+from bot.models import Item, Stock, Variant
+from bot.utils.formatters import (
+    CAPTION_LIMIT,
+    NAME_LIMIT,
+    caption_cache_statistics,
+    format_item_caption,
+    render_item_caption
+)
+
+def large_item(rev=1):
+    sizes = [Stock(size, 10) for size in ('XS', 'S', 'M', 'L', 'XL', 'XXL')]
+    return Item(
+        id=ObjectId(),
+        code='000001',
+        name='Summer_dress *new*',
+        description='x' * 1000,
+        selling_price=20.0,
+        variants=[Variant(color=f'color_{n}', stock=sizes) for n in range(40)],
+        rev=rev
+    )
+
+def test_caption_escapes_markdown_and_fits_the_limit():
+    item = large_item()
+
+    caption = render_item_caption(item)
+
+    assert len(caption) <= CAPTION_LIMIT
+    assert '*Name:* Summer\\_dress \\*new\\*' in caption
+    assert '*Color:* color\\_0' in caption
+    # Whole lines are dropped and counted, never cut in half
+    assert caption.endswith(' more lines_\n')
+    assert all(line.count('*') % 2 == 0 for line in caption.splitlines()[:-1])
+
+def test_caption_is_rendered_once_per_revision():
+    item = large_item()
+    before = caption_cache_statistics()
+
+    first = format_item_caption(item)
+    assert format_item_caption(item) is first
+
+    item.rev = 2
+    item.name = 'Renamed'
+    assert '*Name:* Renamed' in format_item_caption(item)
+
+    after = caption_cache_statistics()
+    assert after['renders'] - before['renders'] == 2
+    assert after['hits'] - before['hits'] == 1
+
+def test_caption_header_fits_with_oversized_fields():
+    item = large_item()
+    item.name = '_' * 5000
+    item.wholesale_price = '*' * 5000
+    item.description = '[' * 5000
+
+    caption = render_item_caption(item)
+
+    assert len(caption) <= CAPTION_LIMIT
+    name = caption.splitlines()[1]
+    assert name == '*Name:* ' + '\\_' * ((NAME_LIMIT - 1) // 2) + '…'
+
+def test_cached_captions_are_reused_without_rendering():
+    items = [large_item() for _ in range(50)]
+    before = caption_cache_statistics()
+
+    first = [format_item_caption(item) for item in items]
+    again = [format_item_caption(item) for item in items]
+
+    after = caption_cache_statistics()
+    assert after['renders'] - before['renders'] == 50
+    assert after['hits'] - before['hits'] == 50
+    assert all(cached is caption for cached, caption in zip(again, first))
+
+@pytest.mark.skipif(not os.environ.get('RUN_BENCHMARKS'), reason='set RUN_BENCHMARKS=1 to run')
+def test_cached_captions_are_much_cheaper_than_rendering():
+    items = [large_item() for _ in range(50)]
+
+    started = time.perf_counter()
+    for item in items:
+        render_item_caption(item)
+    rendered = time.perf_counter() - started
+
+    for item in items:
+        format_item_caption(item)
+    started = time.perf_counter()
+    for item in items:
+        format_item_caption(item)
+    cached = time.perf_counter() - started
+
+    assert cached * 5 < rendered
@@ -1,7 +1,10 @@
+import io
 import pytest
+from bson import ObjectId
 from unittest.mock import AsyncMock, MagicMock, create_autospec
 from telegram import Update, Message, Chat, User
-from telegram.ext import ContextTypes
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, ConversationHandler
 from bot.handlers.add_item import AddItemHandler
 from bot.handlers.list_items import ListItemsHandler
 from bot.handlers.search import SearchHandler
@@ -9,7 +12,10 @@ from bot.handlers.stats import StatsHandler
 from bot.handlers.delete_item import DeleteItemHandler
 from bot.handlers.change_item import ChangeItemHandler
 from bot.utils.states import STATES
+from bot.models import Item, Variant
+from bot.services.cache import StaleDict
 from bot.services.database import DatabaseService
+from bot.config import ITEMS_PER_PAGE
 
 def create_mock_update():
     """Create a mock update with all required attributes."""
@@ -83,8 +89,7 @@ async def test_list_items_empty():
     
     # Create mock database
     mock_db = create_autospec(DatabaseService)
-    mock_db.clothes = MagicMock()
-    mock_db.clothes.count_documents.return_value = 0
+    mock_db.count_items.return_value = 0
     
     # Configure callback query
     update.callback_query = None
@@ -94,9 +99,9 @@ async def test_list_items_empty():
 
     await handler.handle_command(update, context)
 
-    assert update.message.reply_text.called
-    update.message.reply_text.assert_called_once_with(
-        "No items found in the database."
+    context.bot.send_message.assert_called_once_with(
+        chat_id=update.message.chat_id,
+        text="No items found in the database."
     )
 
 @pytest.mark.asyncio
@@ -140,6 +145,24 @@ async def test_stats():
 
     assert update.message.reply_text.called
 
+@pytest.mark.asyncio
+async def test_stats_marks_last_known_data_as_stale():
+    """Statistics served during a MongoDB outage carry a notice."""
+    update = create_mock_update()
+    context = create_mock_context()
+    mock_db = create_autospec(DatabaseService)
+    mock_db.get_statistics.return_value = StaleDict(
+        total_items=1, items_with_photos=0, total_stock=2, colors=[]
+    )
+
+    handler = StatsHandler()
+    handler.db = mock_db
+
+    await handler.handle_command(update, context)
+
+    text = update.message.reply_text.call_args.args[0]
+    assert text.startswith('⚠️') and '*Total Items:* 1' in text
+
 @pytest.mark.asyncio
 async def test_delete_item_invalid_code():
     """Test delete item with invalid code format."""
@@ -171,3 +194,200 @@ async def test_change_item_not_found():
 
     assert update.message.reply_text.called
     assert result == STATES['CHANGE_CHOICE']
+
+@pytest.mark.asyncio
+async def test_delete_item_keeps_only_the_lookup_fields(mock_storage):
+    """Test the item to delete is kept in user_data as a small document."""
+    update = create_mock_update()
+    update.message.text = "000001"
+    context = create_mock_context()
+    mock_db = create_autospec(DatabaseService)
+    mock_db.get_item.return_value = Item(
+        id=1, code='000001', name='Shirt', photo_key='a.jpg',
+        variants=[Variant(photo_key='red.jpg'), Variant()]
+    )
+    mock_db.delete_item.return_value = True
+
+    handler = DeleteItemHandler()
+    handler.db = mock_db
+    handler.storage = mock_storage
+
+    await handler.handle_confirm(update, context)
+    assert context.user_data['delete_item'] == {
+        '_id': 1, 'code': '000001', 'name': 'Shirt', 'photo_key': 'a.jpg',
+        'params': [{'photo_key': 'red.jpg'}, {}]
+    }
+
+    update.callback_query = MagicMock()
+    update.callback_query.answer = AsyncMock()
+    update.callback_query.edit_message_text = AsyncMock()
+    update.callback_query.data = 'yes'
+    result = await handler.handle_confirmation(update, context)
+
+    mock_storage.delete_files.assert_awaited_once_with(['a.jpg', 'red.jpg'])
+    mock_db.delete_item.assert_awaited_once_with(1)
+    assert result == ConversationHandler.END
+
+@pytest.mark.asyncio
+async def test_cancel_deletes_uploaded_photos(mock_storage):
+    """Test cancelling an add removes the item and color photos in one batch."""
+    update = create_mock_update()
+    update.callback_query = None
+    context = create_mock_context()
+    context.user_data['new_item'] = {
+        'photo_key': 'item.jpg',
+        'params': [{'photo_key': 'red.jpg'}, {'color': 'blue'}]
+    }
+
+    handler = AddItemHandler()
+    handler.storage = mock_storage
+
+    result = await handler.cancel(update, context)
+
+    mock_storage.delete_files.assert_awaited_once_with(['item.jpg', 'red.jpg'])
+    assert context.user_data == {}
+    assert result == ConversationHandler.END
+
+@pytest.mark.asyncio
+async def test_send_item_reuses_cached_file_id(mock_db, mock_storage):
+    """Test an item with a cached file_id is sent without touching S3."""
+    context = create_mock_context()
+    context.bot.send_photo = AsyncMock()
+    item = Item(id=1, code='000001', photo_key='a.jpg', photo_file_id='FILE')
+
+    handler = ListItemsHandler()
+    handler.db = mock_db
+    handler.storage = mock_storage
+
+    await handler.send_item(context, 456, item)
+
+    assert context.bot.send_photo.call_args.kwargs['photo'] == 'FILE'
+    mock_storage.get_files.assert_not_called()
+    mock_db.set_photo_file_id.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_send_item_falls_back_to_s3_when_file_id_rejected(mock_db, mock_storage):
+    """Test a rejected file_id is replaced by the one from a fresh S3 upload."""
+    context = create_mock_context()
+    sent = MagicMock()
+    sent.photo = [MagicMock(file_id='SMALL'), MagicMock(file_id='NEW')]
+    context.bot.send_photo = AsyncMock(side_effect=[BadRequest('Wrong file identifier'), sent])
+    mock_storage.get_files.return_value = [io.BytesIO(b'jpeg')]
+    item = Item(id=1, code='000001', photo_key='a.jpg', photo_file_id='STALE')
+
+    handler = ListItemsHandler()
+    handler.db = mock_db
+    handler.storage = mock_storage
+
+    await handler.send_item(context, 456, item)
+
+    mock_storage.get_files.assert_awaited_once_with(['a.jpg'])
+    mock_db.set_photo_file_id.assert_awaited_once_with(1, 'photo_file_id', 'NEW')
+    assert item.photo_file_id == 'NEW'
+
+@pytest.mark.asyncio
+async def test_send_item_does_not_reupload_on_other_bad_requests(mock_db, mock_storage):
+    """Test only a rejected file_id makes the photos be fetched from S3 again."""
+    context = create_mock_context()
+    context.bot.send_photo = AsyncMock(side_effect=BadRequest("Can't parse entities"))
+    item = Item(id=1, code='000001', photo_key='a.jpg', photo_file_id='FILE')
+
+    handler = ListItemsHandler()
+    handler.db = mock_db
+    handler.storage = mock_storage
+
+    await handler.send_item(context, 456, item)
+
+    context.bot.send_photo.assert_awaited_once()
+    mock_storage.get_files.assert_not_called()
+    mock_db.set_photo_file_id.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_list_page_sent_as_album(mock_db, mock_storage):
+    """Test a page is rendered as one album plus one navigation message."""
+    update = create_mock_update()
+    update.callback_query = None
+    context = create_mock_context()
+    sent = [MagicMock(photo=[MagicMock(file_id='F1')]), MagicMock(photo=[MagicMock(file_id='F2')])]
+    context.bot.send_media_group = AsyncMock(return_value=sent)
+    mock_db.count_items.return_value = 3
+    mock_db.get_items.return_value = [
+        Item(id=1, code='000001', photo_key='a.jpg'),
+        Item(id=2, code='000002', photo_key='b.jpg', photo_file_id='CACHED'),
+        Item(id=3, code='000003'),
+    ]
+    mock_storage.get_files.return_value = [io.BytesIO(b'jpeg')]
+
+    handler = ListItemsHandler()
+    handler.db = mock_db
+    handler.storage = mock_storage
+
+    await handler.handle_command(update, context)
+
+    # Only the photo without a file_id is fetched, in a single batch
+    mock_storage.get_files.assert_awaited_once_with(['a.jpg'])
+    media = context.bot.send_media_group.call_args.kwargs['media']
+    assert len(media) == 2
+    assert media[1].media == 'CACHED'
+    mock_db.set_photo_file_id.assert_awaited_once_with(1, 'photo_file_id', 'F1')
+    mock_db.update_item.assert_not_called()
+
+    context.bot.send_message.assert_called_once()
+    text = context.bot.send_message.call_args.kwargs['text']
+    assert '000003' in text
+    assert text.endswith('Page 1 of 1')
+
+@pytest.mark.asyncio
+async def test_album_thumbnails_cache_their_own_file_id(mock_db, mock_storage):
+    """Test albums reuse a thumbnail file_id, kept apart from the full-size one."""
+    context = create_mock_context()
+    sent = [MagicMock(photo=[MagicMock(file_id='T1')]), MagicMock(photo=[MagicMock(file_id='T2')])]
+    context.bot.send_media_group = AsyncMock(return_value=sent)
+    mock_storage.get_files.return_value = [io.BytesIO(b'jpeg')]
+    first = Item(id=1, code='000001', photo_key='a.jpg', photo_file_id='FULL',
+                 photo_derivatives=['thumb', 'web'])
+    second = Item(id=2, code='000002', photo_key='b.jpg', photo_file_id='FULL2',
+                  photo_derivatives=['thumb', 'web'], photo_thumb_file_id='THUMB2')
+
+    handler = ListItemsHandler()
+    handler.db = mock_db
+    handler.storage = mock_storage
+
+    await handler.send_items(context, 456, [first, second])
+
+    # The full-size file_id is not used for a tile
+    mock_storage.get_files.assert_awaited_once_with(['a.thumb.jpg'])
+    media = context.bot.send_media_group.call_args.kwargs['media']
+    assert media[1].media == 'THUMB2'
+    mock_db.set_photo_file_id.assert_awaited_once_with(1, 'photo_thumb_file_id', 'T1')
+    assert first.photo_thumb_file_id == 'T1' and first.photo_file_id == 'FULL'
+
+@pytest.mark.asyncio
+async def test_list_next_page_seeks_after_last_code(mock_db, mock_storage):
+    """Test the Next button carries a cursor that the next page seeks from."""
+    update = create_mock_update()
+    update.callback_query = MagicMock()
+    update.callback_query.answer = AsyncMock()
+    update.callback_query.message.chat_id = 456
+    update.callback_query.data = 'list_1_n_65a000000000000000000001_000005'
+    context = create_mock_context()
+    context.bot.delete_message = AsyncMock()
+    mock_db.count_items.return_value = 20
+    mock_db.get_items.return_value = [
+        Item(id=ObjectId(f'65a00000000000000000000{i}'), code=f'00000{i}')
+        for i in range(6, 10)
+    ]
+
+    handler = ListItemsHandler()
+    handler.db = mock_db
+    handler.storage = mock_storage
+
+    await handler.list_items(update, context)
+
+    mock_db.get_items.assert_awaited_once_with(
+        after=('000005', ObjectId('65a000000000000000000001')),
+        limit=ITEMS_PER_PAGE + 1
+    )
+    keyboard = context.bot.send_message.call_args.kwargs['reply_markup'].inline_keyboard
+    previous_button = keyboard[0][0]
+    assert previous_button.callback_data == 'list_0_p_65a000000000000000000006_000006'
@@ -0,0 +1,55 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import lambda_function
+
+UPDATE = {'update_id': 1, 'message': {
+    'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': '/start'
+}}
+
+@pytest.fixture
+def application():
+    app = MagicMock()
+    app.bot = None
+    app.initialize = AsyncMock()
+    app.process_update = AsyncMock()
+    app.persistence.save_shared_state = AsyncMock()
+    with patch.object(lambda_function, 'create_application', AsyncMock(return_value=app)) as create, \
+            patch.object(lambda_function, 'application', None), \
+            patch.object(lambda_function, 'WEBHOOK_SECRET_TOKEN', 'secret'):
+        yield app, create
+
+def test_application_is_built_once_per_container(application):
+    app, create = application
+    event = {
+        'headers': {'X-Telegram-Bot-Api-Secret-Token': 'secret'},
+        'body': json.dumps(UPDATE)
+    }
+
+    assert lambda_function.lambda_handler(event, None)['statusCode'] == 200
+    assert lambda_function.lambda_handler(event, None)['statusCode'] == 200
+
+    create.assert_awaited_once_with(register_commands=False, shared_state=True)
+    app.initialize.assert_awaited_once()
+    assert app.process_update.await_count == 2
+    # Saved after each update, once PTB has marked its data
+    assert app.persistence.save_shared_state.await_count == 2
+
+def test_requests_without_secret_token_are_rejected(application):
+    app, create = application
+
+    result = lambda_function.lambda_handler({'headers': {}, 'body': json.dumps(UPDATE)}, None)
+
+    assert result['statusCode'] == 403
+    create.assert_not_awaited()
+
+def test_requests_are_rejected_without_a_configured_secret(application):
+    app, create = application
+    event = {'headers': {'X-Telegram-Bot-Api-Secret-Token': ''}, 'body': json.dumps(UPDATE)}
+
+    with patch.object(lambda_function, 'WEBHOOK_SECRET_TOKEN', ''):
+        result = lambda_function.lambda_handler(event, None)
+
+    assert result['statusCode'] == 403
+    create.assert_not_awaited()
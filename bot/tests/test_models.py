@@ -0,0 +1,35 @@
+from bson import ObjectId
+
+from bot.models import Item, Stock, Variant
+from bot.utils.formatters import format_item_caption
+
+DOCUMENT = {
+    '_id': ObjectId('65a000000000000000000001'),
+    'code': '000001',
+    'name': 'Shirt',
+    'sellingPrice': 20.0,
+    'photo_key': 'a.jpg',
+    'photo_thumb_file_id': 'THUMB',
+    'params': [
+        {'color': 'red', 'code': '000002', 'photo_key': 'red.jpg',
+         'stock': [{'size': 'M', 'quantity': 3}]},
+        {'color': 'blue'},
+    ],
+}
+
+def test_item_round_trips_through_its_document_form():
+    item = Item.from_bson(DOCUMENT)
+
+    assert item.id == DOCUMENT['_id'] and item.selling_price == 20.0
+    assert item.variants[0] == Variant('red', '000002', 'red.jpg', None, [Stock('M', 3)])
+    assert item.photo_keys == ['a.jpg', 'red.jpg']
+    assert item.to_bson() == DOCUMENT
+    assert Item.from_bson(None) is None
+    assert not hasattr(item, '__dict__')
+
+def test_caption_marks_fields_left_out_by_the_projection():
+    caption = format_item_caption(Item.from_bson(DOCUMENT))
+
+    assert '*Name:* Shirt' in caption
+    assert '*Wholesale Price:* N/A' in caption
+    assert 'Size: M, Quantity: 3' in caption
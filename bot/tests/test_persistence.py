@@ -0,0 +1,244 @@
+import asyncio
+import copy
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, PropertyMock, patch
+from telegram import Chat, Message, Update, User
+from telegram.ext import ExtBot
+from telegram.ext import CommandHandler, ConversationHandler, MessageHandler, filters
+from telegram.ext._utils.trackingdict import TrackingDict
+
+from bot.bot import create_application
+from bot.config import USER_DATA_COLLECTION, CONVERSATIONS_COLLECTION
+from bot.services.persistence import MongoPersistence
+from bot.utils.circuit_breaker import CircuitOpenError
+
+async def _noop(update, context):
+    pass
+
+def _text_update(text):
+    message = Message(
+        message_id=1,
+        date=datetime.now(timezone.utc),
+        chat=Chat(456, Chat.PRIVATE),
+        from_user=User(789, 'Test', False),
+        text=text
+    )
+    return Update(update_id=1, message=message)
+
+def _conversation(name, command, state):
+    handler = ConversationHandler(
+        entry_points=[CommandHandler(command, _noop)],
+        states={state: [MessageHandler(filters.TEXT, _noop)]},
+        fallbacks=[],
+        name=name,
+        persistent=True
+    )
+    # Application.initialize swaps in tracking dicts for persistent handlers
+    handler._conversations = TrackingDict()
+    return handler
+
+@pytest.fixture
+def persistence(mock_db):
+    persistence = MongoPersistence(flush_delay=0.01)
+    mock_db.get_user_data = AsyncMock(return_value={'new_item': {'name': 'Dress'}})
+    mock_db.bulk_write = AsyncMock()
+    persistence.db = mock_db
+    return persistence
+
+@pytest.mark.asyncio
+async def test_user_data_is_loaded_once_per_user(persistence, mock_db):
+    user_data = {}
+
+    await persistence.refresh_user_data(1, user_data)
+    await persistence.refresh_user_data(1, user_data)
+
+    assert user_data == {'new_item': {'name': 'Dress'}}
+    mock_db.get_user_data.assert_awaited_once_with(1)
+    assert await persistence.get_user_data() == {}
+
+@pytest.mark.asyncio
+async def test_rapid_changes_are_coalesced_into_one_write(persistence, mock_db):
+    for step in range(5):
+        await persistence.update_user_data(1, {'step': step})
+        await persistence.update_conversation('add_item', (10, 1), step)
+    await persistence.update_conversation('delete_item', (10, 1), None)
+
+    await asyncio.sleep(0.05)
+
+    assert mock_db.bulk_write.await_count == 2
+    writes = {call.args[0]: call.args[1] for call in mock_db.bulk_write.await_args_list}
+    assert [op._doc['data'] for op in writes[USER_DATA_COLLECTION]] == [{'step': 4}]
+    assert len(writes[CONVERSATIONS_COLLECTION]) == 2
+    assert writes[CONVERSATIONS_COLLECTION][0]._doc['state'] == 4
+
+@pytest.mark.asyncio
+async def test_flush_writes_pending_state_and_keeps_it_on_failure(persistence, mock_db):
+    persistence.flush_delay = 60
+    mock_db.bulk_write.side_effect = [RuntimeError('down'), None]
+    await persistence.update_user_data(1, {'step': 1})
+
+    with pytest.raises(RuntimeError):
+        await persistence.flush()
+    await persistence.flush()
+
+    assert mock_db.bulk_write.await_count == 2
+    assert persistence._pending[USER_DATA_COLLECTION] == {}
+
+@pytest.mark.asyncio
+async def test_shared_state_is_reloaded_for_every_update(persistence, mock_db):
+    persistence.shared = True
+    mock_db.sync_catalog_generation = AsyncMock()
+    mock_db.get_conversation_states = AsyncMock(return_value={'add_item_conversation': 3})
+    adding = _conversation('add_item_conversation', 'add', 3)
+    deleting = _conversation('delete_item_conversation', 'delete', 1)
+    key = (456, 789)
+    deleting._conversations.update_no_track({key: 1})
+    application = MagicMock()
+    application.handlers = {0: [adding, deleting]}
+
+    await persistence.load_shared_state(application, _text_update('Red'))
+    user_data = {'stale': True}
+    await persistence.refresh_user_data(1, user_data)
+    await persistence.refresh_user_data(1, user_data)
+
+    mock_db.get_conversation_states.assert_awaited_once_with(
+        key, ['add_item_conversation', 'delete_item_conversation']
+    )
+    assert adding._conversations[key] == 3
+    assert key not in deleting._conversations
+    assert adding._conversations.pop_accessed_keys() == set()
+    assert user_data == {'new_item': {'name': 'Dress'}}
+    assert mock_db.get_user_data.await_count == 2
+
+@pytest.mark.asyncio
+async def test_only_the_handling_conversation_keeps_its_state(persistence, mock_db):
+    persistence.shared = True
+    persistence.sync_catalog = False
+    mock_db.sync_catalog_generation = AsyncMock()
+    mock_db.get_conversation_states = AsyncMock(return_value={
+        'add_item_conversation': 3,
+        'delete_item_conversation': 1
+    })
+    adding = _conversation('add_item_conversation', 'add', 3)
+    deleting = _conversation('delete_item_conversation', 'delete', 1)
+    application = MagicMock()
+    application.handlers = {0: [adding, deleting]}
+
+    await persistence.load_shared_state(application, _text_update('Red'))
+
+    # Both are waiting for text, but only the first of the group gets it
+    assert adding._conversations[(456, 789)] == 3
+    assert (456, 789) not in deleting._conversations
+    mock_db.sync_catalog_generation.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_updates_without_a_conversation_key_read_no_state(persistence, mock_db):
+    persistence.shared = True
+    mock_db.sync_catalog_generation = AsyncMock()
+    mock_db.get_conversation_states = AsyncMock()
+    application = MagicMock()
+    application.handlers = {0: [_conversation('add_item_conversation', 'add', 3)]}
+    update = Update(update_id=1, channel_post=_text_update('Red').message)
+
+    await persistence.load_shared_state(application, update)
+
+    mock_db.get_conversation_states.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_shared_state_falls_back_to_local_while_mongodb_is_down(persistence, mock_db):
+    persistence.shared = True
+    persistence.flush_delay = 60
+    down = CircuitOpenError('MongoDB', 30)
+    mock_db.sync_catalog_generation = AsyncMock(side_effect=down)
+    mock_db.get_conversation_states = AsyncMock(side_effect=down)
+    mock_db.get_user_data.side_effect = down
+    mock_db.bulk_write.side_effect = down
+    adding = _conversation('add_item_conversation', 'add', 2)
+    key = (456, 789)
+    adding._conversations.update_no_track({key: 2})
+    application = MagicMock()
+    application.handlers = {0: [adding]}
+    application.update_persistence = AsyncMock()
+    user_data = {'new_item': {'name': 'Dress'}}
+
+    # Neither hook raises, so the error handler does not answer the update
+    await persistence.load_shared_state(application, _text_update('Red'))
+    await persistence.refresh_user_data(1, user_data)
+    await persistence.update_user_data(1, user_data)
+    await persistence.save_shared_state(application)
+
+    assert adding._conversations[key] == 2
+    assert user_data == {'new_item': {'name': 'Dress'}}
+    # Kept for the next flush
+    assert 1 in persistence._pending[USER_DATA_COLLECTION]
+
+@pytest.mark.asyncio
+async def test_queued_writes_are_snapshots(persistence, mock_db):
+    persistence.flush_delay = 60
+    user_data = {'new_item': {'params': []}}
+
+    await persistence.update_user_data(1, user_data)
+    user_data['new_item']['params'].append({'color': 'red'})
+    await persistence.flush()
+
+    operation = mock_db.bulk_write.await_args.args[1][0]
+    assert operation._doc['data'] == {'new_item': {'params': []}}
+
+class StoredState:
+    """Just enough of DatabaseService to keep bot state in memory."""
+
+    def __init__(self):
+        self.collections = {USER_DATA_COLLECTION: {}, CONVERSATIONS_COLLECTION: {}}
+
+    async def bulk_write(self, collection_name, operations):
+        documents = self.collections[collection_name]
+        for operation in operations:
+            document_id = operation._filter['_id']
+            if getattr(operation, '_doc', None) is None:
+                documents.pop(document_id, None)
+            else:
+                documents[document_id] = copy.deepcopy(operation._doc)
+
+    async def get_user_data(self, user_id):
+        document = self.collections[USER_DATA_COLLECTION].get(user_id)
+        return copy.deepcopy(document['data']) if document else None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def get_conversation_states(self, key, names):
+        return {
+            document['name']: document['state']
+            for document in self.collections[CONVERSATIONS_COLLECTION].values()
+            if tuple(document['key']) == key and document['name'] in names
+        }
+
+    async def sync_catalog_generation(self, max_age=0):
+        return False
+
+@pytest.mark.asyncio
+async def test_shared_user_data_is_saved_with_its_own_update():
+    stored = StoredState()
+    with patch.object(ExtBot, 'get_me', AsyncMock()), \
+            patch.object(ExtBot, 'username', new_callable=PropertyMock, return_value='store_bot'), \
+            patch.object(ExtBot, 'send_message', AsyncMock()) as send_message:
+        application = await create_application(register_commands=False, shared_state=True)
+        application.persistence.db = stored
+        await application.initialize()
+        for update_id, text in enumerate(['/add', 'Dress'], start=1):
+            message = _text_update(text).to_dict()
+            if text.startswith('/'):
+                message['message']['entities'] = [
+                    {'type': 'bot_command', 'offset': 0, 'length': len(text)}
+                ]
+            message['update_id'] = update_id
+            update = Update.de_json(message, application.bot)
+            # The way Application feeds updates: through the update processor
+            await application.update_processor.process_update(
+                update, application.process_update(update)
+            )
+
+    # Read back by the next update, possibly on another replica
+    assert stored.collections[USER_DATA_COLLECTION][789]['data']['new_item'] == {'name': 'Dress'}
+    assert send_message.await_args.kwargs['text'].startswith('Enter the wholesale price')
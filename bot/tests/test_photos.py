@@ -0,0 +1,108 @@
+import io
+import os
+import pytest
+import tempfile
+from unittest.mock import AsyncMock, create_autospec
+from bot.models import Item, Variant
+from bot.services.database import DatabaseService
+from bot.services.photos import DERIVATIVES, PhotoService, render_derivatives, select_photo_key
+
+@pytest.fixture
+def photos(monkeypatch, mock_storage):
+    """A fresh PhotoService on mock storage, with rendering stubbed out."""
+    monkeypatch.setattr(PhotoService, '_instance', None)
+    service = PhotoService()
+    service.storage = mock_storage
+    mock_storage.upload_files = AsyncMock(side_effect=lambda files: [None] * len(files))
+    return service
+
+def fake_render(tmp_path):
+    async def render(source_path):
+        paths = {}
+        for name in DERIVATIVES:
+            descriptor, paths[name] = tempfile.mkstemp(suffix=f'.{name}.jpg', dir=tmp_path)
+            os.close(descriptor)
+        return paths
+    return render
+
+def test_smallest_suitable_copy_is_selected():
+    assert select_photo_key('a.jpg', ['thumb', 'web'], 100) == 'a.thumb.jpg'
+    assert select_photo_key('a.jpg', ['thumb', 'web'], DERIVATIVES['web']) == 'a.web.jpg'
+    assert select_photo_key('a.jpg', ['thumb'], DERIVATIVES['web']) == 'a.jpg'
+    assert select_photo_key('a.jpg', [], 100) == 'a.jpg'
+
+    item = Item(photo_key='a.jpg', photo_derivatives=['thumb'],
+                variants=[Variant(photo_key='red.jpg'), Variant()])
+    assert item.photo_keys == ['a.jpg', 'a.thumb.jpg', 'red.jpg']
+
+@pytest.mark.asyncio
+async def test_store_uploads_derivatives_next_to_the_original(photos, mock_storage, tmp_path):
+    photos.render = fake_render(tmp_path)
+
+    names = await photos.store('/tmp/a.jpg', 'a.jpg')
+
+    mock_storage.upload_file.assert_awaited_once_with('/tmp/a.jpg', 'a.jpg')
+    uploaded = mock_storage.upload_files.call_args.args[0]
+    assert [key for _, key in uploaded] == ['a.thumb.jpg', 'a.web.jpg']
+    assert names == ['thumb', 'web']
+    # The rendered files are removed once uploaded
+    assert not list(tmp_path.iterdir())
+
+    photos.render = AsyncMock(side_effect=OSError('cannot identify image file'))
+    assert await photos.store('/tmp/b.jpg', 'b.jpg') == []
+    mock_storage.upload_file.assert_awaited_with('/tmp/b.jpg', 'b.jpg')
+
+@pytest.mark.asyncio
+async def test_backfill_updates_each_photo_that_lacks_derivatives(photos, mock_storage, tmp_path):
+    photos.render = fake_render(tmp_path)
+    db = create_autospec(DatabaseService)
+    db.get_items_missing_photo_derivatives.return_value = [
+        {'_id': 1, 'photo_key': 'a.jpg',
+         'params': [{'photo_key': 'red.jpg', 'photo_derivatives': ['thumb']},
+                    {'photo_key': 'blue.jpg'}]},
+        {'_id': 2, 'photo_key': 'b.jpg', 'photo_derivatives': []},
+    ]
+    mock_storage.get_file.side_effect = [io.BytesIO(b'original'), io.BytesIO(b'original'),
+                                         ConnectionError('S3 is down')]
+
+    assert await photos.backfill_catalog(db) == (2, 1)
+
+    db.update_item.assert_awaited_once_with(1, {
+        'photo_derivatives': ['thumb', 'web'],
+        'params.1.photo_derivatives': ['thumb', 'web'],
+    })
+
+def test_render_strips_metadata_and_caps_size(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    source = tmp_path / 'a.jpg'
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotated 90 degrees
+    exif[0x010F] = 'Camera'
+    Image.new('RGB', (3000, 2000), 'red').save(source, exif=exif)
+
+    paths = render_derivatives(str(source), {'thumb': 300, 'web': 1200}, 82, 50000, 10 ** 8)
+
+    with Image.open(paths['thumb']) as thumb:
+        # Turned upright, then fitted into 300x300
+        assert thumb.size == (200, 300)
+        assert not thumb.getexif()
+    with Image.open(paths['web']) as web:
+        assert web.size == (800, 1200)
+    assert all((tmp_path / f'a.{name}.jpg').stat().st_size <= 50000 for name in paths)
+    with pytest.raises(ValueError):
+        render_derivatives(str(source), {'thumb': 300}, 82, 50000, 1000)
+
+@pytest.mark.asyncio
+async def test_render_runs_in_spawned_workers(photos, tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    source = tmp_path / 'a.jpg'
+    Image.new('RGB', (100, 100), 'red').save(source)
+
+    try:
+        paths = await photos.render(str(source))
+        start_method = photos.executor._mp_context.get_start_method()
+    finally:
+        photos.close()
+
+    assert start_method == 'spawn'
+    assert sorted(paths) == sorted(DERIVATIVES)
@@ -0,0 +1,65 @@
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+from pymongo import errors
+
+from bot.services import database, storage
+from bot.utils.retry import RetryPolicy, retry_statistics
+
+def make_policy(**kwargs):
+    settings = dict(max_attempts=4, deadline=5, base_delay=0.001, max_delay=0.01)
+    settings.update(kwargs)
+    return RetryPolicy('Test', lambda e: isinstance(e, ConnectionError), **settings)
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried_until_success():
+    attempts = []
+
+    @make_policy()
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError('primary stepped down')
+        return 'ok'
+
+    assert await flaky() == 'ok'
+    assert len(attempts) == 3
+    assert retry_statistics()['Test flaky'] == '1 calls, 2 retries, 0 failed'
+
+@pytest.mark.asyncio
+async def test_permanent_errors_and_spent_budgets_are_not_retried():
+    attempts = []
+
+    @make_policy()
+    async def rejected():
+        attempts.append(1)
+        raise ValueError('duplicate key')
+
+    with pytest.raises(ValueError):
+        await rejected()
+    assert len(attempts) == 1
+
+    @make_policy(deadline=0)
+    async def down():
+        attempts.append(1)
+        raise ConnectionError('no primary')
+
+    with pytest.raises(ConnectionError):
+        await down()
+    assert len(attempts) == 2
+
+def test_errors_are_classified_per_service():
+    assert database.is_transient_error(errors.AutoReconnect('failover'))
+    assert database.is_transient_error(errors.NotPrimaryError('stepdown'))
+    assert not database.is_transient_error(errors.DuplicateKeyError('E11000', 11000))
+    assert not database.is_transient_error(errors.OperationFailure('bad query', 2))
+
+    def client_error(code, status):
+        return ClientError(
+            {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+            'GetObject'
+        )
+
+    assert storage.is_transient_error(client_error('SlowDown', 503))
+    assert storage.is_transient_error(EndpointConnectionError(endpoint_url='https://s3'))
+    assert not storage.is_transient_error(client_error('AccessDenied', 403))
+    assert not storage.is_transient_error(client_error('NoSuchKey', 404))
@@ -0,0 +1,44 @@
+from bot.services.search_index import FuzzySearchIndex
+
+def build_index():
+    index = FuzzySearchIndex()
+    index.add({'_id': 1, 'name': 'T-Shirt', 'code': '000001', 'params': [{'color': 'black'}]})
+    index.add({'_id': 2, 'name': 'Dress', 'code': '000002', 'params': [{'color': 'blue'}]})
+    index.add({'_id': 3, 'name': 'Jeans', 'description': 'Classic blue denim'})
+    return index
+
+def test_search_tolerates_typos():
+    index = build_index()
+
+    assert index.search('blak')[0][0] == 1
+    assert index.search('tshirt')[0][0] == 1
+    assert index.search('dres')[0][0] == 2
+
+def test_search_ranks_and_limits():
+    index = build_index()
+
+    results = index.search('blue', limit=1)
+    assert len(results) == 1
+    assert results[0][0] == 2
+    assert index.search('zzzz') == []
+
+def test_updates_and_removals_are_incremental():
+    index = build_index()
+
+    index.add({'_id': 2, 'name': 'Skirt', 'params': [{'color': 'green'}]})
+    assert index.search('skirt')[0][0] == 2
+    assert all(item_id != 2 for item_id, _ in index.search('dress'))
+
+    index.remove(1)
+    assert index.search('blak') == []
+    assert len(index) == 2
+
+def test_compaction_keeps_live_items():
+    index = FuzzySearchIndex()
+    for item_id in range(3000):
+        index.add({'_id': item_id, 'name': f'item {item_id}'})
+    for item_id in range(2500):
+        index.remove(item_id)
+
+    assert len(index) == 500
+    assert index.search('item 2999')[0][0] == 2999
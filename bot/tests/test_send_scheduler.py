@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from telegram.error import RetryAfter
+
+from bot.services.send_scheduler import BULK, INTERACTIVE, SendScheduler
+
+def make_scheduler(**kwargs):
+    settings = dict(global_rate=100, chat_rate=10, group_rate=10, chat_burst=1, max_retries=2)
+    settings.update(kwargs)
+    return SendScheduler(**settings)
+
+@pytest.mark.asyncio
+async def test_interactive_replies_overtake_queued_bulk_sends():
+    scheduler = make_scheduler()
+    sent = []
+
+    async def send(label):
+        sent.append(label)
+
+    def request(label, priority):
+        return scheduler.process_request(
+            send, (label,), {}, 'sendMessage', {'chat_id': 1}, {'priority': priority}
+        )
+
+    bulk = [asyncio.create_task(request(f'page {n}', BULK)) for n in range(3)]
+    await asyncio.sleep(0)
+    reply = asyncio.create_task(request('reply', INTERACTIVE))
+    await asyncio.gather(*bulk, reply)
+
+    # The first page had the chat's only token, the reply came next
+    assert sent == ['page 0', 'reply', 'page 1', 'page 2']
+    stats = scheduler.stats()
+    assert stats['bulk_sent'] == 3 and stats['interactive_sent'] == 1
+    assert stats['queue_depth'] == 0
+    assert stats['bulk_max_wait_ms'] >= stats['interactive_max_wait_ms'] > 0
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_the_chat_and_resends():
+    scheduler = make_scheduler()
+    attempts = []
+
+    async def send():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) == 1:
+            raise RetryAfter(0.05)
+        return 'message'
+
+    result = await scheduler.process_request(
+        send, (), {}, 'sendPhoto', {'chat_id': 1}, None
+    )
+
+    assert result == 'message'
+    assert attempts[1] - attempts[0] >= 0.05
+    assert scheduler.stats()['retry_after'] == 1
+
+@pytest.mark.asyncio
+async def test_other_endpoints_are_not_queued():
+    scheduler = make_scheduler(chat_rate=0.001)
+
+    async def answer():
+        return True
+
+    for _ in range(5):
+        assert await scheduler.process_request(
+            answer, (), {}, 'answerCallbackQuery', {'callback_query_id': 'x'}, None
+        )
+    assert scheduler.stats()['interactive_sent'] == 0
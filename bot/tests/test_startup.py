@@ -0,0 +1,89 @@
+import asyncio
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+# Modules that must only load when a service is first used
+DEFERRED_MODULES = ('pymongo', 'boto3', 'botocore', 'bot.services.database', 'bot.services.storage')
+# Import time of our own modules, excluding third-party dependencies
+OWN_IMPORT_BUDGET_MS = 100
+
+def import_entry_points():
+    """Import the polling and Lambda entry points in a fresh interpreter.
+
+    Only PATH is passed on, so this also checks that importing needs no
+    secrets. Returns the imported module names and the -X importtime
+    self times in microseconds.
+    """
+    code = (
+        "import sys, bot.bot, bot.__main__, lambda_function\n"
+        "print('\\n'.join(sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=PROJECT_ROOT,
+        env={'PATH': os.environ.get('PATH', ''), 'PYTHONPATH': str(PROJECT_ROOT)},
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    self_times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            own, _, name = line[len('import time:'):].split('|')
+            if own.strip().isdigit():
+                self_times[name.strip()] = int(own)
+    return set(result.stdout.split()), self_times
+
+def test_entry_points_defer_heavy_imports():
+    modules, _ = import_entry_points()
+
+    assert not [name for name in DEFERRED_MODULES if name in modules]
+
+def test_own_import_time_within_budget():
+    _, self_times = import_entry_points()
+
+    own = sum(
+        micros for name, micros in self_times.items()
+        if name == 'bot' or name.startswith('bot.') or name == 'lambda_function'
+    )
+    assert own / 1000 < OWN_IMPORT_BUDGET_MS, sorted(self_times.items(), key=lambda x: -x[1])[:10]
+
+def test_failed_service_start_is_not_cached(monkeypatch):
+    from bot.services.storage import StorageService
+
+    def fail(self):
+        raise ValueError("S3_BUCKET_NAME is not set")
+
+    monkeypatch.setattr(StorageService, '_instance', None)
+    monkeypatch.setattr(StorageService, '_initialize', fail)
+    # The second call tries again instead of returning a half-built instance
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            StorageService()
+        assert StorageService._instance is None
+
+@pytest.mark.asyncio
+async def test_database_service_built_on_a_worker_thread_works_on_the_loop(monkeypatch):
+    from bot.services.database import DatabaseService
+
+    monkeypatch.setattr(DatabaseService, '_instance', None)
+    # check_health builds the singleton on a thread without an event loop
+    with ThreadPoolExecutor() as executor:
+        service = await asyncio.get_running_loop().run_in_executor(executor, DatabaseService)
+    try:
+        # Contended, so the lock has to bind to this loop
+        async with service._code_lock:
+            waiter = asyncio.create_task(service._code_lock.acquire())
+            await asyncio.sleep(0)
+        await waiter
+        service._code_lock.release()
+    finally:
+        service.client.close()
+        service.executor.shutdown()
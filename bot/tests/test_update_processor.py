@@ -0,0 +1,143 @@
+import asyncio
+import random
+import pytest
+from unittest.mock import AsyncMock, patch
+from telegram import Update
+from telegram.ext import (
+    ApplicationBuilder,
+    ExtBot,
+    ConversationHandler,
+    MessageHandler,
+    filters
+)
+
+from bot.services.update_processor import KeyedUpdateProcessor
+
+COLLECT = 1
+
+def make_update(bot, update_id, chat_id, user_id, text):
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'group'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Operator'},
+            'text': text,
+        }
+    }, bot)
+
+@pytest.mark.asyncio
+async def test_concurrent_conversations_do_not_cross_talk():
+    processor = KeyedUpdateProcessor(8)
+    application = ApplicationBuilder().token('123:abc').concurrent_updates(processor).build()
+    running = {'now': 0, 'peak': 0, 'keys': set()}
+    results = {}
+
+    async def step(update, context):
+        key = (update.effective_chat.id, update.effective_user.id)
+        assert key not in running['keys'], f"two updates of {key} ran at once"
+        running['keys'].add(key)
+        running['now'] += 1
+        running['peak'] = max(running['peak'], running['now'])
+        # Read, yield, then write back, as the item handlers do with user_data
+        items = list(context.user_data.get('items', []))
+        await asyncio.sleep(random.uniform(0, 0.003))
+        context.user_data['items'] = items + [update.message.text]
+        running['now'] -= 1
+        running['keys'].discard(key)
+
+    async def start(update, context):
+        context.user_data['items'] = []
+        return COLLECT
+
+    async def collect(update, context):
+        await step(update, context)
+        return COLLECT
+
+    async def done(update, context):
+        results[(update.effective_chat.id, update.effective_user.id)] = context.user_data['items']
+        return ConversationHandler.END
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    application.add_error_handler(on_error)
+    application.add_handler(ConversationHandler(
+        entry_points=[MessageHandler(filters.Regex('^start$'), start)],
+        states={COLLECT: [MessageHandler(filters.TEXT & ~filters.Regex('^done$'), collect)]},
+        fallbacks=[MessageHandler(filters.Regex('^done$'), done)],
+    ))
+
+    # Two group chats with three operators each, plus six private chats,
+    # all typing at once
+    keys = [(-chat, user_id) for chat in (1, 2) for user_id in range(3 * chat - 2, 3 * chat + 1)]
+    keys += [(user_id, user_id) for user_id in range(7, 13)]
+    scripts = {key: ['start'] + [f"{key}:{n}" for n in range(25)] + ['done'] for key in keys}
+    updates = []
+    positions = {key: 0 for key in keys}
+    while any(positions[key] < len(scripts[key]) for key in keys):
+        key = random.choice([key for key in keys if positions[key] < len(scripts[key])])
+        updates.append(make_update(application.bot, len(updates) + 1, *key, scripts[key][positions[key]]))
+        positions[key] += 1
+
+    # Feed the updates the way Application does: one task per update, in
+    # arrival order, each going through the update processor
+    with patch.object(ExtBot, 'get_me', AsyncMock()):
+        await application.initialize()
+    tasks = []
+    for update in updates:
+        tasks.append(asyncio.create_task(
+            processor.process_update(update, application.process_update(update))
+        ))
+    await asyncio.gather(*tasks)
+
+    assert errors == []
+    assert results == {key: scripts[key][1:-1] for key in keys}
+    assert 1 < running['peak'] <= 8
+    assert processor._locks == {}
+
+@pytest.mark.asyncio
+async def test_one_user_in_two_chats_is_handled_in_arrival_order():
+    processor = KeyedUpdateProcessor(8)
+    application = ApplicationBuilder().token('123:abc').concurrent_updates(processor).build()
+    handled = {}
+    busy = set()
+
+    async def record(update, context):
+        user_id = update.effective_user.id
+        assert user_id not in busy, f"two updates of user {user_id} ran at once"
+        busy.add(user_id)
+        # The draft in user_data is shared by all chats of a user
+        draft = list(context.user_data.get('draft', []))
+        await asyncio.sleep(random.uniform(0, 0.003))
+        context.user_data['draft'] = draft + [update.message.text]
+        handled.setdefault(user_id, []).append(update.message.text)
+        busy.discard(user_id)
+
+    application.add_handler(MessageHandler(filters.TEXT, record))
+
+    # User 1 types in a group and in their private chat, interleaved with
+    # user 2 in the same group
+    keys = [(-1, 1), (1, 1), (-1, 2)]
+    arrivals = keys * 20
+    random.shuffle(arrivals)
+    updates = [
+        make_update(application.bot, n + 1, chat_id, user_id, f"{chat_id}:{n}")
+        for n, (chat_id, user_id) in enumerate(arrivals)
+    ]
+
+    with patch.object(ExtBot, 'get_me', AsyncMock()):
+        await application.initialize()
+    await asyncio.gather(*(
+        asyncio.create_task(processor.process_update(update, application.process_update(update)))
+        for update in updates
+    ))
+
+    for user_id in (1, 2):
+        sent = [u.message.text for u in updates if u.effective_user.id == user_id]
+        assert handled[user_id] == sent
+        assert application.user_data[user_id]['draft'] == sent
+    assert processor._locks == {}
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from tornado.httpclient import AsyncHTTPClient
+
+import bot.__main__ as main
+from bot.services.webhook_server import SECRET_TOKEN_HEADER, WebhookServer
+
+UPDATE = {'update_id': 1, 'message': {
+    'message_id': 2, 'date': 0, 'chat': {'id': 3, 'type': 'private'}, 'text': '/list'
+}}
+
+@pytest.mark.asyncio
+async def test_updates_are_queued_only_with_the_secret_token():
+    application = MagicMock(bot=None)
+    application.update_queue = asyncio.Queue()
+    server = WebhookServer(application, '127.0.0.1', 0, 'telegram', 'secret')
+    server.start()
+    url = f'http://127.0.0.1:{server.port}/telegram'
+    client = AsyncHTTPClient()
+    body = json.dumps(UPDATE)
+
+    try:
+        refused = await client.fetch(url, method='POST', body=body, raise_error=False,
+                                     headers={SECRET_TOKEN_HEADER: 'wrong'})
+        accepted = await client.fetch(url, method='POST', body=body,
+                                      headers={SECRET_TOKEN_HEADER: 'secret'})
+    finally:
+        await server.stop()
+
+    assert refused.code == 403
+    assert accepted.code == 200
+    assert application.update_queue.get_nowait().update_id == 1
+    assert application.update_queue.empty()
+
+@pytest.mark.asyncio
+async def test_only_the_registering_replica_sets_the_webhook(monkeypatch):
+    monkeypatch.setattr(main, 'WEBHOOK_SECRET_TOKEN', 'secret')
+    monkeypatch.setattr(main, 'WEBHOOK_PORT', 0)
+    monkeypatch.setattr(main, 'WEBHOOK_LISTEN', '127.0.0.1')
+    application = MagicMock()
+    application.bot.set_webhook = AsyncMock()
+
+    for register in (False, True):
+        server = await main.start_updates(application, 'webhook', register_webhook=register)
+        await server.stop()
+
+    application.bot.set_webhook.assert_awaited_once()
+    assert application.bot.set_webhook.call_args.kwargs['drop_pending_updates'] is False
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency that is known to be down."""
+
+    def __init__(self, service, retry_in):
+        super().__init__(f"{service} is unavailable, next attempt in {retry_in:.0f}s")
+        self.service = service
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    """Fails calls to an unhealthy dependency fast instead of waiting for timeouts.
+
+    After ``failure_threshold`` consecutive failures for which
+    ``is_failure(error)`` is true the circuit opens and every call raises
+    CircuitOpenError at once. After ``reset_timeout`` seconds one call is let
+    through as a probe (half-open): if it succeeds the circuit closes, if it
+    fails the circuit opens again. Errors that are not failures, such as a
+    duplicate key, show that the dependency is answering and count as
+    successes.
+    """
+
+    def __init__(self, name, is_failure, failure_threshold, reset_timeout):
+        self.name = name
+        self.is_failure = is_failure
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may be made now."""
+        if self.state == CLOSED:
+            return
+        retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+        if self.state == OPEN and retry_in <= 0:
+            self.state = HALF_OPEN
+            logger.info(f"{self.name} circuit half-open, probing")
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(self.name, max(retry_in, 0))
+
+    def record(self, error=None):
+        """Record the outcome of a call let through by before_call."""
+        self._probing = False
+        if error is None or not self.is_failure(error):
+            if self.state != CLOSED:
+                logger.info(f"{self.name} circuit closed, service recovered")
+            self.state = CLOSED
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state == CLOSED:
+                self.times_opened += 1
+                logger.error(f"{self.name} circuit opened after {self.failures} failures: {error}")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.state != CLOSED
+
+    async def call(self, func, *args, **kwargs):
+        """Await ``func(*args, **kwargs)`` through the breaker."""
+        self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            # No outcome; let the next call probe instead
+            self._probing = False
+            raise
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record()
+        return result
+
+    def stats(self):
+        """Return the circuit state and counters."""
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened,
+            'rejected_calls': self.rejected,
+        }
@@ -1,27 +1,51 @@
 import logging
 import signal
+import sys
 from typing import Callable
-from bot.services.database import DatabaseService
-from bot.services.storage import StorageService
 
 logger = logging.getLogger(__name__)
 
+def _created_service(module_name, class_name):
+    """Return a service singleton if it was ever created, without creating it."""
+    module = sys.modules.get(module_name)
+    return getattr(module, class_name)._instance if module else None
+
 def cleanup_services():
     """Cleanup all services."""
     try:
         # Close MongoDB connection
-        db = DatabaseService()
-        db.close()
-        logger.info("MongoDB connection closed")
+        db = _created_service('bot.services.database', 'DatabaseService')
+        if db:
+            db.close()
+            logger.info("MongoDB connection closed")
     except Exception as e:
         logger.error(f"Error closing MongoDB connection: {e}")
 
+    try:
+        # Stop the S3 transfer pool
+        storage = _created_service('bot.services.storage', 'StorageService')
+        if storage:
+            storage.close()
+            logger.info("S3 transfer pool closed")
+    except Exception as e:
+        logger.error(f"Error closing S3 transfer pool: {e}")
+
+    try:
+        # Stop the photo processing pool
+        photos = _created_service('bot.services.photos', 'PhotoService')
+        if photos:
+            photos.close()
+            logger.info("Photo processing pool closed")
+    except Exception as e:
+        logger.error(f"Error closing photo processing pool: {e}")
+
 def setup_signal_handlers(stop_callback: Callable):
     """Setup signal handlers for graceful shutdown."""
     def signal_handler(signum, frame):
         sig_name = signal.Signals(signum).name
         logger.info(f"Received {sig_name} signal")
-        cleanup_services()
+        # Services are closed by the caller once it has shut down, as the
+        # shutdown itself may still need them (e.g. releasing the lease)
         if stop_callback:
             stop_callback()
 
@@ -21,4 +21,49 @@ def create_conversation_handler(
         per_chat=True,
         per_user=True,
         per_message=False  # Set to False to avoid message tracking issues
-    )
\ No newline at end of file
+    )
+
+# The python-telegram-bot release ConversationStates was checked against
+PTB_VERSION = '20.7'
+
+class ConversationStates:
+    """Reads and sets the in-memory state of persistent ConversationHandlers.
+
+    PTB has no public API to set a single conversation's state, which
+    replicas sharing conversations need (see MongoPersistence). All use of
+    its private attributes is kept here, and a test pinned to PTB_VERSION
+    fails on upgrade so this is checked again.
+    """
+
+    @staticmethod
+    def key(handler, update):
+        """Return the conversation key of an update, or None if it has none."""
+        if update.channel_post or update.edited_channel_post:
+            return None
+        key = []
+        if handler.per_chat:
+            if not update.effective_chat:
+                return None
+            key.append(update.effective_chat.id)
+        if handler.per_user:
+            if not update.effective_user:
+                return None
+            key.append(update.effective_user.id)
+        if handler.per_message:
+            query = update.callback_query
+            if not query or not (query.inline_message_id or query.message):
+                return None
+            key.append(query.inline_message_id or query.message.message_id)
+        return tuple(key)
+
+    @staticmethod
+    def get(handler, key):
+        return handler._conversations.get(key)
+
+    @staticmethod
+    def set(handler, key, state):
+        """Set a state loaded from storage, without marking it as changed."""
+        if state is None:
+            handler._conversations.data.pop(key, None)
+        else:
+            handler._conversations.update_no_track({key: state})
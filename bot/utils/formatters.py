@@ -1,34 +1,119 @@
-def format_item_caption(item):
-    """Format item details for display."""
-    caption = (
-        f"*Code:* {item.get('code', 'N/A')}\n"
-        f"*Name:* {item.get('name', 'N/A')}\n"
-        f"*Description:* {item.get('description', 'N/A')}\n"
-        f"*Wholesale Price:* {item.get('wholesalePrice', 'N/A')}\n"
-        f"*Selling Price:* {item.get('sellingPrice', 'N/A')}\n"
-    )
+from collections import OrderedDict
+from bot.config import CARD_CACHE_SIZE
+
+# Shown above results served from the last known data during an outage
+STALE_NOTICE = "⚠️ _The database is unavailable. This is the last known data and may be out of date._"
+
+# Telegram limits photo captions to 1024 characters
+CAPTION_LIMIT = 1024
+# Escaped characters shown of each header field before it is cut; together
+# they keep the header well within CAPTION_LIMIT
+DESCRIPTION_LIMIT = 300
+NAME_LIMIT = 100
+FIELD_LIMIT = 40
+# Characters with a meaning in Telegram's legacy Markdown
+MARKDOWN_CHARS = '_*`['
+MARKDOWN_SPECIAL = str.maketrans({char: '\\' + char for char in MARKDOWN_CHARS})
+
+# Rendered captions by (item _id, rev); a write bumps rev, so entries never
+# go stale and old revisions simply age out
+_captions = OrderedDict()
+_caption_stats = {'hits': 0, 'renders': 0}
+
+def escape_markdown(value):
+    """Escape a value for parse_mode='Markdown'; None becomes 'N/A'."""
+    if value is None:
+        return 'N/A'
+    return str(value).translate(MARKDOWN_SPECIAL)
+
+def escape_shortened(value, limit):
+    """Escape a value like escape_markdown, cut to at most ``limit`` characters.
+
+    The cut is made before escaping, so no escape is split.
+    """
+    text = escape_markdown(value)
+    if len(text) <= limit:
+        return text
+    value = str(value)
+    size = 0
+    for end, char in enumerate(value):
+        size += 2 if char in MARKDOWN_CHARS else 1
+        # Leave room for the ellipsis
+        if size > limit - 1:
+            break
+    return escape_markdown(value[:end]) + '…'
 
-    params = item.get('params', [])
-    if params:
-        params_text = "*Variants:*\n"
-        for param in params:
-            params_text += f"  - *Color:* {param.get('color', 'N/A')}\n"
-            stock = param.get('stock', [])
-            if stock:
-                params_text += "    *Stock:*\n"
-                for s in stock:
-                    params_text += (
-                        f"      - Size: {s.get('size', 'N/A')}, "
-                        f"Quantity: {s.get('quantity', 'N/A')}\n"
-                    )
-        caption += params_text
-
-    # Ensure caption length does not exceed limit
-    if len(caption) > 1024:
-        caption = caption[:1020] + '...'
+def format_item_caption(item):
+    """Return the Markdown caption of an Item, rendered once per revision.
 
+    Items without an _id, such as drafts, are rendered every time.
+    """
+    if item.id is None:
+        return render_item_caption(item)
+    key = (item.id, item.rev or 0)
+    caption = _captions.get(key)
+    if caption is not None:
+        _captions.move_to_end(key)
+        _caption_stats['hits'] += 1
+        return caption
+    caption = _captions[key] = render_item_caption(item)
+    _caption_stats['renders'] += 1
+    if len(_captions) > CARD_CACHE_SIZE:
+        _captions.popitem(last=False)
     return caption
 
+def render_item_caption(item):
+    """Render an Item's details, escaped and within CAPTION_LIMIT.
+
+    Long header fields are cut, so the header always fits. When the
+    variants do not, whole lines are dropped from the end and replaced by a
+    note, so no Markdown entity is ever cut in half.
+    """
+    lines = [
+        f"*Code:* {escape_shortened(item.code, FIELD_LIMIT)}",
+        f"*Name:* {escape_shortened(item.name, NAME_LIMIT)}",
+        f"*Description:* {escape_shortened(item.description, DESCRIPTION_LIMIT)}",
+        f"*Wholesale Price:* {escape_shortened(item.wholesale_price, FIELD_LIMIT)}",
+        f"*Selling Price:* {escape_shortened(item.selling_price, FIELD_LIMIT)}",
+    ]
+    header = len(lines)
+
+    if item.variants:
+        lines.append("*Variants:*")
+        for variant in item.variants:
+            lines.append(f"  - *Color:* {escape_markdown(variant.color)}")
+            if variant.stock:
+                lines.append("    *Stock:*")
+                lines.extend(
+                    f"      - Size: {escape_markdown(s.size)}, Quantity: {escape_markdown(s.quantity)}"
+                    for s in variant.stock
+                )
+
+    caption = '\n'.join(lines) + '\n'
+    if len(caption) <= CAPTION_LIMIT:
+        return caption
+
+    # Keep whole lines and leave room for the note
+    size = 0
+    for kept, line in enumerate(lines):
+        size += len(line) + 1
+        if size > CAPTION_LIMIT - 40:
+            break
+    # The header fits (see the field limits), so it is always shown
+    kept = max(kept, header)
+    note = f"_…{len(lines) - kept} more lines_"
+    return '\n'.join(lines[:kept] + [note]) + '\n'
+
+def caption_cache_statistics():
+    """Return the rendered caption cache counters."""
+    views = _caption_stats['hits'] + _caption_stats['renders']
+    return {
+        'entries': len(_captions),
+        'hits': _caption_stats['hits'],
+        'renders': _caption_stats['renders'],
+        'hit_rate': round(_caption_stats['hits'] / views, 3) if views else 0.0,
+    }
+
 def format_statistics(stats):
     """Format statistics for display."""
     message = (
@@ -42,4 +127,13 @@ def format_statistics(stats):
     for color in stats['colors']:
         message += f"- {color['_id']}: {color['count']} items\n"
     
-    return message
\ No newline at end of file
+    return message
+
+def format_metrics(sections):
+    """Format named groups of counters for display."""
+    message = "*Metrics*\n"
+    for title, counters in sections.items():
+        message += f"\n*{title}:*\n"
+        for name, value in counters.items():
+            message += f"- {name.replace('_', ' ')}: {value}\n"
+    return message
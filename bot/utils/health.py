@@ -1,14 +1,14 @@
 import logging
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-from bot.services.database import DatabaseService
-from bot.services.storage import StorageService
 from bot.config import MONGODB_TIMEOUT_MS, AWS_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
 def check_mongodb():
     """Check MongoDB connection."""
+    from bot.services.database import DatabaseService
+
     try:
         db = DatabaseService()
         db.client.admin.command('ping')
@@ -20,6 +20,8 @@ def check_mongodb():
 
 def check_s3():
     """Check S3 connection."""
+    from bot.services.storage import StorageService
+
     try:
         storage = StorageService()
         storage.s3.list_buckets()
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+from functools import wraps
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# operation -> counters, reported by retry_statistics()
+_stats = defaultdict(lambda: {'calls': 0, 'retries': 0, 'failures': 0})
+
+class RetryPolicy:
+    """When and how long to wait before trying a failed operation again.
+
+    Only errors for which ``is_transient(error)`` is true are retried; any
+    other error is raised at once. The wait before retry n is drawn
+    uniformly from 0 to min(max_delay, base_delay * 2**n) ("full jitter"),
+    so clients that failed together do not come back together. No retry is
+    started that could not finish its wait within ``deadline`` seconds of
+    the first attempt.
+    """
+
+    def __init__(self, name, is_transient, max_attempts, deadline,
+                 base_delay=0.1, max_delay=2.0):
+        self.name = name
+        self.is_transient = is_transient
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next_delay(self, attempt, started, error):
+        """Return the wait before the next attempt, or None to give up."""
+        if attempt >= self.max_attempts or not self.is_transient(error):
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if time.monotonic() + delay - started > self.deadline:
+            return None
+        return delay
+
+    def _failed(self, operation, attempt, started, error):
+        """Count a failed attempt and return the wait before the next one."""
+        stats = _stats[operation]
+        delay = self.next_delay(attempt, started, error)
+        if delay is None:
+            stats['failures'] += 1
+            if attempt > 1 or self.is_transient(error):
+                logger.warning(f"{operation} failed after {attempt} attempt(s): {error}")
+            return None
+        stats['retries'] += 1
+        logger.warning(
+            f"{operation} failed (attempt {attempt}/{self.max_attempts}), "
+            f"retrying in {delay:.2f}s: {error}"
+        )
+        return delay
+
+    def __call__(self, func: Callable) -> Callable:
+        """Decorate a function or coroutine function to retry under this policy."""
+        operation = f"{self.name} {func.__name__}"
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs) -> Any:
+                _stats[operation]['calls'] += 1
+                started = time.monotonic()
+                attempt = 0
+                while True:
+                    attempt += 1
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        delay = self._failed(operation, attempt, started, e)
+                        if delay is None:
+                            raise
+                    await asyncio.sleep(delay)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            _stats[operation]['calls'] += 1
+            started = time.monotonic()
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    delay = self._failed(operation, attempt, started, e)
+                    if delay is None:
+                        raise
+                time.sleep(delay)
+        return wrapper
+
+def retry_statistics():
+    """Return the calls, retries and failures of each operation that retried or failed."""
+    return {
+        operation: f"{stats['calls']} calls, {stats['retries']} retries, {stats['failures']} failed"
+        for operation, stats in sorted(_stats.items())
+        if stats['retries'] or stats['failures']
+    }
@@ -3,7 +3,8 @@
 # Create a temporary directory for the package
 mkdir -p package
 
-# Install dependencies
+# Install dependencies. Run this with the Lambda function's Python (3.11 or
+# newer), so compiled packages such as Pillow match its runtime
 pip install -r requirements.txt --target ./package
 
 # Copy our bot code
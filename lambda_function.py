@@ -1,36 +1,87 @@
+import asyncio
+import base64
+import hmac
 import json
-import os
-from bot.bot import Bot
+import logging
+import time
 
-# Initialize bot
-bot = Bot(
-    token=os.environ['TELEGRAM_BOT_TOKEN'],
-    mongodb_conn_string=os.environ['MONGODB_CONN_STRING'],
-    s3_bucket_name=os.environ['S3_BUCKET_NAME']
-)
+_import_started = time.perf_counter()
+
+from telegram import Update
+from bot.bot import create_application
+from bot.config import WEBHOOK_SECRET_TOKEN
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+# Everything below lives as long as the container. The PTB application, its
+# HTTP connection pool and the MongoDB/S3 clients are bound to this loop and
+# are reused by every warm invocation.
+loop = asyncio.new_event_loop()
+application = None
+
+async def get_application():
+    """Build and initialize the application on the first invocation only."""
+    global application
+    if application is None:
+        started = time.perf_counter()
+        app = await create_application(register_commands=False, shared_state=True)
+        await app.initialize()
+        application = app
+        logger.info(
+            f"Cold start: imports {IMPORT_SECONDS * 1000:.0f} ms, "
+            f"initialization {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+    return application
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body)
+    }
 
 def lambda_handler(event, context):
+    started = time.perf_counter()
+    cold = application is None
+
+    # Fail closed: without a configured secret nothing can be verified
+    if not WEBHOOK_SECRET_TOKEN:
+        logger.error("WEBHOOK_SECRET_TOKEN is not set, rejecting all requests")
+        return response(403, {'error': 'Forbidden'})
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    token = headers.get('x-telegram-bot-api-secret-token') or ''
+    if not hmac.compare_digest(token, WEBHOOK_SECRET_TOKEN):
+        logger.warning("Rejected request with a missing or wrong secret token")
+        return response(403, {'error': 'Forbidden'})
+
+    if not event.get('body'):
+        return response(400, {'error': 'No body in request'})
+
+    update_id = None
     try:
-        # Parse the incoming update
-        if 'body' not in event:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': 'No body in request'})
-            }
-
-        update = json.loads(event['body'])
-        
-        # Process the update
-        bot.process_update(update)
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps({'status': 'ok'})
-        }
-        
+        body = event['body']
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body)
+        data = json.loads(body)
+        update_id = data.get('update_id')
+
+        app = loop.run_until_complete(get_application())
+        update = Update.de_json(data, app.bot)
+        loop.run_until_complete(app.process_update(update))
+        # Lambda bypasses the update processor, so the state is written here,
+        # before returning: the container may be frozen right after, and
+        # another container may get the user's next update
+        loop.run_until_complete(app.persistence.save_shared_state(app))
+
+        return response(200, {'status': 'ok'})
+
     except Exception as e:
-        print(f"Error processing update: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        logger.error(f"Error processing update {update_id}: {e}", exc_info=True)
+        return response(500, {'error': str(e)})
+    finally:
+        logger.info(
+            f"Update {update_id} handled in {(time.perf_counter() - started) * 1000:.0f} ms "
+            f"({'cold' if cold else 'warm'})"
+        )